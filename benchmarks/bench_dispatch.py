@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""
+Per-message dispatch latency of module handlers through the worker pool
+
+Compares a trivial handler deferred to a worker thread against the same
+handler marked @nonblocking and run inline on the reactor.
+
+Usage: python -m benchmarks.bench_dispatch [messages]
+"""
+
+import sys
+import time
+
+from twisted.internet import defer, reactor
+
+from pyfibot.util.workerpool import WorkerPool, nonblocking
+
+
+def handle_privmsg(bot, user, channel, msg):
+    return msg.lower()
+
+
+inline_handle_privmsg = nonblocking(
+    lambda bot, user, channel, msg: handle_privmsg(bot, user, channel, msg)
+)
+
+
+@defer.inlineCallbacks
+def measure(pool, func, count):
+    latencies = []
+    for i in range(count):
+        start = time.perf_counter()
+        yield pool.run("module_bench.py", func, None, "user", "#chan", "Hello %d" % i)
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    return latencies
+
+
+def report(name, latencies):
+    median = latencies[len(latencies) // 2] * 1e6
+    p99 = latencies[int(len(latencies) * 0.99)] * 1e6
+    print("%-10s median %8.1f us   p99 %8.1f us" % (name, median, p99))
+
+
+@defer.inlineCallbacks
+def main(count):
+    pool = WorkerPool(max_per_module=4)
+    pool.start()
+    try:
+        report("threaded", (yield measure(pool, handle_privmsg, count)))
+        report("inline", (yield measure(pool, inline_handle_privmsg, count)))
+    finally:
+        reactor.stop()
+
+
+if __name__ == "__main__":
+    reactor.callWhenRunning(main, int(sys.argv[1]) if len(sys.argv) > 1 else 5000)
+    reactor.run()
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+URL extraction per line: the old grab() with a TLD list and per-character
+scanning against the current one
+
+Both run over the same synthetic chat log lines as bench_grab_many, and the
+urls they find are compared.
+
+Usage: python -m benchmarks.bench_grab [lines]
+"""
+
+import sys
+import time
+
+from pyfibot.util import pyfiurl
+from benchmarks.bench_grab_many import make_corpus
+
+OLD_TLDS = sorted(pyfiurl._countrycodes)
+
+
+def old_grab(txt, needScheme=True):
+    seekpos = 0
+    possibleUrls = []
+    while 1:
+        srch = pyfiurl.hostRe.search(txt, seekpos)
+        if not srch:
+            break
+        valid = False
+        if srch.group("host"):
+            if srch.group("ipv4"):
+                ip = [x for x in srch.group("ipv4").split(".") if int(x) > 255]
+                if ip == []:
+                    valid = True
+            elif srch.group("hostname"):
+                if srch.group("toplabel") in OLD_TLDS:
+                    valid = True
+            elif srch.group("ipv6"):
+                valid = True
+        if not valid:
+            seekpos = srch.end("host")
+            continue
+        s = srch.start("host")
+        e = srch.end("host")
+        if s > 1 and txt[s - 1] == "@":
+            s -= 1
+            while s >= 0 and txt[s] in pyfiurl.validUserinfoChars:
+                s -= 1
+            s += 1
+        schemeFound = False
+        for scheme in pyfiurl._schemes:
+            if txt[s - len(scheme) : s] == scheme:
+                s -= len(scheme)
+                schemeFound = True
+                break
+        if needScheme and not schemeFound:
+            seekpos = srch.end("host")
+            continue
+        while e < len(txt) and txt[e] in pyfiurl.validPathChars:
+            e += 1
+        ns = s
+        for v in [("<", ">"), ("(", ")"), ("{", "}"), ("[", "]"), '"', "'"]:
+            if isinstance(v, tuple):
+                sc, ec = v
+            else:
+                sc = ec = v
+            if txt[ns - len(sc) :].startswith(sc):
+                if txt[e - len(ec) :].startswith(ec):
+                    e -= len(ec)
+        possibleUrls.append(txt[s:e])
+        seekpos = e
+    return possibleUrls
+
+
+def run(func, lines):
+    start = time.perf_counter()
+    found = [func(line) for line in lines]
+    return (time.perf_counter() - start) / len(lines), found
+
+
+def main(count):
+    lines = make_corpus(count)
+    old_time, old_found = run(old_grab, lines)
+    new_time, new_found = run(pyfiurl.grab, lines)
+
+    print("old grab %8.2f us/line" % (old_time * 1e6))
+    print("new grab %8.2f us/line" % (new_time * 1e6))
+    print(
+        "urls %s (%d found)"
+        % (
+            "identical" if old_found == new_found else "DIFFER",
+            sum(len(urls) for urls in new_found),
+        )
+    )
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200000)
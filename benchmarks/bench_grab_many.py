@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+URL extraction throughput for log backfills: grab() per line against
+grab_many(), in one process and spread over several
+
+The corpus is synthetic chat log lines, a few percent of which contain urls.
+
+Usage: python -m benchmarks.bench_grab_many [lines] [processes]
+"""
+
+import os
+import sys
+import time
+import random
+
+from pyfibot.util.pyfiurl import grab, grab_many
+
+WORDS = (
+    "moi mitä kuuluu tänään ei mitään erikoista kahvi on loppu taas "
+    "the build is broken again and nobody knows why lol ok thanks bye "
+    "v1.2 klo 12.30 e.g. i.e. jne. ym."
+).split()
+URLS = [
+    "https://www.youtube.com/watch?v=dQw4w9WgXcQ",
+    "http://www.iltalehti.fi/uutiset/a/2015123120948917",
+    "https://github.com/lepinkainen/pyfibot/issues/1",
+    "https://en.wikipedia.org/wiki/Internet_Relay_Chat",
+]
+
+
+def make_corpus(count):
+    rng = random.Random(1)
+    lines = []
+    for _ in range(count):
+        words = [rng.choice(WORDS) for _ in range(rng.randint(2, 15))]
+        if rng.random() < 0.05:
+            words.insert(rng.randint(0, len(words)), rng.choice(URLS))
+        lines.append(" ".join(words))
+    return lines
+
+
+def measure(name, func, lines):
+    start = time.perf_counter()
+    found = sum(len(urls) for urls in func(lines))
+    elapsed = time.perf_counter() - start
+    print("%-22s %10.0f lines/s  (%d urls)" % (name, len(lines) / elapsed, found))
+
+
+def main(count, processes):
+    lines = make_corpus(count)
+    measure("grab", lambda lines: (grab(line) for line in lines), lines)
+    measure("grab_many", grab_many, lines)
+    measure(
+        "grab_many x%d" % processes,
+        lambda lines: grab_many(lines, processes=processes, chunksize=5000),
+        lines,
+    )
+
+
+if __name__ == "__main__":
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 200000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count() or 1,
+    )
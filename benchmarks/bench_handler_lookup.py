@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+Handler lookup in module_urltitle: fnmatch over every handler against GlobIndex
+
+The url corpus is built from the handler patterns themselves (wildcards
+filled in) mixed with urls for unrelated sites, which are the common case.
+
+Usage: python -m benchmarks.bench_handler_lookup [urls]
+"""
+
+import sys
+import time
+import random
+import fnmatch
+
+from pyfibot.modules import module_urltitle
+from pyfibot.util.globindex import GlobIndex
+
+
+def make_corpus(patterns, count):
+    rng = random.Random(1)
+    words = ["foo", "bar", "news", "blog", "video", "item", "123456", "a-b-c"]
+    urls = []
+    for i in range(count):
+        if rng.random() < 0.3:
+            url = rng.choice(patterns)
+            url = url.replace("http*", rng.choice(["http", "https"]))
+            url = url.replace("[?]", "?")
+            while "*" in url:
+                url = url.replace("*", rng.choice(words), 1)
+        else:
+            url = "https://%s.%s/%s/%s" % (
+                rng.choice(words),
+                rng.choice(["com", "fi", "org", "net"]),
+                rng.choice(words),
+                rng.choice(words),
+            )
+        urls.append(url)
+    return urls
+
+
+def linear(handlers, url):
+    return [ref for ref in handlers if fnmatch.fnmatch(url, ref.__doc__.split()[0])]
+
+
+def main(count):
+    handlers = [
+        ref
+        for name, ref in vars(module_urltitle).items()
+        if name.startswith("_handle_")
+    ]
+    patterns = [ref.__doc__.split()[0] for ref in handlers]
+    urls = make_corpus(patterns, count)
+
+    start = time.perf_counter()
+    index = GlobIndex((pattern, ref) for pattern, ref in zip(patterns, handlers))
+    build = time.perf_counter() - start
+
+    for name, lookup in (
+        ("fnmatch", lambda url: linear(handlers, url)),
+        ("index", index.match),
+    ):
+        start = time.perf_counter()
+        for url in urls:
+            lookup(url)
+        elapsed = time.perf_counter() - start
+        print("%-8s %8.2f us/url" % (name, elapsed / len(urls) * 1e6))
+    print("%d handlers, index built in %.2f ms" % (len(handlers), build * 1e3))
+
+    mismatches = sum(1 for url in urls if linear(handlers, url) != index.match(url))
+    print("%d of %d lookups differ" % (mismatches, len(urls)))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 50000)
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+Redundant title detection in module_urltitle: full matrix against bounded
+edit distance
+
+Runs _check_redundant over title/url pairs like the ones seen on channels,
+once with the old full-matrix Levenshtein and once with the bounded one,
+and checks that both make the same decisions.
+
+Usage: python -m benchmarks.bench_redundant [rounds]
+"""
+
+import sys
+import time
+
+from pyfibot.modules import module_urltitle
+
+PAIRS = [
+    (
+        "https://www.iltalehti.fi/kotimaa/a/2f1c3f62-1d7e-4c5b-9c1e-8a0b7e2f1a11",
+        "Hallitus esittää muutoksia työttömyysturvaan – tätä ne tarkoittavat",
+    ),
+    ("https://github.com/lepinkainen/pyfibot", "lepinkainen/pyfibot: Python IRC bot"),
+    ("https://www.python.org/", "Welcome to Python.org"),
+    (
+        "https://yle.fi/a/74-20012345",
+        "Ylen kysely: Suomalaisten luottamus poliisiin on edelleen korkealla",
+    ),
+    (
+        "https://www.theguardian.com/world/2024/jan/01/some-long-article-slug-about-news",
+        "Some long article slug about news | World news | The Guardian",
+    ),
+    (
+        "https://news.ycombinator.com/item?id=12345678",
+        "Show HN: A tiny database written in a weekend | Hacker News",
+    ),
+    ("https://example.com/foo-bar-baz", "Foo Bar Baz"),
+    (
+        "https://blog.example.org/2023/05/17/why-we-rewrote-everything-in-rust.html",
+        "Why we rewrote everything in Rust",
+    ),
+    (
+        "https://www.reddit.com/r/Suomi/comments/abc123/mikä_on_paras_pizzeria_helsingissä/",
+        "Mikä on paras pizzeria Helsingissä? : r/Suomi",
+    ),
+    (
+        "https://stackoverflow.com/questions/1/how-do-i-undo-the-most-recent-local-commits",
+        "git - How do I undo the most recent local commits in Git? - Stack Overflow",
+    ),
+]
+
+
+def old_levenshtein_distance(s, t, limit=None):
+    d = [[i] + [0] * len(t) for i in range(0, len(s) + 1)]
+    d[0] = [i for i in range(0, (len(t) + 1))]
+
+    for i in range(1, len(d)):
+        for j in range(1, len(d[i])):
+            if len(s) > i - 1 and len(t) > j - 1 and s[i - 1] == t[j - 1]:
+                d[i][j] = d[i - 1][j - 1]
+            else:
+                d[i][j] = min((d[i - 1][j] + 1, d[i][j - 1] + 1, d[i - 1][j - 1] + 1))
+
+    return d[len(s)][len(t)]
+
+
+def run(rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        decisions = [
+            module_urltitle._check_redundant(url, title) for url, title in PAIRS
+        ]
+    return (time.perf_counter() - start) / rounds / len(PAIRS), decisions
+
+
+def main(rounds):
+    bounded = module_urltitle._levenshtein_distance
+    try:
+        module_urltitle._levenshtein_distance = old_levenshtein_distance
+        old_time, old_decisions = run(rounds)
+    finally:
+        module_urltitle._levenshtein_distance = bounded
+    new_time, new_decisions = run(rounds)
+
+    print("full matrix %8.1f us/title" % (old_time * 1e6))
+    print("bounded     %8.1f us/title" % (new_time * 1e6))
+    print(
+        "decisions %s (%d of %d redundant)"
+        % (
+            "identical" if old_decisions == new_decisions else "DIFFER",
+            sum(new_decisions),
+            len(new_decisions),
+        )
+    )
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+PyFiBot.say throughput: TextWrapper against the byte-based splitter
+
+Sends typical replies (mostly short, some long, some Finnish) through say()
+once with the old TextWrapper and msg() based implementation and once with
+the current one. Lines are collected instead of being sent, so only the
+splitting and formatting is measured. Also counts lines that would be over
+the limit once the server adds our prefix.
+
+Usage: python -m benchmarks.bench_say [rounds]
+"""
+
+import sys
+import time
+import textwrap
+
+from twisted.words.protocols import irc
+
+from pyfibot import botcore
+from pyfibot.pyfibot import Network, PyFiBotFactory
+
+MESSAGES = [
+    "pong",
+    "Title: Welcome to Python.org",
+    "Title: lepinkainen/pyfibot: Python IRC bot [github.com]",
+    "Helsinki: 12.3°C, pilvistä, tuuli 4 m/s, kosteus 81%",
+    "Lähetys JJFI12345678 on toimitettu noutopisteeseen: K-Market Kallio, "
+    "Helsinginkatu 12, 00500 Helsinki",
+    "Title: Hallitus esittää muutoksia työttömyysturvaan – tätä ne tarkoittavat",
+    "Usage: join <channel>[@network] [password] - Join the specified channel",
+    " ".join(["Pitkä vastaus, jossa on ääkkösiä ja öljyä säästä."] * 12),
+    " ".join(["A long answer with a lot of words in it."] * 30),
+]
+
+
+def old_say(self, channel, message, length=None):
+    channel = self.factory.to_unicode(channel)
+    message = self.factory.to_unicode(message)
+    if "!" and "@" in channel:
+        channel = self.get_nick(channel)
+    msg = self.tw.wrap(message)
+    cont = False
+    for m in msg:
+        if cont:
+            m = "..." + m
+        self.msg(channel, m, length)
+        cont = True
+    return ("botcore.say", channel, message)
+
+
+def make_bot():
+    network = Network("data", "bench", ("localhost", 6667), "pyfibot")
+    bot = botcore.PyFiBot({}, network)
+    bot.factory = PyFiBotFactory({})
+    bot.supported = irc.ServerSupportedFeatures()
+    bot._update_max_line()
+    bot.tw = textwrap.TextWrapper(width=480, break_long_words=True)
+    bot.lines = []
+    bot.sendLine = bot.lines.append
+    return bot
+
+
+def run(bot, say, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for message in MESSAGES:
+            say(bot, "#pyfibot", message)
+    elapsed = time.perf_counter() - start
+    return rounds * len(MESSAGES) / elapsed
+
+
+def main(rounds):
+    bot = make_bot()
+    # Lines longer than max_line may be cut when relayed with our prefix
+    for name, say in (("textwrap", old_say), ("ircsplit", botcore.PyFiBot.say)):
+        bot.lines[:] = []
+        rate = run(bot, say, rounds)
+        lines = len(bot.lines) // rounds
+        over = sum(
+            len(line.encode("utf-8")) > bot.outgoing.max_line for line in bot.lines
+        )
+        print(
+            "%-8s %9.0f messages/s, %d lines per round, %d over %d bytes"
+            % (name, rate, lines, over // rounds, bot.outgoing.max_line)
+        )
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+Title extraction from recorded pages: BeautifulSoup against HeadParser
+
+Runs both extractors over every HTML response in tests/cassettes and reports
+parse time and peak memory per page. Pages are fed to HeadParser in chunks
+the way module_urltitle downloads them.
+
+Usage: python -m benchmarks.bench_title_extract [rounds]
+"""
+
+import os
+import sys
+import glob
+import gzip
+import time
+import logging
+import tracemalloc
+
+import yaml
+from bs4 import BeautifulSoup
+
+from pyfibot.util.htmlhead import HeadParser, charset_from_content_type
+
+CHUNK_SIZE = 8192
+CASSETTES = os.path.join(os.path.dirname(__file__), "..", "tests", "cassettes")
+
+
+def load_pages():
+    """Yield (name, body, content-type) for every HTML response in the cassettes"""
+    for path in sorted(glob.glob(os.path.join(CASSETTES, "*.yaml"))):
+        with open(path) as f:
+            cassette = yaml.load(f, Loader=yaml.UnsafeLoader)
+        for i, interaction in enumerate(cassette.get("interactions", [])):
+            response = interaction["response"]
+            headers = {k.lower(): v[0] for k, v in response["headers"].items()}
+            content_type = headers.get("content-type", "")
+            if not content_type.startswith("text/html"):
+                continue
+            body = response["body"]["string"]
+            if isinstance(body, str):
+                body = body.encode("utf-8", "surrogateescape")
+            if headers.get("content-encoding") == "gzip":
+                try:
+                    body = gzip.decompress(body)
+                except OSError:
+                    continue
+            name = "%s#%d" % (os.path.basename(path)[:-5], i)
+            yield name, body, content_type
+
+
+def with_bs(body, content_type):
+    bs = BeautifulSoup(body, "html.parser")
+    bs.find("meta", {"name": "fragment"})
+    og_title = bs.find("meta", {"property": "og:title"})
+    if og_title:
+        return og_title["content"]
+    title = bs.find("title")
+    return title.text if title else None
+
+
+def with_head_parser(body, content_type):
+    # Fed in chunks like module_urltitle does while downloading
+    head = HeadParser(charset_from_content_type(content_type))
+    for i in range(0, len(body), CHUNK_SIZE):
+        if head.feed_bytes(body[i : i + CHUNK_SIZE]):
+            break
+    head.close()
+    return head.og_title or head.title
+
+
+def measure(func, body, content_type, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        func(body, content_type)
+    elapsed = (time.perf_counter() - start) / rounds
+
+    tracemalloc.start()
+    func(body, content_type)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def main(rounds):
+    # bs4 complains about undecodable bytes in some of the recordings
+    logging.getLogger("bs4").setLevel(logging.ERROR)
+    print(
+        "%-32s %8s  %10s %10s  %10s %10s"
+        % ("page", "kB", "bs ms", "bs peak kB", "head ms", "head kB")
+    )
+    for name, body, content_type in load_pages():
+        bs_time, bs_peak = measure(with_bs, body, content_type, rounds)
+        head_time, head_peak = measure(with_head_parser, body, content_type, rounds)
+        if with_bs(body, content_type) != with_head_parser(body, content_type):
+            print("%s: extracted titles differ" % name)
+        print(
+            "%-32s %8.1f  %10.2f %10.1f  %10.2f %10.1f"
+            % (
+                name[:32],
+                len(body) / 1024,
+                bs_time * 1e3,
+                bs_peak / 1024,
+                head_time * 1e3,
+                head_peak / 1024,
+            )
+        )
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20)
@@ -14,10 +14,9 @@ from __future__ import print_function, division
 
 # twisted imports
 from twisted.words.protocols import irc
-from twisted.internet import reactor, threads
+from twisted.internet import reactor
 from twisted.python import rebuild
 
-from types import FunctionType
 from typing import Optional, Any, Dict, Tuple, TYPE_CHECKING
 
 if TYPE_CHECKING:
@@ -26,10 +25,10 @@ if TYPE_CHECKING:
 import inspect
 import string
 import logging
-from pyfibot.util import pyfiurl
+import threading
+from pyfibot.util import pyfiurl, outqueue, ircsplit
 
 # line splitting
-import textwrap
 
 __pychecker__ = "unusednames=i, classattr"
 
@@ -63,15 +62,13 @@ class CoreCommands(object):
                 log.info("rebuilding %r" % self)
                 rebuild.updateInstance(self)
 
-                # reload config file
+                # reload config file and modules
+                self.factory.rehash(conf=args == "conf")
                 if args == "conf":
-                    self.factory.reload_config()
                     self.say(channel, "Configuration reloaded.")
 
-                # unload removed modules
-                self.factory._unload_removed_modules()
-                # reload modules
-                self.factory._loadmodules()
+                # and in other worker processes
+                self.factory.broadcast("rehash", conf=args == "conf")
             except Exception as e:
                 self.say(channel, "Rehash error: %s" % e)
                 log.error("Rehash error: %s" % e)
@@ -80,7 +77,11 @@ class CoreCommands(object):
                 log.info("Rehash OK")
 
     def say(
-        self, channel: str, message: str, length: Optional[int] = None
+        self,
+        channel: str,
+        message: str,
+        length: Optional[int] = None,
+        priority: int = outqueue.REPLY,
     ) -> Tuple[str, str, str]:
         """Must be implemented by the inheriting class"""
         raise NotImplementedError
@@ -107,7 +108,11 @@ class CoreCommands(object):
         try:
             bot = self.factory.allBots[network]
         except KeyError:
-            self.say(channel, "I am not on that network.")
+            # the network may be run by another worker process
+            if self.factory.forward(network, "join", channel=newchannel, key=password):
+                self.say(channel, "Joining %s on %s." % (newchannel, network))
+            else:
+                self.say(channel, "I am not on that network.")
         else:
             log.debug("Attempting to join channel %s on ", (newchannel, network))
             if newchannel in bot.network.channels:
@@ -143,7 +148,11 @@ class CoreCommands(object):
         try:
             bot = self.factory.allBots[network]
         except KeyError:
-            self.say(channel, "I am not on that network.")
+            # the network may be run by another worker process
+            if newchannel and self.factory.forward(network, "part", channel=newchannel):
+                self.say(channel, "Leaving %s on %s." % (newchannel, network))
+            else:
+                self.say(channel, "I am not on that network.")
         else:
             # no arguments, attempt to part current channel
             if not newchannel:
@@ -239,9 +248,19 @@ class PyFiBot(irc.IRCClient, CoreCommands):
         self.realname = self.network.realname or self.realname
         self.lineRate = self.network.linerate
         self.password = self.network.password
-        # Text wrapper to clip overly long answers
-        # 510 is the spec maximum (512 - CRLF)
-        self.tw = textwrap.TextWrapper(width=480, break_long_words=True)
+        # Outgoing lines are queued per target and priority instead of
+        # Twisted's single queue, lineburst lines can be sent at once
+        network_conf = config.get("networks", {}).get(self.network.alias, {})
+        # With linecoalesce set, short messages to the same target are
+        # merged into fewer lines
+        self.outgoing = outqueue.OutgoingScheduler(
+            self.lineRate or 0,
+            network_conf.get("lineburst", config.get("lineburst", 1)),
+            coalesce=network_conf.get("linecoalesce", config.get("linecoalesce", 0)),
+        )
+        self._drain_call = None
+        # Priority of messages being sent by say() in the current thread
+        self._send_priority = threading.local()
         log.info("bot initialized")
 
     def __repr__(self):
@@ -258,11 +277,16 @@ class PyFiBot(irc.IRCClient, CoreCommands):
 
     def connectionMade(self):
         irc.IRCClient.connectionMade(self)
+        self._update_max_line()
         self.repeatingPing(300)
         log.info("connection made")
 
     def connectionLost(self, reason):
         irc.IRCClient.connectionLost(self, reason)
+        if self._drain_call is not None and self._drain_call.active():
+            self._drain_call.cancel()
+        self._drain_call = None
+        self.outgoing.clear()
         log.info("connection lost: %s", reason)
 
     def signedOn(self):
@@ -346,6 +370,12 @@ class PyFiBot(irc.IRCClient, CoreCommands):
     def getUrl(self, url, nocache=False, params=None, headers=None, cookies=None):
         return self.get_url(url, nocache, params, headers, cookies)
 
+    def fetch(self, url, params=None, headers=None):
+        return self.factory.fetch(url, params, headers)
+
+    def run_cpu(self, func, *args, timeout=None):
+        return self.factory.run_cpu(func, *args, timeout=timeout)
+
     def isAdmin(self, user):
         return self.factory.isAdmin(user)
 
@@ -410,51 +440,36 @@ class PyFiBot(irc.IRCClient, CoreCommands):
         # Run privmsg handlers
         self._runhandler("privmsg", user, reply, self.factory.to_unicode(msg))
 
-        # run URL handlers
+        # run URL handlers, most messages don't need the full url scan
+        stats = self.factory.url_scan_stats
+        stats["messages"] += 1
+        if not pyfiurl.may_contain_url(msg):
+            return
+        stats["scanned"] += 1
         urls = pyfiurl.grab(msg)
         if urls:
+            stats["with_urls"] += 1
             for url in urls:
                 self._runhandler("url", user, reply, url, self.factory.to_unicode(msg))
 
     def _runhandler(self, handler, *args, **kwargs):
         """Run a handler for an event"""
-        handler = "handle_%s" % handler
-        # module commands
-        for module, env in self.factory.ns.items():
-            myglobals, mylocals = env
-            # find all matching command functions
-            handlers = [
-                (h, ref)
-                for h, ref in mylocals.items()
-                if h == handler and isinstance(ref, FunctionType)
-            ]
-
-            for hname, func in handlers:
-                # defer each handler to a separate thread, assign callbacks to see when they end
-                d = threads.deferToThread(func, self, *args, **kwargs)
-                d.addCallback(self.printResult, "handler %s completed" % hname)
-                d.addErrback(self.printError, "handler %s error" % hname)
+        hname = "handle_%s" % handler
+        # module handlers, looked up from the factory's dispatch index
+        for module, func in self.factory.dispatch.get(hname, ()):
+            # run each handler in the worker pool, assign callbacks to see when they end
+            d = self.factory.workers.run(module, func, self, *args, **kwargs)
+            d.addCallback(self.printResult, "handler %s completed" % hname)
+            d.addErrback(self.printError, "handler %s error" % hname)
 
     def _runEvents(self, eventname, *args, **kwargs):
         """Run funtions on events named by eventname parameter"""
-        eventname = "event_%s" % eventname
-        for module, env in self.factory.ns.items():
-            myglobals, mylocals = env
-
-            # find all matching events
-            events = [
-                (h, ref)
-                for h, ref in mylocals.items()
-                if h == eventname and isinstance(ref, FunctionType)
-            ]
-
-            for ename, func in events:
-                # defer each handler to a separate thread, assign callbacks to see when they end
-                d = threads.deferToThread(func, self, *args, **kwargs)
-                d.addCallback(
-                    self.printResult, "%s %s event completed" % (module, ename)
-                )
-                d.addErrback(self.printError, "%s %s event error" % (module, ename))
+        ename = "event_%s" % eventname
+        for module, func in self.factory.dispatch.get(ename, ()):
+            # run each event in the worker pool, assign callbacks to see when they end
+            d = self.factory.workers.run(module, func, self, *args, **kwargs)
+            d.addCallback(self.printResult, "%s %s event completed" % (module, ename))
+            d.addErrback(self.printError, "%s %s event error" % (module, ename))
 
     def _command(self, user, channel, cmnd):
         """Handles bot commands.
@@ -480,57 +495,93 @@ class PyFiBot(irc.IRCClient, CoreCommands):
             return
 
         # module commands
-        for module, env in self.factory.ns.items():
-            myglobals, mylocals = env
-            # find all matching command functions
-            commands = [
-                (c, ref) for c, ref in mylocals.items() if c == "command_%s" % cmnd
-            ]
-            commands += [
-                (c, ref) for c, ref in mylocals.items() if c == "admin_%s" % cmnd
-            ]
-
-            for cname, command in commands:
-                if not self.factory.isAdmin(user) and cname.startswith("admin"):
-                    continue
-                i = inspect.getcallargs(command, self, user, channel, cmnd)
-                if "silent" not in i:
-                    log.info(
-                        "module command %s called by %s (%s) on %s"
-                        % (cname, user, self.factory.isAdmin(user), channel)
-                    )
-                # Defer commands to threads
-                d = threads.deferToThread(
-                    command, self, user, channel, self.factory.to_unicode(args.strip())
+        dispatch = self.factory.dispatch
+        commands = [
+            ("command_%s" % cmnd, c) for c in dispatch.get("command_%s" % cmnd, ())
+        ]
+        commands += [
+            ("admin_%s" % cmnd, c) for c in dispatch.get("admin_%s" % cmnd, ())
+        ]
+
+        for cname, (module, command) in commands:
+            if not self.factory.isAdmin(user) and cname.startswith("admin"):
+                continue
+            i = inspect.getcallargs(command, self, user, channel, cmnd)
+            if "silent" not in i:
+                log.info(
+                    "module command %s called by %s (%s) on %s"
+                    % (cname, user, self.factory.isAdmin(user), channel)
                 )
-                d.addCallback(self.printResult, "command %s completed" % cname)
-                d.addErrback(self.printError, "command %s error" % cname)
+            # Run commands in the worker pool
+            d = self.factory.workers.run(
+                module,
+                command,
+                self,
+                user,
+                channel,
+                self.factory.to_unicode(args.strip()),
+            )
+            d.addCallback(self.printResult, "command %s completed" % cname)
+            d.addErrback(self.printError, "command %s error" % cname)
 
     # Overrides for twisted.words.irc core commands #
+    def sendLine(self, line):
+        """Queue a line in the outgoing scheduler, may be called from any thread"""
+        if self.lineRate is None:
+            return self._reallySendLine(line)
+        priority = getattr(self._send_priority, "value", outqueue.REPLY)
+        if self.outgoing.push(line, priority):
+            reactor.callFromThread(self._drain)
+
+    def _update_max_line(self):
+        # Coalesced lines must fit when relayed with our nick!user@host prefix
+        self.outgoing.max_line = self._safeMaximumLineLength("") - 2
+
+    def _drain(self):
+        # Called early when a line can't wait for the scheduled call
+        if self._drain_call is not None and self._drain_call.active():
+            self._drain_call.cancel()
+        self._drain_call = None
+        delay = self.outgoing.drain(self._reallySendLine)
+        if delay is not None:
+            self._drain_call = reactor.callLater(delay, self._drain)
+
     def say(
-        self, channel: str, message: str, length: Optional[int] = None
+        self,
+        channel: str,
+        message: str,
+        length: Optional[int] = None,
+        priority: int = outqueue.REPLY,
     ) -> Tuple[str, str, str]:
-        """Override default say to make replying to private messages easier"""
+        """Override default say to make replying to private messages easier
+
+        Use priority outqueue.BULK for announcements and other output that
+        can wait for replies to commands."""
 
         # Ensure channel is a string
         # (for cases where channel is specified in code instead of "answering")
-        channel = self.factory.to_unicode(channel)
+        if not isinstance(channel, str):
+            channel = self.factory.to_unicode(channel)
         # Ensure all outgoing messages are strings
-        message = self.factory.to_unicode(message)
+        if not isinstance(message, str):
+            message = self.factory.to_unicode(message)
 
         # Change nick!user@host -> nick, since all servers don't support full hostmask messaging
         if "!" and "@" in channel:
             channel = self.get_nick(channel)
 
-        # wrap long text into suitable fragments
-        msg = self.tw.wrap(message)
-        cont = False
+        # split long text into lines that fit when relayed by the server,
+        # length includes the CRLF like in msg()
+        fmt = "PRIVMSG %s :" % channel
+        max_line = self.outgoing.max_line if length is None else length - 2
+        lines = ircsplit.split(message, max_line - len(fmt.encode("utf-8")))
 
-        for m in msg:
-            if cont:
-                m = "..." + m
-            self.msg(channel, m, length)
-            cont = True
+        self._send_priority.value = priority
+        try:
+            for line in lines:
+                self.sendLine(fmt + line)
+        finally:
+            self._send_priority.value = outqueue.REPLY
 
         return ("botcore.say", channel, message)
 
@@ -683,6 +734,7 @@ class PyFiBot(irc.IRCClient, CoreCommands):
     # Network = Quakenet -> do Q auth
     def isupport(self, options):
         log.info(self.network.alias + " SUPPORTS: " + ",".join(options))
+        self._update_max_line()
 
     def created(self, when):
         log.info(self.network.alias + " CREATED: " + when)
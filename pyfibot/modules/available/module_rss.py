@@ -1,11 +1,10 @@
 from __future__ import unicode_literals, print_function, division
-import feedparser
 import dataset
-from twisted.internet.reactor import callLater
-from threading import Thread
+import requests
+from twisted.internet.reactor import callLater, callFromThread
 import twisted.internet.error
 import logging
-
+from pyfibot.util import cpupool, outqueue, parsers
 
 logger = logging.getLogger("module_rss")
 DATABASE = None
@@ -79,13 +78,28 @@ def remove_feed(network, channel, id):
     return f
 
 
+def feed_fetched(r, feed):
+    """Update a feed from its response in the bot's worker pool"""
+    if not 200 <= r.status_code < 300:
+        logger.error('Feed "%s" update failed: HTTP %d' % (feed.name, r.status_code))
+        return
+    return botref.workers.run("module_rss.py", feed.update, r.content)
+
+
 def update_feeds(cancel=True, **kwargs):
     # from time import sleep
     """Update all feeds in the DB"""
     global updater
     logger.info("Updating RSS feeds started")
     for f in get_feeds(**kwargs):
-        Thread(target=f.update).start()
+        # Download without tying up a thread, only parsing is done in one
+        d = botref.fetch(f.url)
+        d.addCallback(feed_fetched, f)
+        d.addErrback(
+            lambda failure, f=f: logger.error(
+                'Feed "%s" update failed: %s' % (f.name, failure.getErrorMessage())
+            )
+        )
 
     # If we get a cancel, cancel the existing updater
     # and start a new one
@@ -159,7 +173,8 @@ def command_rss(bot, user, channel, args):
     if command == "update":
         if len(args) < 2:
             bot.say(channel, "feeds updating")
-            update_feeds()
+            # commands run in a worker thread, fetching is done on the reactor
+            callFromThread(update_feeds)
             return
         feed = find_feed(network, channel, id=int(args[1]))
         if not feed:
@@ -217,13 +232,33 @@ class Feed(object):
         """Get table for feeds items"""
         return DATABASE[("items_%i" % (self.id))]
 
-    def __parse_feed(self):
-        """Parse items from feed"""
-        f = feedparser.parse(self.url)
+    def __parse_feed(self, content=None):
+        """Parse items from feed, downloading it unless content is given"""
+        if content is None:
+            content = self.__download()
+            if content is None:
+                logger.warning('Downloading feed "%s" failed' % (self.url))
+                return ("", [])
+        if botref:
+            try:
+                title, items = botref.run_cpu(parsers.parse_feed, content)
+            except cpupool.PoolFull:
+                title, items = parsers.parse_feed(content)
+        else:
+            title, items = parsers.parse_feed(content)
         if self.initialized:
-            self.update_feed_info({"name": f["channel"]["title"]})
-        items = [{"title": i["title"], "link": i["link"]} for i in f["items"]]
-        return (f, items)
+            self.update_feed_info({"name": title})
+        return (title, items)
+
+    def __download(self):
+        """Download the feed document, None if that failed"""
+        if botref:
+            r = botref.get_url(self.url)
+        else:
+            r = requests.get(self.url)
+        if r is None or not r.ok:
+            return None
+        return r.content
 
     def __save_item(self, item, table=None):
         """Save item to feeds database"""
@@ -287,9 +322,9 @@ class Feed(object):
         # Update self to match new...
         self._get_feed_from_db()
 
-    def read(self):
+    def read(self, content=None):
         """Read new items from feed"""
-        f, items = self.__parse_feed()
+        f, items = self.__parse_feed(content)
         # Get table -reference to speed up stuff...
         tbl = self.__get_items_tbl()
         # Save items in DB, saving takes care of duplicate checks
@@ -308,7 +343,7 @@ class Feed(object):
                 self.__mark_printed(i, tbl)
         return items
 
-    def update(self):
+    def update(self, content=None):
         # If botref isn't defined, bot isn't running, no need to run
         # (used for tests?)
         if not botref:
@@ -316,7 +351,7 @@ class Feed(object):
 
         # Read all items for feed
         logger.debug('Feed "%s" updating' % (self.name))
-        self.read()
+        self.read(content)
         # Get number of unprinted items (and don't mark as printed)
         items = self.get_new_items(False)
 
@@ -337,7 +372,7 @@ class Feed(object):
         # Get all new (not printed) items and print them
         items = self.get_new_items(True)
         for i in items:
-            bot_instance.say(self.channel, self.get_item_str(i))
+            bot_instance.say(self.channel, self.get_item_str(i), priority=outqueue.BULK)
 
 
 if __name__ == "__main__":
@@ -2,11 +2,13 @@
 
 from __future__ import unicode_literals, print_function, division
 from twisted.internet import reactor
+from pyfibot.util.workerpool import nonblocking
 
 # rejoin after 1 minute
 delay = 61
 
 
+@nonblocking
 def handle_kickedFrom(bot, channel, kicker, message):
     """Rejoin channel after 60 seconds"""
     bot.log("Kicked by %s from %s. Reason: %s" % (kicker, channel, message))
@@ -1,6 +1,7 @@
 """ """
 
 from __future__ import unicode_literals, print_function, division
+from pyfibot.util.workerpool import nonblocking
 
 
 def calc_bmi(height, weight):
@@ -26,6 +27,7 @@ def print_bmi(bmi):
     return "your bmi is %.2f which is %s" % (bmi, weight_category)
 
 
+@nonblocking
 def command_bmi(bot, user, channel, args):
     """Calculates your body mass index. Usage: bmi height(cm)/weight(kg)"""
     data = args.split("/")
@@ -1,8 +1,11 @@
 # -*- encoding: utf-8 -*-
 from __future__ import unicode_literals, print_function, division
 from datetime import datetime, timedelta
-from bs4 import BeautifulSoup
-from math import isnan
+import logging
+
+from pyfibot.util import cpupool, parsers
+
+log = logging.getLogger("fmi")
 
 global default_place
 default_place = "Helsinki"
@@ -93,25 +96,16 @@ def command_saa(bot, user, channel, args):
     }
 
     r = bot.get_url("http://opendata.fmi.fi/wfs", params=params)
-    bs = BeautifulSoup(r.text)
-
-    # Get FMI name, gives the observation place more accurately
     try:
-        place = bs.find("gml:name").text
-    except AttributeError:
+        place, values = bot.run_cpu(parsers.parse_fmi_observations, r.text)
+    except cpupool.PoolFull:
+        place, values = parsers.parse_fmi_observations(r.text)
+    except TimeoutError:
+        log.warning("Parsing the FMI response timed out")
+        return
+    if place is None:
         return bot.say(channel, "Paikkaa ei löytynyt.")
 
-    # Loop through measurement time series -objects and gather values
-    values = {}
-    for mts in bs.find_all("wml2:measurementtimeseries"):
-        # Get the identifier from mts-tag
-        target = mts["gml:id"].split("-")[-1]
-        # Get last value from measurements (always sorted by time)
-        value = float(mts.find_all("wml2:value")[-1].text)
-        # NaN is returned, if observation doesn't exist
-        if not isnan(value):
-            values[target] = value
-
     # Build text from values found
     text = []
     if "t2m" in values:
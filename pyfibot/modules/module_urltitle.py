@@ -18,23 +18,42 @@ from datetime import datetime, timedelta
 from dateutil.tz import tzutc
 from dateutil.parser import parse as parse_datetime
 
-from repoze.lru import ExpiringLRUCache
-
 from bs4 import BeautifulSoup
 
+from pyfibot.util import cpupool, parsers, titlecache
+from pyfibot.util.globindex import GlobIndex, GlobSet
+from pyfibot.util.singleflight import SingleFlight
+from pyfibot.util.urlcanon import canonicalize
+from pyfibot.util.htmlhead import HeadParser, charset_from_content_type
+
 logging.getLogger("urllib3").setLevel(logging.WARNING)
 
 log = logging.getLogger("urltitle")
 config = None
 bot = None
 handlers = []
+handler_index = GlobIndex()
+ignored_urls = GlobSet()
+ignored_users = GlobSet()
 
 TITLE_LAG_MAXIMUM = 10
+# Stop reading a page after this many bytes when only the <head> is needed
+HEAD_MAX_BYTES = 64 * 1024
+# Unless no title has been found by then, same as get_url's size limit
+BODY_MAX_BYTES = 2048 * 1024
 
-# Caching for url titles
+# Caching for url titles, the cache outlives rehashes and is configured in init
+cache_size = 1000
 cache_timeout = 300  # 300 second timeout for cache
-cache = ExpiringLRUCache(10, cache_timeout)
+cache = titlecache.shared("urltitle", cache_size, cache_timeout)
 CACHE_ENABLED = True
+# Urls that didn't point to a page with a title, not fetched again for a while
+skipped_timeout = 600
+skipped = titlecache.shared("urltitle_skipped", cache_size, skipped_timeout)
+# Title lookups in progress
+inflight = SingleFlight()
+# Number of urls whose cache key differed from the url itself
+canonicalized = 0
 
 
 def init(botref):
@@ -43,14 +62,71 @@ def init(botref):
     global config
     global bot
     global handlers
+    global handler_index
+    global ignored_urls
+    global ignored_users
     bot = botref
     config = bot.config.get("module_urltitle", {})
+    cache.configure(
+        config.get("cache_size", cache_size),
+        config.get("cache_ttl", cache_timeout),
+        config.get("cache_path"),
+    )
     # load handlers in init, as the data doesn't change between rehashes anyways
     handlers = [(h, ref) for h, ref in globals().items() if h.startswith("_handle_")]
+    # the url pattern is the first word of the handler's docstring
+    handler_index = GlobIndex((ref.__doc__.split()[0], (h, ref)) for h, ref in handlers)
+    # hack, support both ignore and ignore_urls for a while
+    ignored_urls = GlobSet(config.get("ignore", []) + config.get("ignore_urls", []))
+    ignored_users = GlobSet(config.get("ignore_users", []))
+
 
+def __has_title(data, parser):
+    """Whether a title has been found in the beginning of a page"""
+    if parser is not None:
+        return parser.title is not None or parser.og_title is not None
+    return re.search(b"<title", data, re.I) is not None
 
-def __get_bs(bot, url):
-    """Attempt to get a beautifulsoup object for the given url"""
+
+def __read_head(r, max_bytes=HEAD_MAX_BYTES, parser=None, limit=BODY_MAX_BYTES):
+    """Read the response body up to </head>
+
+    Reading stops at max_bytes if a title has been found by then, some pages
+    have heads longer than that, and at limit in any case. If a HeadParser is
+    given, chunks are fed to it as they arrive and reading stops as soon as it
+    has seen the whole head. Pages without a title in the head are read
+    further, for a parser looking for one in the whole document."""
+
+    # Body already read (cached response), go through it the same way
+    if r._content_consumed:
+        content = r.content
+        chunks = (content[i : i + 8192] for i in range(0, len(content), 8192))
+    else:
+        chunks = r.iter_content(chunk_size=8192)
+
+    data = b""
+    head_done = False
+    try:
+        for chunk in chunks:
+            # only look for the closing tag in the new data (and a tag split over chunks)
+            start = max(0, len(data) - 6)
+            data += chunk
+            if parser is not None and parser.feed_bytes(chunk):
+                head_done = True
+            if re.search(b"</head", data[start:], re.I):
+                head_done = True
+            if len(data) >= limit:
+                break
+            if (head_done or len(data) >= max_bytes) and __has_title(data, parser):
+                break
+    finally:
+        # release the connection without reading the rest of the page
+        r.close()
+    return data[:limit]
+
+
+def __get_response(bot, url):
+    """Fetch url, returning the response only if it's a page we can parse"""
 
     # Fetch the content and measure how long it took
     start = datetime.now()
@@ -71,26 +147,69 @@ def __get_bs(bot, url):
     content_type = r.headers.get("content-type", "").split(";")[0]
     if content_type not in ["text/html", "text/xml", "application/xhtml+xml"]:
         log.debug("Content-type %s not parseable", content_type)
+        skipped.put(url, content_type)
+        return None
+
+    return r
+
+
+def __get_bs(bot, url, head_only=False):
+    """Attempt to get a beautifulsoup object for the given url
+
+    With head_only, only the beginning of the page up to </head> is
+    downloaded and parsed."""
+
+    r = __get_response(bot, url)
+    if not r:
         return None
 
-    if r.content:
-        return BeautifulSoup(r.content, "html.parser")
+    content = __read_head(r) if head_only else r.content
+    if content:
+        return BeautifulSoup(content, "html.parser")
     else:
         return None
 
 
+def __get_head(bot, url):
+    """Get title, og:title and fragment meta of the given url as a HeadParser
+
+    The head is tokenized as it's downloaded, without building a document
+    tree. BeautifulSoup is only used if no title could be found that way, on
+    the rest of the page as well."""
+
+    r = __get_response(bot, url)
+    if not r:
+        return None
+
+    parser = HeadParser(charset_from_content_type(r.headers.get("content-type")))
+    content = __read_head(r, parser=parser)
+    if not content:
+        return None
+    parser.close()
+
+    if parser.title is None and parser.og_title is None:
+        log.debug("No title found in head, falling back to BeautifulSoup")
+        try:
+            head = bot.run_cpu(parsers.parse_head, content)
+        except cpupool.PoolFull:
+            log.debug("Process pool full, parsing %s in this thread", url)
+            head = parsers.parse_head(content)
+        except TimeoutError:
+            log.warning("Parsing %s timed out", url)
+            return None
+        parser.title, parser.og_title, parser.fragment = head
+
+    return parser
+
+
 def __get_title_tag(url):
     """Get the plain title tag for the site"""
 
-    bs = __get_bs(bot, url)
-    if not bs:
+    head = __get_head(bot, url)
+    if not head:
         return False
 
-    title = bs.find("title")
-    if not title:
-        return
-
-    return title.text
+    return head.title
 
 
 def __get_length_str(secs):
@@ -185,9 +304,30 @@ def __escaped_fragment(url, meta=False):
     return urlparse.urlunsplit((url.scheme, url.netloc, url.path, query, ""))
 
 
+def __handler_ttl(handler):
+    """Cache TTL configured for a title handler, None for the default"""
+    name = handler[len("_handle_") :]
+    for pattern, ttl in config.get("cache_ttl_handlers", {}).items():
+        if fnmatch.fnmatch(name, pattern):
+            return ttl
+    return None
+
+
 def command_cache(bot, user, channel, args):
-    """Enable or disable url title caching"""
+    """Enable or disable url title caching, "cache stats" shows cache statistics"""
     global CACHE_ENABLED
+    if args.strip() == "stats":
+        stats = cache.stats()
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = 100.0 * stats["hits"] / lookups if lookups else 0.0
+        stats["canonicalized"] = canonicalized
+        bot.say(
+            channel,
+            "Cache: %(entries)d titles, %(hits)d hits, %(misses)d misses "
+            "(%(hit_rate).1f%% hit rate), %(evictions)d evictions, "
+            "%(canonicalized)d urls canonicalized" % stats,
+        )
+        return
     if bot.isAdmin(user):
         CACHE_ENABLED = not CACHE_ENABLED
         # cache was just disabled, clear it
@@ -200,6 +340,7 @@ def command_cache(bot, user, channel, args):
 
 def handle_url(bot, user, channel, url, msg):
     """Handle urls"""
+    global canonicalized
 
     if not url or not isinstance(url, str):
         return
@@ -215,49 +356,64 @@ def handle_url(bot, user, channel, url, msg):
     if channel.lstrip("#") in config.get("disable", ""):
         return
 
-    # hack, support both ignore and ignore_urls for a while
-    for ignore in config.get("ignore", []):
-        if fnmatch.fnmatch(url, ignore):
-            log.info("Ignored URL: %s %s", url, ignore)
-            return
-    for ignore in config.get("ignore_urls", []):
-        if fnmatch.fnmatch(url, ignore):
-            log.info("Ignored URL: %s %s", url, ignore)
-            return
-    for ignore in config.get("ignore_users", []):
-        if fnmatch.fnmatch(user, ignore):
-            log.info("Ignored url from user: %s, %s %s", user, url, ignore)
-            return
+    ignore = ignored_urls.match(url)
+    if ignore is not None:
+        log.info("Ignored URL: %s %s", url, ignore)
+        return
+    ignore = ignored_users.match(user)
+    if ignore is not None:
+        log.info("Ignored url from user: %s, %s %s", user, url, ignore)
+        return
 
     # Parse shebang fragments according to Google's specification
     if url.rfind("#!") != -1:
         url = __escaped_fragment(url)
 
+    # Titles are cached under the canonical url, so differently written links
+    # to the same page share the entry
+    key = canonicalize(url)
+    if key != url:
+        canonicalized += 1
+
     # Check if the url already has a title cached
     if CACHE_ENABLED:
-        title = cache.get(url)
+        title = cache.get(key)
         if title:
             log.debug("Cache hit")
             return _title(bot, channel, title, True)
 
+    # Resolve the title only once when the same url is posted to several
+    # channels at the same time
+    found = inflight.do(key, __find_title, user, channel, url)
+    if found:
+        return _title(bot, channel, key=key, **found)
+
+
+def __find_title(user, channel, url):
+    """Find the title for url with a site handler or the generic one
+
+    Returns keyword arguments for _title, or None if there's nothing to say"""
+
     # try to find a specific handler for the URL
-    for handler, ref in handlers:
-        pattern = ref.__doc__.split()[0]
-        if fnmatch.fnmatch(url, pattern):
-            title = ref(url)
-            if title is False:
-                log.debug("Title disabled by handler.")
-                return
-            elif title is None:
-                # Handler found, but suggests using the default title instead
-                break
-            elif title:
-                log.info("Found specific handler for %s" % url)
-                # handler found, abort
-                return _title(bot, channel, title, True, url=url)
-            else:
-                # No specific handler, use generic
-                pass
+    for handler, ref in handler_index.match(url):
+        title = ref(url)
+        if title is False:
+            log.debug("Title disabled by handler.")
+            return
+        elif title is None:
+            # Handler found, but suggests using the default title instead
+            break
+        elif title:
+            log.info("Found specific handler for %s" % url)
+            # handler found, abort
+            return {
+                "title": title,
+                "smart": True,
+                "ttl": __handler_ttl(handler),
+            }
+        else:
+            # No specific handler, use generic
+            pass
 
     # post data to Lambda if enabled
     if config.get("lambda_enable", False):
@@ -280,37 +436,35 @@ def handle_url(bot, user, channel, url, msg):
         else:
             log.debug(data)
 
-        _title(bot, channel, data.get("title"))
+        return {"title": data.get("title")}
 
+    log.debug("No specific handler found, using generic")
+    if skipped.get(url):
+        log.debug("Not a page, skipping %s", url)
         return
 
-    log.debug("No specific handler found, using generic")
     # Fall back to generic handler
-    bs = __get_bs(bot, url)
+    head = __get_head(bot, url)
 
     # Handle case of failed connection
-    if not bs:
-        log.debug("No BS available, returning")
+    if not head:
+        log.debug("No page head available, returning")
         return
 
-    # According to Google's Making AJAX Applications Crawlable specification
-    fragment = bs.find("meta", {"name": "fragment"})
-    if fragment and fragment.get("content") == "!":
+    # According to Google's Making AJAX Applications Crawlable specification.
+    # The title is still cached under the url that was posted.
+    if head.fragment == "!":
         log.debug("Fragment meta tag on page, getting non-ajax version")
-        url = __escaped_fragment(url, meta=True)
-        bs = __get_bs(bot, url)
+        head = __get_head(bot, __escaped_fragment(url, meta=True))
+        if not head:
+            return
 
     # Try and get title meant for social media first, it's usually fairly accurate
-    title = bs.find("meta", {"property": "og:title"})
+    title = head.og_title or head.title
+    # no title attribute
     if not title:
-        title = bs.find("title")
-        # no title attribute
-        if not title:
-            log.debug("No title found, returning")
-            return
-        title = title.text
-    else:
-        title = title["content"]
+        log.debug("No title found, returning")
+        return
 
     try:
         # remove trailing spaces, newlines, linefeeds and tabs
@@ -335,7 +489,7 @@ def handle_url(bot, user, channel, url, msg):
             return
 
         # Return title
-        return _title(bot, channel, title, url=url)
+        return {"title": title}
 
     except AttributeError:
         # TODO: Nees a better way to handle this. Happens with empty <title> tags
@@ -379,46 +533,72 @@ def _check_redundant(url, title):
 
     parts = cmp_url.lower().rsplit("/")
 
-    distances = []
+    # Largest distance still considered redundant for this title length
+    if len(title) < 20:
+        limit = 4
+    elif len(title) <= 30:
+        limit = 9
+    elif len(title) <= 60:
+        limit = 21
+    else:
+        limit = 36
+
     for part in parts:
         if part.rfind(".") != -1:
             part = part[: part.rfind(".")]
-        distances.append(_levenshtein_distance(part, cmp_title))
-
-    if len(title) < 20 and min(distances) < 5:
-        return True
-    elif len(title) >= 20 and len(title) <= 30 and min(distances) < 10:
-        return True
-    elif len(title) > 30 and len(title) <= 60 and min(distances) <= 21:
-        return True
-    elif len(title) > 60 and min(distances) < 37:
-        return True
+        if _levenshtein_distance(part, cmp_title, limit) <= limit:
+            return True
     return False
 
 
-def _levenshtein_distance(s, t):
-    d = [[i] + [0] * len(t) for i in range(0, len(s) + 1)]
-    d[0] = [i for i in range(0, (len(t) + 1))]
-
-    for i in range(1, len(d)):
-        for j in range(1, len(d[i])):
-            if len(s) > i - 1 and len(t) > j - 1 and s[i - 1] == t[j - 1]:
-                d[i][j] = d[i - 1][j - 1]
+def _levenshtein_distance(s, t, limit=None):
+    """Edit distance between s and t
+
+    With limit, gives up as soon as the distance is known to be larger and
+    returns limit + 1. Only cells within limit of the diagonal are computed."""
+
+    # t is the shorter one
+    if len(s) < len(t):
+        s, t = t, s
+    if limit is None:
+        limit = len(s)
+    if len(s) - len(t) > limit:
+        return limit + 1
+
+    over = limit + 1
+    previous = [j if j <= limit else over for j in range(len(t) + 1)]
+    for i in range(1, len(s) + 1):
+        c = s[i - 1]
+        current = [over] * (len(t) + 1)
+        if i <= limit:
+            current[0] = i
+        lowest = current[0]
+        for j in range(max(1, i - limit), min(len(t), i + limit) + 1):
+            if c == t[j - 1]:
+                value = previous[j - 1]
             else:
-                d[i][j] = min((d[i - 1][j] + 1, d[i][j - 1] + 1, d[i - 1][j - 1] + 1))
+                value = min(previous[j - 1], previous[j], current[j - 1]) + 1
+            if value > over:
+                value = over
+            current[j] = value
+            if value < lowest:
+                lowest = value
+        if lowest > limit:
+            return over
+        previous = current
 
-    return d[len(s)][len(t)]
+    return previous[len(t)]
 
 
-def _title(bot, channel, title, smart=False, prefix=None, url=None):
-    """Say title to channel"""
+def _title(bot, channel, title, smart=False, prefix=None, key=None, ttl=None):
+    """Say title to channel, caching it under key if given"""
 
     if not title:
         return
 
-    if url is not None:
+    if key is not None and CACHE_ENABLED:
         # Cache title
-        cache.put(url, title)
+        cache.put(key, title, ttl)
 
     if not prefix:
         prefix = "Title:"
@@ -12,20 +12,33 @@ A modular python bot based on the twisted matrix irc library
 
 from __future__ import print_function, division
 from typing import Dict, Any, Optional, List, Tuple
+from types import FunctionType
 import sys
 import os.path
 import time
 import fnmatch
+import urllib.parse
 import logging
 import requests
+import requests.adapters
 import logging.handlers
 import json
 import jsonschema
 from copy import deepcopy
 import argparse
+import signal
 
 from pyfibot import botcore
 from pyfibot.util.dictdiffer import DictDiffer
+from pyfibot.util.workerpool import WorkerPool
+from pyfibot.util.cpupool import CPUPool
+from pyfibot.util.httpcache import HTTPCache
+from pyfibot.util.asynchttp import AsyncHTTPClient
+from pyfibot.util.circuitbreaker import CircuitBreaker
+from pyfibot.util.titlecache import TitleCache
+from pyfibot.util.dnscache import DNSCache
+from pyfibot.util.reconnect import Backoff, NetworkHealth
+from pyfibot.supervisor import ControlChannel, Supervisor, CONTROL_IN, CONTROL_OUT
 import socket
 
 from pyfibot import colorlogger
@@ -74,6 +87,7 @@ class Network(object):
         linerate: Optional[float] = None,
         password: Optional[str] = None,
         is_ssl: bool = False,
+        servers: Optional[List[Tuple[str, int]]] = None,
     ) -> None:
         self.root = root
         self.alias = alias  # network name
@@ -84,6 +98,8 @@ class Network(object):
         self.linerate = linerate
         self.password = password
         self.is_ssl = is_ssl
+        # servers to rotate through when connecting fails, address is the current one
+        self.servers: List[Tuple[str, int]] = servers or [address]
 
     def __repr__(self):
         return "Network(%r, %r)" % (self.alias, self.address)
@@ -116,6 +132,93 @@ class ThrottledClientFactory(protocol.ClientFactory):
         reactor.callLater(self.failedDelay, connector.connect)
 
 
+class NetworkFactory(protocol.ClientFactory):
+    """Client factory for the connection to a single network
+
+    Bots know their network from the factory that connected them, instead of
+    PyFiBotFactory finding it out from the address connected to. Reconnects
+    back off exponentially, rotating through the network's servers when
+    connecting fails."""
+
+    def __init__(
+        self, factory: "PyFiBotFactory", network: Network, backoff: Backoff
+    ) -> None:
+        self.factory = factory
+        self.network = network
+        self.health = NetworkHealth(network.servers, backoff)
+        self._reconnect = None
+
+    def __repr__(self):
+        return "NetworkFactory(%r)" % self.network.alias
+
+    def doStart(self):
+        self.factory.doStart()
+
+    def doStop(self):
+        self.factory.doStop()
+
+    def connect(self):
+        """Connect to the current server of the network"""
+        self._reconnect = None
+        host, port = self.network.address = self.health.connecting()
+        if self.network.is_ssl:
+            log.info("connecting via SSL to %s:%d" % (host, port))
+            reactor.connectSSL(host, port, self, ssl.ClientContextFactory())
+        else:
+            log.info("connecting to %s:%d" % (host, port))
+            reactor.connectTCP(host, port, self)
+
+    def _schedule(self, delay):
+        self._reconnect = reactor.callLater(delay, self.connect)
+
+    def stop(self):
+        """Cancel a pending reconnect"""
+        if self._reconnect is not None and self._reconnect.active():
+            self._reconnect.cancel()
+        self._reconnect = None
+        self.health.stopped()
+
+    def buildProtocol(self, address):
+        log.info("Building protocol for %s (%s)", self.network.alias, address)
+        self.health.connected()
+        return self.factory.build_bot(self.network)
+
+    def clientConnectionLost(self, connector, reason):
+        if not self.factory.network_connection_lost(self.network, connector, reason):
+            self.health.stopped()
+            return
+        delay = self.health.lost(reason.getErrorMessage())
+        log.info(
+            "connection to %s lost (%s): reconnecting in %.0f seconds"
+            % (self.network.alias, reason.getErrorMessage(), delay)
+        )
+        self._schedule(delay)
+
+    def clientConnectionFailed(self, connector, reason):
+        delay = self.health.failed(reason.getErrorMessage())
+        log.info(
+            "connection to %s failed (%s): trying %s:%d in %.0f seconds"
+            % (
+                self.network.alias,
+                reason.getErrorMessage(),
+                self.health.server[0],
+                self.health.server[1],
+                delay,
+            )
+        )
+        self._schedule(delay)
+
+
+class _RequestCookieJar(requests.cookies.RequestsCookieJar):
+    """Session cookie jar that doesn't keep cookies between requests"""
+
+    def set_cookie(self, cookie, *args, **kwargs):
+        pass
+
+    def extract_cookies(self, response, request):
+        pass
+
+
 class PyFiBotFactory(ThrottledClientFactory):
     """python.fi bot factory"""
 
@@ -132,11 +235,49 @@ class PyFiBotFactory(ThrottledClientFactory):
         self.data: Dict[str, Any] = {}
         self.data["networks"] = {}
         self.ns: Dict[str, Any] = {}
+        # name -> [(module, callable)] for commands, handlers and events
+        self.dispatch: Dict[str, List[Tuple[str, Any]]] = {}
+        # Threadpool for module commands, handlers and events
+        self.workers = WorkerPool.from_config(config)
+        # Worker processes for CPU-heavy parsing
+        self.cpu = CPUPool.from_config(config)
+        # Common HTTP session for all requests, keeps connections alive
+        self.session = self._create_session()
+        # Cache for responses, None if disabled
+        self.http_cache = HTTPCache.from_config(config)
+        # Non-blocking client for code running on the reactor
+        self.http_client = AsyncHTTPClient.from_config(reactor, config)
+        # Requests to hosts that keep failing are refused for a while
+        self.breaker = CircuitBreaker.from_config(config)
+        # Recently failed urls, None if disabled
+        negative_ttl = config.get("http", {}).get("negative_ttl", 60)
+        self.failed_urls = TitleCache(ttl=negative_ttl) if negative_ttl else None
+        # Channel messages seen, fully scanned for urls and containing urls
+        self.url_scan_stats = {"messages": 0, "scanned": 0, "with_urls": 0}
+        # Server addresses, only needed when connecting through this factory
+        self.dns = DNSCache.from_config(reactor.nameResolver, config)
+        # alias -> NetworkFactory connecting to the network
+        self.network_factories: Dict[str, NetworkFactory] = {}
+        self.backoff = Backoff.from_config(config)
+        # Control channel to the supervisor when running as a worker process
+        self.control: Optional[ControlChannel] = None
+        # Shutdown trigger closing http_client, added when first started
+        self._close_trigger = None
 
     def startFactory(self):
         self.allBots = {}
         self.starttime = time.time()
+        self.workers.start()
+        self.cpu.start()
+        # The factory is started again after reconnecting, close only once
+        if self._close_trigger is None:
+            self._close_trigger = reactor.addSystemEventTrigger(
+                "before", "shutdown", self.http_client.close
+            )
         self._loadmodules()
+        # Resolve servers in advance for buildProtocol
+        for network in self.data["networks"].values():
+            self.dns.resolve(network.address[0])
         ThrottledClientFactory.startFactory(self)
         log.info("factory started")
 
@@ -145,27 +286,41 @@ class PyFiBotFactory(ThrottledClientFactory):
         ThrottledClientFactory.stopFactory(self)
         log.info("factory stopped")
 
+    def for_network(self, alias):
+        """Return the client factory for connecting to the network alias"""
+        if alias not in self.network_factories:
+            self.network_factories[alias] = NetworkFactory(
+                self, self.data["networks"][alias], self.backoff
+            )
+        return self.network_factories[alias]
+
+    def network_health(self):
+        """Connection state of networks connected through for_network()"""
+        return {alias: f.health.stats() for alias, f in self.network_factories.items()}
+
+    def build_bot(self, network):
+        log.debug("Connecting to %s", network)
+        p = self.protocol(self.config, network)
+        self.allBots[network.alias] = p
+        p.factory = self
+        return p
+
     def buildProtocol(self, address):
         # we are connecting to a server, don't know which yet
+        # (connections made through for_network() know their network)
         log.info("Building protocol for %s", address)
 
         # Go through all defined networks
         for network, server in self.data["networks"].items():
             log.debug("Looking for matching network: %s - %s", server, address)
-            # get all of the ipv4 and ipv6 addresses configured for this domain name
-            addrinfo = socket.getaddrinfo(server.address[0], server.address[1])
-            ips = set()
-            for ip in addrinfo:
-                ips.add(ip[4][0])  # (2, 1, 6, '', ('192.168.191.241', 6667))
+            # the ipv4 and ipv6 addresses of the server, resolved in advance
+            # as resolving here would block the reactor
+            ips = self.dns.cached(server.address[0]) or [server.address[0]]
 
             # if the address we are connecting to matches one of the IPs defined for
             # this network, connect to it and stop looking
             if address.host in ips:
-                log.debug("Connecting to %s / %s", server, address)
-                p = self.protocol(self.config, server)
-                self.allBots[server.alias] = p
-                p.factory = self
-                return p
+                return self.build_bot(server)
 
         # No address found
         log.error("Unknown network address: " + repr(address))
@@ -181,6 +336,7 @@ class PyFiBotFactory(ThrottledClientFactory):
         linerate=None,
         password=None,
         is_ssl=False,
+        servers=None,
     ):
         self.setNetwork(
             Network(
@@ -193,6 +349,7 @@ class PyFiBotFactory(ThrottledClientFactory):
                 linerate,
                 password,
                 is_ssl,
+                servers,
             )
         )
 
@@ -209,17 +366,20 @@ class PyFiBotFactory(ThrottledClientFactory):
         for n in self.data["networks"].values():
             dest = connector.getDestination()
             if (dest.host, dest.port) == n.address:
-                if n.alias in self.allBots:
-                    # did we quit intentionally?
-                    if not self.allBots[n.alias].hasQuit:
-                        # nope, reconnect
-                        ThrottledClientFactory.clientConnectionLost(
-                            self, connector, reason
-                        )
-                    del self.allBots[n.alias]
-                    return
-                else:
-                    log.info("No active connection to known network %s" % n.address[0])
+                if self.network_connection_lost(n, connector, reason):
+                    ThrottledClientFactory.clientConnectionLost(self, connector, reason)
+                return
+
+    def network_connection_lost(self, network, connector, reason):
+        """Forget the bot of network, return True if it should reconnect"""
+        if network.alias in self.allBots:
+            # did we quit intentionally?
+            reconnect = not self.allBots[network.alias].hasQuit
+            del self.allBots[network.alias]
+            return reconnect
+        else:
+            log.info("No active connection to known network %s" % network.address[0])
+            return False
 
     def _finalize_modules(self, modules=None):
         """Call all module finalizers"""
@@ -247,12 +407,36 @@ class PyFiBotFactory(ThrottledClientFactory):
                 env["init"](self)
             # Add to namespace so we can find it later
             self.ns[module] = (env, env)
+        # Swap in the new index in one go, so dispatch never sees a half-loaded state
+        self.dispatch = self._build_dispatch()
+
+    def _build_dispatch(self):
+        """Index module commands, handlers and events by their full name"""
+        dispatch: Dict[str, List[Tuple[str, Any]]] = {}
+        for module, env in self.ns.items():
+            myglobals, mylocals = env
+            for name, ref in mylocals.items():
+                if name.startswith(("command_", "admin_")):
+                    if not callable(ref):
+                        continue
+                elif name.startswith(("handle_", "event_")):
+                    if not isinstance(ref, FunctionType):
+                        continue
+                else:
+                    continue
+                dispatch.setdefault(name, []).append((module, ref))
+        return dispatch
 
     def _unload_removed_modules(self):
         """Unload modules removed from modules -directory"""
         # find all modules in namespace, which aren't present in modules -directory
         removed_modules = [m for m in self.ns if m not in self._findmodules()]
         self._finalize_modules(removed_modules)
+        for module in removed_modules:
+            log.info("unload module - %s" % module)
+            del self.ns[module]
+        # Don't dispatch to the removed modules
+        self.dispatch = self._build_dispatch()
 
     def _findmodules(self):
         """Find all modules"""
@@ -279,11 +463,11 @@ class PyFiBotFactory(ThrottledClientFactory):
         # g["to_unicode"] = self.to_unicode
         return g
 
-    def get_url(self, url, nocache=False, params=None, headers=None, cookies=None):
+    def _create_session(self):
+        """Create the HTTP session shared by all get_url calls"""
+        http_config = self.config.get("http", {})
         browser = "Mozilla/5.0 (Windows NT 6.1; Win64; x64; rv:49.0) Gecko/20100101 Firefox/49.0"
-        # Common session for all requests
         s = requests.session()
-        s.stream = True  # Don't fetch content unless asked
         s.headers.update({"User-Agent": browser})
         s.headers.update({"Accept-Language": "*"})
         s.headers.update(
@@ -291,43 +475,130 @@ class PyFiBotFactory(ThrottledClientFactory):
                 "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8"
             }
         )
-        # Custom headers from requester
-        if headers:
-            s.headers.update(headers)
-        # Custom cookies from requester
-        if cookies:
-            s.cookies.update(cookies)
+        # Don't let cookies set by one site leak to other modules' requests.
+        # Each request still keeps the cookies set during its redirects.
+        s.cookies = _RequestCookieJar()
+        # Keep-alive connection pools, one per host
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=http_config.get("max_hosts", 20),
+            pool_maxsize=http_config.get("max_connections_per_host", 4),
+        )
+        s.mount("http://", adapter)
+        s.mount("https://", adapter)
+        return s
+
+    def get_url_stats(self):
+        """Request and connection counts of the shared HTTP connection pools"""
+        requests_made, connections = 0, 0
+        for adapter in set(self.session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                requests_made += pool.num_requests
+                connections += pool.num_connections
+        reuse = 1 - connections / requests_made if requests_made else 0.0
+        return {"requests": requests_made, "connections": connections, "reuse": reuse}
+
+    def _url_failed(self, key, host, error):
+        """Remember a failed fetch, returns None for get_url to pass on"""
+        log.error(error)
+        if host:
+            self.breaker.failure(host)
+        if self.failed_urls is not None:
+            self.failed_urls.put(key, error)
+        return None
+
+    def get_url(self, url, nocache=False, params=None, headers=None, cookies=None):
+        cache = None if nocache else self.http_cache
+        entry = None
+        request_headers = headers
+        key = HTTPCache.key(url, params, headers, cookies)
+        if cache is not None:
+            r = cache.lookup(key)
+            if r is not None:
+                return r
+            # Stale entry, ask the server if it has changed
+            entry = cache.get(key)
+            if entry is not None:
+                request_headers = dict(headers or {})
+                request_headers.update(entry.conditional_headers())
+
+        if self.failed_urls is not None and not nocache:
+            error = self.failed_urls.get(key)
+            if error is not None:
+                log.debug("Recently failed, not fetching: %s (%s)" % (url, error))
+                return None
+        host = urllib.parse.urlsplit(url).hostname
+        if host and not self.breaker.allow(host):
+            log.debug("Circuit open for %s, not fetching %s" % (host, url))
+            return None
 
         try:
-            r = s.get(url, params=params, timeout=5)
+            # Don't fetch content unless asked
+            r = self.session.get(
+                url,
+                params=params,
+                headers=request_headers,
+                cookies=cookies,
+                stream=True,
+                timeout=self.config.get("http", {}).get("timeout", 5),
+            )
         except requests.exceptions.InvalidSchema:
             log.error("Invalid schema in URI: %s" % url)
             return None
         except requests.exceptions.SSLError:
-            log.error("SSL Error when connecting to %s" % url)
-            return None
+            return self._url_failed(key, host, "SSL Error when connecting to %s" % url)
         except requests.exceptions.ConnectionError:
-            log.error("Connection error when connecting to %s" % url)
+            return self._url_failed(
+                key, host, "Connection error when connecting to %s" % url
+            )
+        except requests.exceptions.Timeout:
+            return self._url_failed(key, host, "Timeout when connecting to %s" % url)
+
+        if host:
+            if r.status_code >= 500:
+                self.breaker.failure(host)
+            else:
+                self.breaker.success(host)
+
+        if cache is not None and entry is not None and r.status_code == 304:
+            r.close()
+            cache.refresh(key, entry, r)
+            return entry.to_response()
+
+        # Pages without Content-Length can't be checked here, callers needing
+        # only the beginning of a body should read it in chunks with iter_content
+        length = r.headers.get("Content-Length", "0")
+        size = int(length) // 1024 if length.isdigit() else 0  # Size in kB
+
+        if size > 2048:
+            log.warning("Content too large, will not fetch: %skB %s" % (size, url))
+            r.close()
+            if self.failed_urls is not None:
+                self.failed_urls.put(key, "too large")
             return None
 
-        size = int(r.headers.get("Content-Length", 0)) // 1024
-        size = size / 1024 / 1024  # Size in MB
+        if cache is not None:
+            # Stored once the caller has read the whole body
+            cache.store(key, r)
+        return r
 
-        content_type = r.headers.get("content-type", None)
-        if not content_type:
-            content_type = "Unknown"
+    def fetch(self, url, params=None, headers=None):
+        """Non-blocking get_url, returns a Deferred firing with the response.
 
-        if size > 5:
-            bot.say(
-                channel,
-                "File size: %s MB - Content-Type: %s" % (int(size), content_type),
-            )
+        Must be called from the reactor thread.
+        """
+        return self.http_client.fetch(url, params=params, headers=headers)
 
-        if size > 2:
-            log.warn("Content too large, will not fetch: %skB %s" % (size, url))
-            return None
+    def run_cpu(self, func, *args, timeout=None):
+        """Call func(*args) in the process pool and return the result.
 
-        return r
+        Blocks until the result is ready, so use it from module code, not
+        the reactor thread.
+        """
+        return self.cpu.run(func, *args, timeout=timeout)
 
     def getIdent(self, user):
         """Parses ident from nick!user@host
@@ -432,14 +703,93 @@ class PyFiBotFactory(ThrottledClientFactory):
 
         # change cmdchar, default to "."
         cmdchar = config.get("cmdchar", ".")
-        for key, bot in self.allBots.items():
+        for key, bot in (self.allBots or {}).items():
             bot.cmdchar = cmdchar
 
     def find_bot_for_network(self, network):
-        if network not in self.allBots:
+        # allBots is None while the factory is stopped
+        if not self.allBots or network not in self.allBots:
             return None
         return self.allBots[network]
 
+    def rehash(self, conf=False):
+        """Reload modules, and the configuration file if conf is set"""
+        if conf:
+            self.reload_config()
+        # unload removed modules
+        self._unload_removed_modules()
+        # reload modules
+        self._loadmodules()
+
+    def attach_control(self):
+        """Open the control channel to the supervisor"""
+        from twisted.internet import stdio
+
+        self.control = ControlChannel(self.control_received, self._control_closed)
+        stdio.StandardIO(self.control, stdin=CONTROL_IN, stdout=CONTROL_OUT)
+
+    def _control_closed(self):
+        if reactor.running:
+            log.error("control channel to supervisor closed, quitting")
+            self.quit_all()
+
+    def forward(self, network, command, **kwargs):
+        """Send a command for a network run by another worker
+
+        Returns False if network isn't run by another worker."""
+        if self.control is None or network in self.data["networks"]:
+            return False
+        if network not in self.config["networks"]:
+            return False
+        kwargs.update(command=command, network=network)
+        self.control.send(kwargs)
+        return True
+
+    def broadcast(self, command, **kwargs):
+        """Send a command to all other workers"""
+        if self.control is not None:
+            kwargs.update(command=command, broadcast=True)
+            self.control.send(kwargs)
+
+    def control_received(self, message):
+        """Run a command from the control channel"""
+        command = message["command"]
+        log.info("control command %s", command)
+        if command == "rehash":
+            self.rehash(message.get("conf", False))
+            return
+        if command == "quit":
+            self.quit_all(message.get("message", ""))
+            return
+
+        bot = self.find_bot_for_network(message.get("network"))
+        if bot is None:
+            log.warning("control command %s for unknown network: %r", command, message)
+        elif command == "join":
+            bot.join(message["channel"], key=message.get("key"))
+        elif command == "part":
+            if message["channel"] in bot.network.channels:
+                bot.network.channels.remove(message["channel"])
+            bot.part(message["channel"])
+        elif command == "say":
+            bot.say(message["channel"], message["message"])
+        else:
+            log.warning("unknown control command: %r", message)
+
+    def quit_all(self, message=""):
+        """Quit all networks and stop"""
+        for alias, network_factory in self.network_factories.items():
+            network_factory.stop()
+        for bot in list((self.allBots or {}).values()):
+            bot.hasQuit = 1
+            bot.quit(message)
+        # Give the QUITs a moment to be sent
+        reactor.callLater(1, self._stop_reactor)
+
+    def _stop_reactor(self):
+        if reactor.running:
+            reactor.stop()
+
 
 def init_logging(config):
     logger = logging.getLogger()
@@ -499,6 +849,19 @@ def parse_args():
     parser.add_argument(
         "-c", "--config", default="config.yml", help="Path to config file (default: config.yml)"
     )
+    parser.add_argument(
+        "--supervise",
+        action="store_true",
+        help="Run each network (or group of networks) in a worker process",
+    )
+    parser.add_argument(
+        "--network",
+        action="append",
+        help="Only connect to this network, can be given more than once",
+    )
+    parser.add_argument(
+        "--worker", action="store_true", help="Run as a worker of a supervisor"
+    )
     return parser.parse_args()
 
 
@@ -511,8 +874,19 @@ def main():
 
     init_logging(config.get("logging", {}))
 
+    if args.supervise:
+        Supervisor(args.config, config).start()
+        reactor.run()
+        return
+
     factory = PyFiBotFactory(config)
+    if args.worker:
+        factory.attach_control()
+        # Ctrl-C reaches workers too, but they quit when the supervisor says so
+        reactor.callWhenRunning(signal.signal, signal.SIGINT, signal.SIG_IGN)
     for network, settings in config["networks"].items():
+        if args.network and network not in args.network:
+            continue
         # settings = per network, config = global
         nick = settings.get("nick", None) or config["nick"]
         realname = settings.get("realname") or config.get("realname")
@@ -533,21 +907,28 @@ def main():
         else:
             log.warning('No channels defined for "%s"' % network)
 
-        if force_ipv6:
-            try:
-                server_name = socket.getaddrinfo(
-                    settings["server"], port, socket.AF_INET6
-                )[0][4][0]
-            except IndexError:
-                log.error(
-                    "No IPv6 address found for %s (force_ipv6 = true)" % (network)
-                )
-                continue
-        else:
-            server_name = settings["server"]
+        # the main server first, then any others to try when connecting fails
+        servers = []
+        for server in [settings["server"]] + settings.get("servers", []):
+            server_port = port
+            if server.count(":") == 1:
+                server, server_port = server.split(":")
+                server_port = int(server_port)
+            if force_ipv6:
+                try:
+                    addrinfo = socket.getaddrinfo(server, server_port, socket.AF_INET6)
+                    server = addrinfo[0][4][0]
+                except (IndexError, socket.gaierror):
+                    log.error(
+                        "No IPv6 address found for %s (force_ipv6 = true)" % (server)
+                    )
+                    continue
+            servers.append((server, server_port))
+        if not servers:
+            continue
 
         factory.createNetwork(
-            (server_name, port),
+            servers[0],
             network,
             nick,
             realname,
@@ -555,13 +936,9 @@ def main():
             linerate,
             password,
             is_ssl,
+            servers,
         )
-        if is_ssl:
-            log.info("connecting via SSL to %s:%d" % (server_name, port))
-            reactor.connectSSL(server_name, port, factory, ssl.ClientContextFactory())
-        else:
-            log.info("connecting to %s:%d" % (server_name, port))
-            reactor.connectTCP(server_name, port, factory)
+        factory.for_network(network).connect()
     reactor.run()
 
 
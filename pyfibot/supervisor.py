@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+"""
+Run networks in separate worker processes
+
+In supervisor mode (pyfibot --supervise) the bot process doesn't connect to
+any networks itself. It starts a worker process for each network, or each
+group of networks listed under supervisor.groups in the config, so a module
+hogging the CPU on one network doesn't slow down the others. Workers that
+exit are restarted with the same backoff as reconnects.
+
+Each worker has a control channel to the supervisor: JSON objects, one per
+line, over file descriptors 3 (supervisor to worker) and 4 (worker to
+supervisor). Messages with a "network" are routed to the worker running that
+network, messages with "broadcast" set to every other worker. Workers use it
+for commands like join and part on networks of other workers, and to
+propagate rehash. On shutdown the supervisor tells every worker to quit.
+"""
+
+import sys
+import json
+import time
+import logging
+from typing import Any, Callable, Dict, List, Optional
+
+from twisted.internet import defer, protocol, reactor
+from twisted.protocols import basic
+
+from pyfibot.util.reconnect import Backoff
+
+log = logging.getLogger("supervisor")
+
+# Control channel file descriptors in the worker
+CONTROL_IN = 3
+CONTROL_OUT = 4
+
+# Seconds workers get to quit before they're terminated
+QUIT_TIMEOUT = 10
+
+
+class ControlChannel(basic.LineReceiver):
+    """JSON messages, one per line"""
+
+    delimiter = b"\n"
+    MAX_LENGTH = 65536
+
+    def __init__(
+        self,
+        received: Callable[[Dict[str, Any]], Any],
+        closed: Optional[Callable[[], Any]] = None,
+    ) -> None:
+        self.received = received
+        self.closed = closed
+
+    def send(self, message: Dict[str, Any]) -> None:
+        """Send a message, may be called from any thread"""
+        reactor.callFromThread(self.sendLine, json.dumps(message).encode("utf-8"))
+
+    def lineReceived(self, line: bytes) -> None:
+        try:
+            message = json.loads(line)
+        except ValueError:
+            log.warning("invalid control message: %r", line)
+            return
+        if not isinstance(message, dict) or "command" not in message:
+            log.warning("invalid control message: %r", line)
+            return
+        self.received(message)
+
+    def connectionLost(self, reason: Any = None) -> None:
+        if self.closed is not None:
+            self.closed()
+
+
+class _ChildWriter(object):
+    """Transport for a ControlChannel writing to a worker's control fd"""
+
+    disconnecting = False
+
+    def __init__(self, process: "WorkerProcess") -> None:
+        self.process = process
+
+    def write(self, data: bytes) -> None:
+        if self.process.transport is not None:
+            self.process.transport.writeToChild(CONTROL_IN, data)
+
+    def writeSequence(self, data: List[bytes]) -> None:
+        self.write(b"".join(data))
+
+
+class WorkerProcess(protocol.ProcessProtocol):
+    """A worker running some of the networks"""
+
+    def __init__(self, supervisor: "Supervisor", name: str, networks: List[str]):
+        self.supervisor = supervisor
+        self.name = name
+        self.networks = networks
+        self.channel = ControlChannel(self._received)
+        self.channel.makeConnection(_ChildWriter(self))
+        self.started: Optional[float] = None
+        self.restarts = 0
+        self.failures = 0
+        self.exited: Optional[defer.Deferred] = None
+
+    def __repr__(self):
+        return "WorkerProcess(%r)" % self.name
+
+    @property
+    def running(self) -> bool:
+        return self.transport is not None and self.transport.pid is not None
+
+    def connectionMade(self) -> None:
+        self.started = time.time()
+        log.info("worker %s started for %s", self.name, ", ".join(self.networks))
+
+    def childDataReceived(self, childFD: int, data: bytes) -> None:
+        if childFD == CONTROL_OUT:
+            self.channel.dataReceived(data)
+
+    def _received(self, message: Dict[str, Any]) -> None:
+        self.supervisor.route(self, message)
+
+    def send(self, message: Dict[str, Any]) -> None:
+        self.channel.send(message)
+
+    def processEnded(self, reason: Any) -> None:
+        log.info("worker %s exited: %s", self.name, reason.getErrorMessage())
+        self.transport = None
+        # Reset the buffer of a half received line
+        self.channel.clearLineBuffer()
+        if self.exited is not None:
+            self.exited.callback(None)
+            self.exited = None
+        self.supervisor.worker_ended(self)
+
+
+class Supervisor(object):
+    """Start, restart and route messages between worker processes"""
+
+    def __init__(self, config_file: str, config: Dict[str, Any]) -> None:
+        self.config_file = config_file
+        self.config = config
+        self.backoff = Backoff.from_config(config)
+        self.stopping = False
+        self.workers: List[WorkerProcess] = []
+        # network -> worker running it
+        self.routes: Dict[str, WorkerProcess] = {}
+        for networks in self.groups(config):
+            worker = WorkerProcess(self, "+".join(networks), networks)
+            self.workers.append(worker)
+            for network in networks:
+                self.routes[network] = worker
+
+    @staticmethod
+    def groups(config: Dict[str, Any]) -> List[List[str]]:
+        """Networks run by each worker: the configured groups, then the rest
+        each in a worker of its own"""
+        groups = []
+        grouped = set()
+        for group in config.get("supervisor", {}).get("groups", []):
+            group = [n for n in group if n in config["networks"] and n not in grouped]
+            if group:
+                groups.append(group)
+                grouped.update(group)
+        for network in config["networks"]:
+            if network not in grouped:
+                groups.append([network])
+        return groups
+
+    def start(self) -> None:
+        reactor.addSystemEventTrigger("before", "shutdown", self.stop)
+        for worker in self.workers:
+            self.spawn(worker)
+
+    def spawn(self, worker: WorkerProcess) -> None:
+        if self.stopping:
+            return
+        args = [sys.executable, "-m", "pyfibot.pyfibot", "-c", self.config_file]
+        args.append("--worker")
+        for network in worker.networks:
+            args.extend(["--network", network])
+        # Logs go to our stdout and stderr, control messages over extra fds
+        reactor.spawnProcess(
+            worker,
+            sys.executable,
+            args,
+            env=None,
+            childFDs={0: 0, 1: 1, 2: 2, CONTROL_IN: "w", CONTROL_OUT: "r"},
+        )
+
+    def worker_ended(self, worker: WorkerProcess) -> None:
+        if self.stopping:
+            return
+        if worker.started and time.time() - worker.started >= self.backoff.stable_after:
+            worker.failures = 0
+        delay = self.backoff.delay(worker.failures)
+        worker.failures += 1
+        worker.restarts += 1
+        log.warning("restarting worker %s in %.0f seconds", worker.name, delay)
+        reactor.callLater(delay, self.spawn, worker)
+
+    def route(self, sender: WorkerProcess, message: Dict[str, Any]) -> None:
+        """Deliver a message from a worker to the workers it's for"""
+        if message.pop("broadcast", False):
+            for worker in self.workers:
+                if worker is not sender and worker.running:
+                    worker.send(message)
+            return
+        network = message.get("network")
+        worker = self.routes.get(network)
+        if worker is None or not worker.running:
+            log.warning("no worker running network %s, dropped %r", network, message)
+            return
+        worker.send(message)
+
+    def stop(self) -> defer.Deferred:
+        """Tell workers to quit, wait for them to exit"""
+        self.stopping = True
+        waiting = []
+        for worker in self.workers:
+            if not worker.running:
+                continue
+            worker.exited = defer.Deferred()
+            waiting.append(worker.exited)
+            worker.send({"command": "quit"})
+            reactor.callLater(QUIT_TIMEOUT, self._terminate, worker)
+        return defer.DeferredList(waiting)
+
+    def _terminate(self, worker: WorkerProcess) -> None:
+        if worker.running:
+            log.warning("worker %s didn't quit, terminating", worker.name)
+            worker.transport.signalProcess("TERM")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            worker.name: {
+                "networks": worker.networks,
+                "running": worker.running,
+                "pid": worker.transport.pid if worker.running else None,
+                "restarts": worker.restarts,
+            }
+            for worker in self.workers
+        }
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""
+Non-blocking HTTP client built on Twisted's Agent
+
+fetch() returns a Deferred firing with a requests.Response, so code written
+against get_url results (.status_code, .headers, .content, .text, .json())
+works unchanged. Connections are kept alive in a persistent pool and an
+in-flight request costs a file descriptor instead of a thread.
+
+Must be called from the reactor thread.
+"""
+
+import logging
+from io import BytesIO
+from typing import Any, Dict, Optional
+
+import requests
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+from twisted.internet import defer, protocol
+from twisted.web.client import (
+    Agent,
+    BrowserLikeRedirectAgent,
+    ContentDecoderAgent,
+    GzipDecoder,
+    HTTPConnectionPool,
+    ResponseDone,
+)
+from twisted.web.http import PotentialDataLoss
+from twisted.web.http_headers import Headers
+
+log = logging.getLogger("asynchttp")
+
+USER_AGENT = (
+    "Mozilla/5.0 (Windows NT 6.1; Win64; x64; rv:49.0) Gecko/20100101 Firefox/49.0"
+)
+
+
+class _BodyCollector(protocol.Protocol):
+    """Collect a response body, giving up after max_bytes
+
+    finished fires with (body, truncated). Cancelling it closes the
+    connection."""
+
+    transport = None
+
+    def __init__(self, max_bytes: int) -> None:
+        self.finished: defer.Deferred = defer.Deferred(self.cancel)
+        self.max_bytes = max_bytes
+        self.buffer = BytesIO()
+        self.truncated = False
+
+    def dataReceived(self, data: bytes) -> None:
+        if self.truncated:
+            return
+        remaining = self.max_bytes - self.buffer.tell()
+        self.buffer.write(data[:remaining])
+        if len(data) >= remaining:
+            self.truncated = True
+            self.transport.stopProducing()
+
+    def cancel(self, finished: defer.Deferred) -> None:
+        """Stop reading the body, the connection is closed"""
+        if self.transport is not None:
+            self.transport.stopProducing()
+
+    def connectionLost(self, reason) -> None:
+        if self.finished.called:
+            # Cancelled
+            return
+        if self.truncated or reason.check(ResponseDone, PotentialDataLoss):
+            self.finished.callback((self.buffer.getvalue(), self.truncated))
+        else:
+            self.finished.errback(reason)
+
+
+class AsyncHTTPClient(object):
+    """Pooled, non-blocking HTTP GET client"""
+
+    def __init__(
+        self,
+        reactor,
+        max_connections_per_host: int = 4,
+        timeout: float = 5,
+        max_bytes: int = 2 * 1024 * 1024,
+    ) -> None:
+        self.reactor = reactor
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+        self.pool = HTTPConnectionPool(reactor, persistent=True)
+        self.pool.maxPersistentPerHost = max_connections_per_host
+        self.agent = ContentDecoderAgent(
+            BrowserLikeRedirectAgent(Agent(reactor, pool=self.pool)),
+            [(b"gzip", GzipDecoder)],
+        )
+
+    @classmethod
+    def from_config(cls, reactor, config: Dict[str, Any]) -> "AsyncHTTPClient":
+        """Create a client from the "http" section of the bot config"""
+        conf = config.get("http", {})
+        return cls(
+            reactor,
+            max_connections_per_host=conf.get("max_connections_per_host", 4),
+            timeout=conf.get("timeout", 5),
+        )
+
+    def fetch(
+        self,
+        url: str,
+        params: Optional[Dict[str, Any]] = None,
+        headers: Optional[Dict[str, str]] = None,
+        timeout: Optional[float] = None,
+        max_bytes: Optional[int] = None,
+    ) -> defer.Deferred:
+        """GET url, returning a Deferred firing with a requests.Response.
+
+        Bodies are cut off at max_bytes; response.truncated tells if that
+        happened.
+        """
+        url = requests.Request("GET", url, params=params).prepare().url
+        request_headers = Headers(
+            {
+                b"User-Agent": [USER_AGENT.encode("ascii")],
+                b"Accept-Language": [b"*"],
+                b"Accept": [
+                    b"text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8"
+                ],
+            }
+        )
+        for name, value in (headers or {}).items():
+            request_headers.setRawHeaders(name.encode("ascii"), [value.encode("utf-8")])
+
+        d = self.agent.request(b"GET", url.encode("ascii"), request_headers)
+        d.addCallback(self._read_response, url, max_bytes or self.max_bytes)
+        d.addTimeout(timeout or self.timeout, self.reactor)
+        return d
+
+    def _read_response(self, response, url: str, max_bytes: int) -> defer.Deferred:
+        collector = _BodyCollector(max_bytes)
+        # A timeout while the body is being read cancels finished
+        finished = collector.finished
+        response.deliverBody(collector)
+
+        def _build(result):
+            content, truncated = result
+            r = requests.Response()
+            r.status_code = response.code
+            r.reason = response.phrase.decode("latin-1")
+            r.url = url
+            r.headers = CaseInsensitiveDict(
+                {
+                    name.decode("latin-1"): ", ".join(
+                        v.decode("latin-1") for v in values
+                    )
+                    for name, values in response.headers.getAllRawHeaders()
+                }
+            )
+            r.encoding = get_encoding_from_headers(r.headers)
+            r._content = content
+            r._content_consumed = True
+            r.truncated = truncated  # type: ignore[attr-defined]
+            return r
+
+        return finished.addCallback(_build)
+
+    def close(self) -> defer.Deferred:
+        return self.pool.closeCachedConnections()
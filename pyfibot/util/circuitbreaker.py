@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+Per-host circuit breaker for outgoing HTTP requests
+
+A host that fails max_failures times in a row (connection errors, timeouts,
+5xx responses) is considered down and the circuit opens: requests to it are
+refused right away instead of each waiting for a timeout. After reset_timeout
+seconds the circuit is half-open and a single probe request is let through.
+If it succeeds the circuit closes again, if not it stays open for another
+reset_timeout.
+"""
+
+import time
+import logging
+import threading
+from typing import Any, Dict
+
+log = logging.getLogger("circuitbreaker")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+
+class _Circuit(object):
+    def __init__(self) -> None:
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+
+
+class CircuitBreaker(object):
+    """Track request failures per host and refuse requests to dead hosts"""
+
+    def __init__(self, max_failures: int = 5, reset_timeout: float = 60) -> None:
+        self.max_failures = max_failures
+        self.reset_timeout = reset_timeout
+        self.refused = 0
+        self._circuits: Dict[str, _Circuit] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> "CircuitBreaker":
+        """Create a circuit breaker from the "http" section of the bot config"""
+        conf = config.get("http", {})
+        return cls(
+            max_failures=conf.get("breaker_failures", 5),
+            reset_timeout=conf.get("breaker_reset", 60),
+        )
+
+    def allow(self, host: str) -> bool:
+        """Check if a request to host may be made"""
+        with self._lock:
+            circuit = self._circuits.get(host)
+            if circuit is None or circuit.state == CLOSED:
+                return True
+            now = time.time()
+            if now - circuit.opened_at >= self.reset_timeout:
+                # Let one probe through, others are refused until it finishes
+                # (or for another reset_timeout, if it never reports back)
+                circuit.state = HALF_OPEN
+                circuit.opened_at = now
+                log.info("circuit for %s half-open, probing", host)
+                return True
+            self.refused += 1
+            return False
+
+    def success(self, host: str) -> None:
+        with self._lock:
+            circuit = self._circuits.pop(host, None)
+        if circuit is not None and circuit.state != CLOSED:
+            log.info("circuit for %s closed", host)
+
+    def failure(self, host: str) -> None:
+        with self._lock:
+            circuit = self._circuits.setdefault(host, _Circuit())
+            circuit.failures += 1
+            if circuit.state == HALF_OPEN or (
+                circuit.state == CLOSED and circuit.failures >= self.max_failures
+            ):
+                circuit.state = OPEN
+                circuit.opened_at = time.time()
+                log.warning(
+                    "circuit for %s open after %d failures", host, circuit.failures
+                )
+
+    def state(self, host: str) -> str:
+        circuit = self._circuits.get(host)
+        return circuit.state if circuit is not None else CLOSED
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "open": sorted(
+                    host for host, c in self._circuits.items() if c.state != CLOSED
+                ),
+                "refused": self.refused,
+            }
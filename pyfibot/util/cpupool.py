@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+"""
+Process pool for CPU-heavy work like parsing HTML, feeds and XML
+
+Module code runs in threads, and threads share the GIL with the reactor: a
+few large pages being parsed at once slow down the IRC connections of every
+network. CPUPool runs such functions in separate processes instead, so they
+use the other cores and only the result is handed back.
+
+The worker processes are started with the bot and import the parsers in
+pyfibot.util.parsers right away, so the first calls don't wait for that.
+Calls that would leave more than max_pending calls waiting or running are
+refused with PoolFull, and a caller waits at most timeout seconds for the
+result. A call that timed out keeps its worker busy until it finishes and
+counts against max_pending until then.
+
+The function and its arguments are pickled to the worker, so the function
+must be importable: functions of bot modules aren't, as modules are loaded
+with exec. With processes set to 0 functions are called directly instead.
+"""
+
+import signal
+import logging
+import importlib
+import threading
+import multiprocessing
+from concurrent import futures
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, Optional, Sequence, Tuple
+
+from twisted.internet import reactor
+
+log = logging.getLogger("cpupool")
+
+# Imported by every worker process when it starts
+PRELOAD = ("pyfibot.util.parsers",)
+
+
+class PoolFull(Exception):
+    """Too many calls waiting for the process pool"""
+
+
+def _preload(modules: Sequence[str]) -> None:
+    # Ctrl-C is for the bot, it stops the pool
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    for module in modules:
+        importlib.import_module(module)
+
+
+def _ready() -> None:
+    pass
+
+
+class CPUPool(object):
+    """Run functions in a pool of worker processes"""
+
+    def __init__(
+        self,
+        processes: int = 2,
+        timeout: float = 30,
+        max_pending: int = 20,
+        preload: Sequence[str] = PRELOAD,
+    ) -> None:
+        self.processes = processes
+        self.timeout = timeout
+        self.max_pending = max_pending
+        self.preload = preload
+        self._executor: Optional[futures.ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._counters = {
+            "run": 0,
+            "inline": 0,
+            "rejected": 0,
+            "timeouts": 0,
+            "errors": 0,
+            "restarts": 0,
+        }
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> "CPUPool":
+        """Create a pool from the "cpu" section of the bot config"""
+        conf = config.get("cpu", {})
+        return cls(
+            processes=conf.get("processes", 2),
+            timeout=conf.get("timeout", 30),
+            max_pending=conf.get("max_pending", 20),
+        )
+
+    def _get_executor(self) -> futures.ProcessPoolExecutor:
+        # Called with the lock held
+        if self._executor is None:
+            self._executor = futures.ProcessPoolExecutor(
+                self.processes,
+                # Forking a process with the reactor and threads running
+                # isn't safe
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_preload,
+                initargs=(self.preload,),
+            )
+            # Processes are started as calls are submitted, start them all
+            for _ in range(self.processes):
+                self._executor.submit(_ready)
+            log.info("process pool started with %d processes", self.processes)
+        return self._executor
+
+    def start(self) -> None:
+        """Start the worker processes, they're started on first use otherwise"""
+        if self.processes <= 0:
+            return
+        with self._lock:
+            if self._executor is not None:
+                return
+            self._get_executor()
+        reactor.addSystemEventTrigger("during", "shutdown", self.stop)
+
+    def stop(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _done(self, future: futures.Future) -> None:
+        with self._lock:
+            self._pending -= 1
+        if not future.cancelled() and future.exception() is not None:
+            self._counters["errors"] += 1
+
+    def _broken(self, executor: futures.ProcessPoolExecutor) -> None:
+        """A worker process died, replace the pool on the next call"""
+        with self._lock:
+            if self._executor is not executor:
+                return
+            self._executor = None
+            self._counters["restarts"] += 1
+        log.error("process pool broken, restarting")
+        executor.shutdown(wait=False)
+
+    def _submit(self, func: Callable, args: tuple) -> Tuple[Any, futures.Future]:
+        """Submit func(*args), return the executor running it and a Future"""
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self._counters["rejected"] += 1
+                raise PoolFull("%d calls waiting for the process pool" % self._pending)
+            executor = self._get_executor()
+            self._pending += 1
+            self._counters["run"] += 1
+        try:
+            future = executor.submit(func, *args)
+        except BrokenProcessPool:
+            with self._lock:
+                self._pending -= 1
+            self._broken(executor)
+            raise
+        future.add_done_callback(self._done)
+        return executor, future
+
+    def run(self, func: Callable, *args, timeout: Optional[float] = None) -> Any:
+        """Call func(*args) in a worker process and wait for the result
+
+        Blocks, so don't call it on the reactor thread. Raises PoolFull,
+        TimeoutError if the result takes longer than timeout seconds, or the
+        exception func raised."""
+        if self.processes <= 0:
+            self._counters["inline"] += 1
+            return func(*args)
+        executor, future = self._submit(func, args)
+        try:
+            return future.result(self.timeout if timeout is None else timeout)
+        except futures.TimeoutError:
+            future.cancel()
+            self._counters["timeouts"] += 1
+            log.warning("%s timed out in the process pool", func.__name__)
+            raise TimeoutError("%s timed out" % func.__name__)
+        except BrokenProcessPool:
+            self._broken(executor)
+            raise
+
+    def stats(self) -> Dict[str, int]:
+        stats = dict(self._counters)
+        stats["processes"] = self.processes
+        stats["pending"] = self._pending
+        return stats
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+Asynchronous host name resolution with a TTL cache
+
+Resolving with socket.getaddrinfo blocks the reactor for as long as the
+resolver takes. DNSCache resolves through the reactor's name resolver instead,
+which does the lookup off the reactor thread, and remembers the addresses for
+ttl seconds. Concurrent lookups for the same host share a single resolution.
+
+Must be called from the reactor thread.
+"""
+
+import logging
+from typing import Any, Dict, List, Optional
+
+from twisted.internet import defer
+from twisted.internet.interfaces import IResolutionReceiver
+from zope.interface import implementer
+
+from pyfibot.util.titlecache import TitleCache
+
+log = logging.getLogger("dnscache")
+
+
+@implementer(IResolutionReceiver)
+class _Receiver(object):
+    def __init__(self, finished: defer.Deferred) -> None:
+        self.finished = finished
+        self.addresses: List[str] = []
+
+    def resolutionBegan(self, resolution: Any) -> None:
+        pass
+
+    def addressResolved(self, address: Any) -> None:
+        if address.host not in self.addresses:
+            self.addresses.append(address.host)
+
+    def resolutionComplete(self) -> None:
+        self.finished.callback(self.addresses)
+
+
+class DNSCache(object):
+    """Resolve host names to lists of addresses, caching them for ttl seconds"""
+
+    def __init__(self, resolver: Any, ttl: float = 300, capacity: int = 100) -> None:
+        self.resolver = resolver
+        self.cache = TitleCache(capacity=capacity, ttl=ttl)
+        self.lookups = 0
+        self.failures = 0
+        # host -> Deferreds waiting for a resolution in progress
+        self._pending: Dict[str, List[defer.Deferred]] = {}
+
+    @classmethod
+    def from_config(cls, resolver: Any, config: Dict[str, Any]) -> "DNSCache":
+        """Create a cache from the bot config"""
+        return cls(resolver, ttl=config.get("dns_ttl", 300))
+
+    def cached(self, host: str) -> Optional[List[str]]:
+        """Addresses of host if they are in the cache, without resolving"""
+        return self.cache.get(host)
+
+    def resolve(self, host: str) -> defer.Deferred:
+        """Return a Deferred firing with the addresses of host
+
+        Fires with an empty list if the host can't be resolved. Failed
+        lookups aren't cached."""
+        addresses = self.cache.get(host)
+        if addresses is not None:
+            return defer.succeed(addresses)
+
+        d: defer.Deferred = defer.Deferred()
+        waiting = self._pending.get(host)
+        if waiting is not None:
+            waiting.append(d)
+            return d
+        self._pending[host] = [d]
+
+        self.lookups += 1
+        finished: defer.Deferred = defer.Deferred()
+        finished.addCallback(self._resolved, host)
+        self.resolver.resolveHostName(_Receiver(finished), host)
+        return d
+
+    def _resolved(self, addresses: List[str], host: str) -> None:
+        if addresses:
+            self.cache.put(host, addresses)
+        else:
+            self.failures += 1
+            log.warning("unable to resolve %s", host)
+        for d in self._pending.pop(host, []):
+            d.callback(addresses)
+
+    def stats(self) -> Dict[str, int]:
+        stats = self.cache.stats()
+        stats["lookups"] = self.lookups
+        stats["failures"] = self.failures
+        return stats
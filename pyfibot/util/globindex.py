@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+Indexes of fnmatch-style patterns
+
+Matching a url against a long list of globs one by one means translating and
+running every pattern for every url. GlobIndex compiles the patterns once and
+files those of the form scheme://host/... under their host: exact hosts in a
+dict, *suffix hosts in a dict looked up with each suffix of the url's host.
+Only the patterns found that way are tried, plus those of the ones that can't
+be indexed whose longest literal part is in the url. The literals are searched
+for with a single combined regex.
+
+Like fnmatch.fnmatchcase, matching is case sensitive. A pattern filed under a
+host only matches urls for that host, even when its leading * could in theory
+reach over the scheme or into the path.
+
+GlobSet answers whether a string matches any pattern of a list, exactly like
+looping over the list with fnmatch.fnmatch. Patterns without wildcards are
+kept in a set, the rest are compiled into a single regex.
+"""
+
+import os
+import re
+import fnmatch
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+_WILDCARDS = re.compile(r"[*?\[]")
+_URL_HOST = re.compile(r"[^:/?#]*://([^/?#]*)")
+
+
+def _literal(pattern: str) -> str:
+    """Longest part of pattern without wildcards"""
+    return max(re.split(r"\*|\?|\[[^\]]*\]", pattern), key=len)
+
+
+def _host_key(pattern: str) -> Tuple[Optional[str], bool]:
+    """Return (host, is_suffix) for an indexable pattern, (None, False) if not"""
+    _, sep, rest = pattern.partition("://")
+    host, slash, _ = rest.partition("/")
+    if not sep or not slash or not host:
+        return None, False
+    if host.startswith("*"):
+        if _WILDCARDS.search(host[1:]):
+            return None, False
+        return host[1:], True
+    if _WILDCARDS.search(host):
+        return None, False
+    return host, False
+
+
+class GlobIndex(object):
+    """Find the values of all patterns matching a url, in insertion order"""
+
+    def __init__(self, items: Iterable[Tuple[str, Any]] = ()) -> None:
+        self._values: List[Any] = []
+        self._matchers: List[Callable] = []
+        self._exact: Dict[str, List[int]] = {}
+        self._suffix: Dict[str, List[int]] = {}
+        # literal -> patterns which can't be indexed by host
+        self._generic: Dict[str, List[int]] = {}
+        self._generic_re: Optional[Callable] = None
+
+        for i, (pattern, value) in enumerate(items):
+            regex = fnmatch.translate(pattern)
+            self._values.append(value)
+            self._matchers.append(re.compile(regex).match)
+            host, is_suffix = _host_key(pattern)
+            if host is None:
+                self._generic.setdefault(_literal(pattern), []).append(i)
+            elif is_suffix:
+                self._suffix.setdefault(host, []).append(i)
+            else:
+                self._exact.setdefault(host, []).append(i)
+
+        # Patterns that are all wildcards are always tried
+        self._always = self._generic.pop("", [])
+        if self._generic:
+            literals = sorted(self._generic, key=len, reverse=True)
+            self._generic_re = re.compile(
+                "|".join(re.escape(literal) for literal in literals)
+            ).search
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def match(self, url: str) -> List[Any]:
+        """Values of every pattern matching url"""
+        candidates: List[int] = list(self._always)
+        m = _URL_HOST.match(url)
+        if m:
+            host = m.group(1)
+            candidates.extend(self._exact.get(host, ()))
+            if self._suffix:
+                for i in range(len(host) + 1):
+                    candidates.extend(self._suffix.get(host[i:], ()))
+        if self._generic_re is not None and self._generic_re(url):
+            for literal, indexes in self._generic.items():
+                if literal in url:
+                    candidates.extend(indexes)
+        candidates.sort()
+        return [self._values[i] for i in candidates if self._matchers[i](url)]
+
+
+class GlobSet(object):
+    """Match strings against a list of fnmatch patterns in one go"""
+
+    def __init__(self, patterns: Iterable[str] = ()) -> None:
+        self._exact: Dict[str, str] = {}
+        self._patterns: List[str] = []
+        self._re: Optional[Callable] = None
+        regexes = []
+        for pattern in patterns:
+            # fnmatch.fnmatch normalizes case on case-insensitive platforms
+            normalized = os.path.normcase(pattern)
+            if not _WILDCARDS.search(normalized):
+                self._exact.setdefault(normalized, pattern)
+                continue
+            regexes.append(
+                "(?P<p%d>%s)" % (len(self._patterns), fnmatch.translate(normalized))
+            )
+            self._patterns.append(pattern)
+        if regexes:
+            self._re = re.compile("|".join(regexes)).match
+
+    def __len__(self) -> int:
+        return len(self._exact) + len(self._patterns)
+
+    def match(self, name: str) -> Optional[str]:
+        """Return a pattern matching name, None if there are none"""
+        # Nothing to match, like a missing user with no users ignored
+        if not isinstance(name, str) or not len(self):
+            return None
+        name = os.path.normcase(name)
+        pattern = self._exact.get(name)
+        if pattern is not None:
+            return pattern
+        if self._re is not None:
+            m = self._re(name)
+            if m:
+                return self._patterns[int(m.lastgroup[1:])]
+        return None
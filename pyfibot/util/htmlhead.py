@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""
+Lightweight extraction of the title and meta tags from the head of a page
+
+HeadParser is fed raw bytes as they arrive from the network. It works out the
+character set from the HTTP headers, a byte order mark or a <meta> tag, decodes
+incrementally (as UTF-8 if none is declared, or windows-1252 if the page isn't
+valid UTF-8) and tokenizes with the standard library HTMLParser without
+building a document tree. Parsing stops at </head> or <body>, after which
+.done is set and the rest of the page doesn't need to be downloaded.
+"""
+
+import re
+import codecs
+from html.parser import HTMLParser
+from typing import Dict, Optional
+
+# The HTML spec looks for a <meta> charset in the first 1024 bytes
+_PRESCAN_BYTES = 1024
+_META_CHARSET_RE = re.compile(
+    rb"""<meta[^>]+charset\s*=\s*["']?\s*([a-zA-Z0-9_:.-]+)""", re.I
+)
+_HEADER_CHARSET_RE = re.compile(r"""charset\s*=\s*["']?([a-zA-Z0-9_:.-]+)""", re.I)
+
+_BOMS = (
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+)
+
+
+def charset_from_content_type(content_type: Optional[str]) -> Optional[str]:
+    """Get the charset parameter of a Content-Type header, if any"""
+    if not content_type:
+        return None
+    match = _HEADER_CHARSET_RE.search(content_type)
+    return match.group(1) if match else None
+
+
+def _lookup(charset: Optional[str]) -> Optional[str]:
+    if not charset:
+        return None
+    try:
+        return codecs.lookup(charset).name
+    except LookupError:
+        return None
+
+
+class _FallbackDecoder(object):
+    """Incremental UTF-8 decoder switching to windows-1252 on invalid UTF-8"""
+
+    def __init__(self) -> None:
+        self.charset = "utf-8"
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+
+    def decode(self, data: bytes, final: bool = False) -> str:
+        if self.charset != "utf-8":
+            return self._decoder.decode(data, final)
+        # Bytes of an incomplete character buffered from the previous chunk
+        buffered = self._decoder.getstate()[0]
+        try:
+            return self._decoder.decode(data, final)
+        except UnicodeDecodeError:
+            # Undeclared legacy encoding, most often Latin-1 or windows-1252
+            self.charset = "cp1252"
+            self._decoder = codecs.getincrementaldecoder("cp1252")(errors="replace")
+            return self._decoder.decode(buffered + data, final)
+
+
+class _Done(Exception):
+    pass
+
+
+class HeadParser(HTMLParser):
+    """Collect <title>, og:title and the fragment meta tag from a page head"""
+
+    def __init__(self, charset: Optional[str] = None) -> None:
+        super().__init__(convert_charrefs=True)
+        self.charset = _lookup(charset)
+        self.title: Optional[str] = None
+        self.og_title: Optional[str] = None
+        self.fragment: Optional[str] = None
+        self.done = False
+        self._pending = b""
+        self._decoder = None
+        self._title_parts: Optional[list] = None
+
+    def feed_bytes(self, data: bytes) -> bool:
+        """Feed a chunk of the raw page, returns True once the head is parsed"""
+        if self.done:
+            return True
+        if self._decoder is None:
+            self._pending += data
+            if len(self._pending) < _PRESCAN_BYTES:
+                return False
+            data, self._pending = self._pending, b""
+            self._start_decoding(data)
+        self._feed_text(self._decode(data))
+        return self.done
+
+    def close(self) -> None:
+        """Parse whatever has been buffered so far"""
+        if self._decoder is None:
+            data, self._pending = self._pending, b""
+            self._start_decoding(data)
+            self._feed_text(self._decode(data))
+        if not self.done:
+            self._feed_text(self._decode(b"", final=True))
+            self._finish()
+
+    def _start_decoding(self, data: bytes) -> None:
+        charset = self.charset
+        for bom, name in _BOMS:
+            if data.startswith(bom):
+                charset = name
+                break
+        if charset is None:
+            match = _META_CHARSET_RE.search(data[:_PRESCAN_BYTES])
+            if match:
+                charset = _lookup(match.group(1).decode("ascii"))
+        if charset is None:
+            self._decoder = _FallbackDecoder()
+        else:
+            self._decoder = codecs.getincrementaldecoder(charset)(errors="replace")
+        self.charset = charset or "utf-8"
+
+    def _decode(self, data: bytes, final: bool = False) -> str:
+        text = self._decoder.decode(data, final)
+        if isinstance(self._decoder, _FallbackDecoder):
+            self.charset = self._decoder.charset
+        return text
+
+    def _feed_text(self, text: str) -> None:
+        try:
+            self.feed(text)
+        except _Done:
+            self._finish()
+
+    def _finish(self) -> None:
+        self.done = True
+        if self._title_parts is not None:
+            self.title = "".join(self._title_parts)
+            self._title_parts = None
+
+    def handle_starttag(self, tag: str, attrs) -> None:
+        if tag == "body":
+            raise _Done()
+        if tag == "title" and self.title is None and self._title_parts is None:
+            self._title_parts = []
+        elif tag == "meta":
+            attributes: Dict[str, Optional[str]] = dict(attrs)
+            content = attributes.get("content")
+            if content is None:
+                return
+            if attributes.get("property") == "og:title" and self.og_title is None:
+                self.og_title = content
+            elif attributes.get("name") == "fragment" and self.fragment is None:
+                self.fragment = content
+
+    def handle_endtag(self, tag: str) -> None:
+        if tag == "title" and self._title_parts is not None:
+            self.title = "".join(self._title_parts)
+            self._title_parts = None
+        elif tag == "head":
+            raise _Done()
+
+    def handle_data(self, data: str) -> None:
+        if self._title_parts is not None:
+            self._title_parts.append(data)
+
+
+def parse_head(data: bytes, charset: Optional[str] = None) -> HeadParser:
+    """Parse the head of an already downloaded page"""
+    parser = HeadParser(charset)
+    parser.feed_bytes(data)
+    parser.close()
+    return parser
@@ -0,0 +1,349 @@
+# -*- coding: utf-8 -*-
+"""
+HTTP response cache for get_url
+
+Responses are kept in an in-memory LRU with a byte budget and optionally
+written through to an SQLite file so they survive restarts. Freshness follows
+Cache-Control (max-age, s-maxage, no-cache, no-store) and Expires. Stale
+entries with an ETag or Last-Modified validator are revalidated with a
+conditional request instead of being fetched again.
+
+A response's body is only stored once the caller has read all of it, so
+callers reading just the beginning of a page don't download the rest for the
+cache. The SQLite file keeps at most max_db_entries responses, those closest
+to expiring are dropped first.
+"""
+
+import json
+import time
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, Optional
+
+import requests
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+log = logging.getLogger("httpcache")
+
+# Headers of a 304 Not Modified response that update a stored entry
+REFRESH_HEADERS = ("Date", "Expires", "Cache-Control", "ETag", "Last-Modified")
+# Trim the SQLite file to max_db_entries every this many writes
+PRUNE_INTERVAL = 100
+
+
+def _parse_cache_control(value: str) -> Dict[str, Optional[str]]:
+    directives: Dict[str, Optional[str]] = {}
+    for part in value.split(","):
+        name, _, arg = part.strip().partition("=")
+        if name:
+            directives[name.lower()] = arg.strip('"') if arg else None
+    return directives
+
+
+def _parse_date(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+class _BodyRecorder(object):
+    """Wraps the raw stream of a response, calling done with the body once
+    it has been read to the end"""
+
+    def __init__(self, raw: Any, done: Any) -> None:
+        self._raw = raw
+        self._done = done
+
+    def stream(self, *args, **kwargs):
+        chunks = []
+        for chunk in self._raw.stream(*args, **kwargs):
+            chunks.append(chunk)
+            yield chunk
+        self._done(b"".join(chunks))
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._raw, name)
+
+
+class CacheEntry(object):
+    """A cached response and its freshness information"""
+
+    def __init__(
+        self,
+        url: str,
+        status: int,
+        headers: Dict[str, str],
+        content: bytes,
+        expires: float,
+    ) -> None:
+        self.url = url
+        self.status = status
+        self.headers = CaseInsensitiveDict(headers)
+        self.content = content
+        self.expires = expires
+
+    @property
+    def size(self) -> int:
+        return len(self.content)
+
+    def is_fresh(self, now: Optional[float] = None) -> bool:
+        return (now or time.time()) < self.expires
+
+    def conditional_headers(self) -> Dict[str, str]:
+        """Headers for revalidating this entry with the origin server"""
+        headers = {}
+        if "ETag" in self.headers:
+            headers["If-None-Match"] = self.headers["ETag"]
+        if "Last-Modified" in self.headers:
+            headers["If-Modified-Since"] = self.headers["Last-Modified"]
+        return headers
+
+    def to_response(self) -> requests.Response:
+        r = requests.Response()
+        r.status_code = self.status
+        r.headers = CaseInsensitiveDict(self.headers)
+        r.url = self.url
+        r.encoding = get_encoding_from_headers(r.headers)
+        r._content = self.content
+        r._content_consumed = True
+        r.from_cache = True  # type: ignore[attr-defined]
+        return r
+
+
+class HTTPCache(object):
+    """In-memory LRU of HTTP responses with an optional SQLite store"""
+
+    def __init__(
+        self,
+        max_bytes: int = 4 * 1024 * 1024,
+        max_entry_bytes: int = 512 * 1024,
+        path: Optional[str] = None,
+        max_db_entries: int = 10000,
+    ) -> None:
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.max_db_entries = max_db_entries
+        self._writes = 0
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self._entries: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses "
+                "(key TEXT PRIMARY KEY, url TEXT, status INTEGER, headers TEXT, "
+                "content BLOB, expires REAL);"
+            )
+            self._db.commit()
+            self._prune()
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> Optional["HTTPCache"]:
+        """Create a cache from the "http" section of the bot config"""
+        conf = config.get("http", {})
+        size_kb = conf.get("cache_size_kb", 4096)
+        if not size_kb:
+            return None
+        return cls(
+            max_bytes=size_kb * 1024,
+            max_entry_bytes=conf.get("cache_entry_size_kb", 512) * 1024,
+            path=conf.get("cache_path"),
+            max_db_entries=conf.get("cache_db_entries", 10000),
+        )
+
+    @staticmethod
+    def key(url, params=None, headers=None, cookies=None) -> str:
+        """Cache key for a request, custom headers and cookies included"""
+        prepared = requests.Request("GET", url, params=params).prepare()
+        key = prepared.url
+        if headers:
+            key += "|h:" + repr(sorted(headers.items()))
+        if cookies:
+            key += "|c:" + repr(sorted(dict(cookies).items()))
+        return key
+
+    def _expires(self, headers: CaseInsensitiveDict, now: float) -> Optional[float]:
+        """Expiry time for a response, None if it must not be stored"""
+        directives = _parse_cache_control(headers.get("Cache-Control", ""))
+        if "no-store" in directives:
+            return None
+        validators = "ETag" in headers or "Last-Modified" in headers
+        if "no-cache" in directives:
+            return now if validators else None
+
+        age = headers.get("Age", "0")
+        age = int(age) if age.isdigit() else 0
+        expires = None
+        for directive in ("s-maxage", "max-age"):
+            value = directives.get(directive)
+            if value is not None and value.isdigit():
+                expires = now + int(value) - age
+                break
+        else:
+            date = _parse_date(headers.get("Expires"))
+            if date is not None:
+                expires = now + (date - (_parse_date(headers.get("Date")) or now))
+
+        if expires is not None and expires > now:
+            return expires
+        if validators:
+            # Store, but revalidate on every use
+            return now
+        # Already stale and can't be revalidated, no use storing it
+        return None
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry
+        entry = self._load(key)
+        if entry is not None:
+            with self._lock:
+                self._put(key, entry)
+        return entry
+
+    def lookup(self, key: str) -> Optional[requests.Response]:
+        """Return a cached response if a fresh one exists"""
+        entry = self.get(key)
+        if entry is not None and entry.is_fresh():
+            self.hits += 1
+            return entry.to_response()
+        self.misses += 1
+        return None
+
+    def store(self, key: str, r: requests.Response) -> None:
+        """Store a response if it's cacheable
+
+        The body isn't read here: a streamed response is stored once the
+        caller has read all of it."""
+        if r.status_code != 200:
+            return
+        length = r.headers.get("Content-Length")
+        if not length or not length.isdigit() or int(length) > self.max_entry_bytes:
+            return
+        expires = self._expires(r.headers, time.time())
+        if expires is None:
+            return
+        entry = CacheEntry(r.url, r.status_code, dict(r.headers), b"", expires)
+        if r._content is not False or r.raw is None:
+            self._store_entry(key, entry, r.content)
+        else:
+            r.raw = _BodyRecorder(
+                r.raw, lambda content: self._store_entry(key, entry, content)
+            )
+
+    def _store_entry(self, key: str, entry: CacheEntry, content: bytes) -> None:
+        entry.content = content
+        with self._lock:
+            self._put(key, entry)
+        self._save(key, entry)
+
+    def refresh(self, key: str, entry: CacheEntry, r: requests.Response) -> None:
+        """Update a stale entry from a 304 Not Modified response"""
+        self.revalidated += 1
+        for name in REFRESH_HEADERS:
+            if name in r.headers:
+                entry.headers[name] = r.headers[name]
+        expires = self._expires(entry.headers, time.time())
+        if expires is None:
+            self.remove(key)
+            return
+        entry.expires = expires
+        self._save(key, entry)
+
+    def remove(self, key: str) -> None:
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self.size -= entry.size
+        if self._db is not None:
+            with self._lock:
+                self._db.execute("DELETE FROM responses WHERE key = ?;", (key,))
+                self._db.commit()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+            if self._db is not None:
+                self._db.execute("DELETE FROM responses;")
+                self._db.commit()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "entries": len(self._entries),
+            "bytes": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "revalidated": self.revalidated,
+        }
+
+    def _put(self, key: str, entry: CacheEntry) -> None:
+        """Add an entry to the LRU, evicting old ones. Caller holds the lock."""
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.size -= old.size
+        if entry.size > self.max_bytes:
+            return
+        self._entries[key] = entry
+        self.size += entry.size
+        while self.size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.size -= evicted.size
+
+    def _load(self, key: str) -> Optional[CacheEntry]:
+        if self._db is None:
+            return None
+        with self._lock:
+            row = self._db.execute(
+                "SELECT url, status, headers, content, expires FROM responses "
+                "WHERE key = ?;",
+                (key,),
+            ).fetchone()
+        if not row:
+            return None
+        url, status, headers, content, expires = row
+        return CacheEntry(url, status, json.loads(headers), content, expires)
+
+    def _save(self, key: str, entry: CacheEntry) -> None:
+        if self._db is None:
+            return
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?);",
+                (
+                    key,
+                    entry.url,
+                    entry.status,
+                    json.dumps(dict(entry.headers)),
+                    entry.content,
+                    entry.expires,
+                ),
+            )
+            self._db.commit()
+            self._writes += 1
+        if self._writes % PRUNE_INTERVAL == 0:
+            self._prune()
+
+    def _prune(self) -> None:
+        """Drop the entries closest to expiring over max_db_entries"""
+        with self._lock:
+            self._db.execute(
+                "DELETE FROM responses WHERE key IN (SELECT key FROM responses "
+                "ORDER BY expires DESC LIMIT -1 OFFSET ?);",
+                (self.max_db_entries,),
+            )
+            self._db.commit()
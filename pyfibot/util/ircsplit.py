@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""
+Split messages into IRC lines by encoded length
+
+Servers limit lines to 512 bytes, so the limit for the text of a message is
+in UTF-8 bytes too: a line of Finnish text fits fewer characters than one of
+ASCII. split() breaks text at spaces where possible and never in the middle of
+a character. Like textwrap, other whitespace (newlines, tabs) is turned into
+spaces and whitespace around the breaks is dropped.
+
+Most messages fit on a single line. Those are recognized from their length in
+characters and returned without encoding them.
+"""
+
+from typing import List
+
+# Worst case length of a character in UTF-8
+MAX_CHAR_BYTES = 4
+
+_WHITESPACE = {ord(c): " " for c in "\t\n\x0b\x0c\r"}
+
+
+def split(text: str, max_bytes: int, continuation: str = "...") -> List[str]:
+    """Split text into lines of at most max_bytes bytes when encoded
+
+    Lines after the first are prefixed with continuation. Returns an empty
+    list for text that is empty or only whitespace."""
+    cont = continuation.encode("utf-8")
+    if max_bytes - len(cont) < MAX_CHAR_BYTES:
+        raise ValueError("max_bytes %d is too small to split text" % max_bytes)
+
+    # Fast path: text that fits even if every character took the most bytes
+    # possible, or ASCII text that fits, and has no line breaks or trailing
+    # whitespace to clean up
+    if (
+        len(text) <= max_bytes
+        and (len(text) * MAX_CHAR_BYTES <= max_bytes or text.isascii())
+        and text
+        and text[-1] > " "
+        and text.isprintable()
+    ):
+        return [text]
+
+    data = text.translate(_WHITESPACE).rstrip().encode("utf-8")
+    lines: List[bytes] = []
+    prefix = b""
+    while data:
+        budget = max_bytes - len(prefix)
+        if len(data) <= budget:
+            lines.append(prefix + data)
+            break
+        cut = data.rfind(b" ", 0, budget + 1)
+        if cut > 0:
+            rest = data[cut + 1 :]
+        else:
+            # No space to break at, don't split a multibyte character
+            cut = budget
+            while data[cut] & 0xC0 == 0x80:
+                cut -= 1
+            rest = data[cut:]
+        line = data[:cut].rstrip(b" ")
+        if line:
+            lines.append(prefix + line)
+            prefix = cont
+        data = rest.lstrip(b" ")
+    return [line.decode("utf-8") for line in lines]
@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+"""
+Scheduler for lines sent to an IRC server
+
+Twisted's IRCClient sends everything through a single FIFO paced by lineRate,
+so a long burst of output to one channel delays everything queued after it.
+OutgoingScheduler keeps a queue per target (channel or nick) in three priority
+classes: protocol commands like MODE and KICK first, then replies to commands,
+then bulk output like RSS announcements. Within a class, targets take turns
+line by line. Protocol commands are always sent in the order they were queued.
+
+Lines are paced by a token bucket: up to burst lines can be sent back to back,
+after that one line every interval seconds. With burst 1 this is the same
+pacing as lineRate.
+
+Coalescing is off by default. When enabled, a message is held for coalesce
+seconds before it's sent, and consecutive messages to the same target queued
+meanwhile (or while waiting for the token bucket) are appended to it, as long
+as the combined line fits in max_line bytes.
+"""
+
+import time
+import threading
+from collections import OrderedDict, deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+URGENT = 0
+REPLY = 1
+BULK = 2
+PRIORITY_NAMES = ("urgent", "reply", "bulk")
+
+# Commands sent with the priority given by the caller, everything else is urgent
+MESSAGE_COMMANDS = frozenset(["PRIVMSG", "NOTICE"])
+
+# Longest line a server accepts, without the CRLF
+MAX_LINE = 510
+# Between the texts of coalesced messages
+SEPARATOR = " | "
+# CTCP messages (like ACTION) are never coalesced
+CTCP = "\x01"
+
+
+def classify(line: str, priority: int = REPLY) -> Tuple[int, str]:
+    """Return (priority, target) for a raw IRC line"""
+    parts = line.split(" ", 2)
+    if parts[0].upper() not in MESSAGE_COMMANDS or len(parts) < 2:
+        # Protocol commands share a queue, their order matters (NICK and USER
+        # before anything else, JOIN before MODE)
+        return URGENT, ""
+    return priority, parts[1].lower()
+
+
+class TokenBucket(object):
+    """Allow burst events at once, refilled at one per interval seconds"""
+
+    def __init__(
+        self,
+        interval: float,
+        burst: int = 1,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.interval = interval
+        self.burst = max(1, burst)
+        self.clock = clock
+        self.tokens = float(self.burst)
+        self.updated = clock()
+
+    def _refill(self, now: float) -> None:
+        if self.interval <= 0:
+            self.tokens = float(self.burst)
+        else:
+            elapsed = now - self.updated
+            self.tokens = min(self.burst, self.tokens + elapsed / self.interval)
+        self.updated = now
+
+    def take(self) -> float:
+        """Take a token, return 0 on success or seconds until one is available"""
+        self._refill(self.clock())
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) * self.interval
+
+
+class OutgoingScheduler(object):
+    """Per-target priority queues for outgoing lines"""
+
+    def __init__(
+        self,
+        interval: float,
+        burst: int = 1,
+        clock: Callable[[], float] = time.monotonic,
+        coalesce: float = 0.0,
+        max_line: int = MAX_LINE,
+    ) -> None:
+        self.clock = clock
+        self.bucket = TokenBucket(interval, burst, clock)
+        self.coalesce = coalesce
+        self.max_line = max_line
+        # priority -> target -> [queued at, send after, line], targets in the
+        # order they take turns
+        self._queues: List["OrderedDict[str, Deque[List[Any]]]"] = [
+            OrderedDict() for _ in PRIORITY_NAMES
+        ]
+        self._lock = threading.Lock()
+        # True while a call to drain has been or will be scheduled
+        self._scheduled = False
+        # When the scheduled call is due, None if it's made right away
+        self._wake_at: Optional[float] = None
+        self._sent = [0] * len(PRIORITY_NAMES)
+        self._wait_total = [0.0] * len(PRIORITY_NAMES)
+        self._wait_max = [0.0] * len(PRIORITY_NAMES)
+        self._coalesced = 0
+
+    def __len__(self) -> int:
+        return sum(len(q) for queues in self._queues for q in queues.values())
+
+    def _merge(self, queued: str, line: str) -> Optional[str]:
+        """Append the text of message line to queued, None if they can't merge"""
+        prefix, sep, text = line.partition(" :")
+        if not queued.startswith(prefix + sep) or CTCP in text or CTCP in queued:
+            return None
+        merged = queued + SEPARATOR + text
+        if len(merged.encode("utf-8")) > self.max_line:
+            return None
+        return merged
+
+    def push(self, line: str, priority: int = REPLY) -> bool:
+        """Queue a line, return True if a call to drain should be scheduled"""
+        priority, target = classify(line, priority)
+        with self._lock:
+            now = self.clock()
+            queues = self._queues[priority]
+            queue = queues.get(target)
+            if queue is None:
+                queue = queues[target] = deque()
+            merged = None
+            send_after = now
+            if self.coalesce > 0 and priority != URGENT:
+                if queue:
+                    merged = self._merge(queue[-1][2], line)
+                if merged is not None:
+                    queue[-1][2] = merged
+                    self._coalesced += 1
+                else:
+                    # Give following messages a moment to be merged into this
+                    send_after = now + self.coalesce
+                    queue.append([now, send_after, line])
+            else:
+                queue.append([now, now, line])
+            if self._scheduled:
+                # Don't let a line that's ready sooner wait for a call
+                # scheduled for held messages
+                if merged is None and self._wake_at is not None:
+                    if send_after < self._wake_at:
+                        self._wake_at = None
+                        return True
+                return False
+            self._scheduled = True
+            self._wake_at = None
+            return True
+
+    def _next(self, now: float) -> Tuple[Optional[Tuple[int, str]], float]:
+        """Find the queue to send from next, or how long until one is ready"""
+        ready_at = float("inf")
+        for priority, queues in enumerate(self._queues):
+            for target, queue in queues.items():
+                send_after = queue[0][1]
+                if send_after <= now:
+                    return (priority, target), 0.0
+                ready_at = min(ready_at, send_after)
+        return None, ready_at - now
+
+    def _pop(self, priority: int, target: str, now: float) -> str:
+        queues = self._queues[priority]
+        # Move the target to the back of the line, or drop its empty queue
+        queue = queues.pop(target)
+        queued_at, _, line = queue.popleft()
+        if queue:
+            queues[target] = queue
+        wait = now - queued_at
+        self._sent[priority] += 1
+        self._wait_total[priority] += wait
+        self._wait_max[priority] = max(self._wait_max[priority], wait)
+        return line
+
+    def drain(self, send: Callable[[str], Any]) -> Optional[float]:
+        """Send lines the token bucket allows
+
+        Return the number of seconds until drain should be called again, None
+        if the queues are empty. push() returns True when a line is queued
+        that should be sent before that, the pending call should then be
+        replaced with one made right away."""
+        while True:
+            with self._lock:
+                self._wake_at = None
+                if not len(self):
+                    self._scheduled = False
+                    return None
+                now = self.clock()
+                found, delay = self._next(now)
+                if found is None:
+                    self._wake_at = now + delay
+                    return delay
+                delay = self.bucket.take()
+                if delay > 0:
+                    self._wake_at = now + delay
+                    return delay
+                line = self._pop(found[0], found[1], now)
+            send(line)
+
+    def clear(self) -> None:
+        with self._lock:
+            for queues in self._queues:
+                queues.clear()
+            self._scheduled = False
+            self._wake_at = None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            depth: Dict[str, int] = {}
+            for queues in self._queues:
+                for target, queue in queues.items():
+                    depth[target] = depth.get(target, 0) + len(queue)
+            return {
+                "queued": sum(depth.values()),
+                "depth": depth,
+                "sent": dict(zip(PRIORITY_NAMES, self._sent)),
+                "wait_avg": {
+                    name: (
+                        self._wait_total[i] / self._sent[i] if self._sent[i] else 0.0
+                    )
+                    for i, name in enumerate(PRIORITY_NAMES)
+                },
+                "wait_max": dict(zip(PRIORITY_NAMES, self._wait_max)),
+                "coalesced": self._coalesced,
+            }
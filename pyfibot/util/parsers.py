@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""
+Parsers run in the process pool
+
+Functions here take the raw content of a page or document and return plain
+values (strings, numbers, lists and dicts of them), so they can be called
+with CPUPool.run and their results pickled back from the worker process.
+"""
+
+from math import isnan
+from typing import Dict, List, Optional, Tuple
+
+import feedparser
+from bs4 import BeautifulSoup
+
+
+def parse_head(content: bytes) -> Tuple[Optional[str], Optional[str], Optional[str]]:
+    """Return the title, og:title and fragment meta of an HTML document"""
+    bs = BeautifulSoup(content, "html.parser")
+    title = bs.find("title")
+    og_title = bs.find("meta", {"property": "og:title"})
+    fragment = bs.find("meta", {"name": "fragment"})
+    return (
+        title.text if title else None,
+        og_title.get("content") if og_title else None,
+        fragment.get("content") if fragment else None,
+    )
+
+
+def parse_feed(content: bytes) -> Tuple[str, List[Dict[str, str]]]:
+    """Return the title and the items of an RSS or Atom feed document"""
+    # feedparser would download a url given instead, in the worker process
+    if not isinstance(content, bytes):
+        raise TypeError("parse_feed takes the feed document as bytes")
+    f = feedparser.parse(content)
+    items = [{"title": i["title"], "link": i["link"]} for i in f["items"]]
+    return f["channel"].get("title", ""), items
+
+
+def parse_fmi_observations(text: str) -> Tuple[Optional[str], Dict[str, float]]:
+    """Return the place name and latest observed values of an FMI weather
+    observation response, None for the place if it wasn't found"""
+    bs = BeautifulSoup(text)
+
+    # Get FMI name, gives the observation place more accurately
+    place = bs.find("gml:name")
+    if place is None:
+        return None, {}
+
+    # Loop through measurement time series -objects and gather values
+    values = {}
+    for mts in bs.find_all("wml2:measurementtimeseries"):
+        # Get the identifier from mts-tag
+        target = mts["gml:id"].split("-")[-1]
+        # Get last value from measurements (always sorted by time)
+        value = float(mts.find_all("wml2:value")[-1].text)
+        # NaN is returned, if observation doesn't exist
+        if not isnan(value):
+            values[target] = value
+    return place.text, values
@@ -10,276 +10,42 @@
 
 __version__ = "3.0.3"
 
+import os
 import re
 import string
-from typing import List
-
-_countrycodes = [
-    "ac",
-    "ad",
-    "ae",
-    "af",
-    "ag",
-    "ai",
-    "al",
-    "am",
-    "an",
-    "ao",
-    "aq",
-    "ar",
-    "as",
-    "at",
-    "au",
-    "aw",
-    "ax",
-    "az",
-    "ba",
-    "bb",
-    "bd",
-    "be",
-    "bf",
-    "bg",
-    "bh",
-    "bi",
-    "bj",
-    "bm",
-    "bn",
-    "bo",
-    "br",
-    "bs",
-    "bt",
-    "bv",
-    "bw",
-    "by",
-    "bz",
-    "ca",
-    "cc",
-    "cd",
-    "cf",
-    "cg",
-    "ch",
-    "ci",
-    "ck",
-    "cl",
-    "cm",
-    "cn",
-    "co",
-    "cr",
-    "cs",
-    "cu",
-    "cv",
-    "cx",
-    "cy",
-    "cz",
-    "de",
-    "dj",
-    "dk",
-    "dm",
-    "do",
-    "dz",
-    "ec",
-    "ee",
-    "eg",
-    "eh",
-    "er",
-    "es",
-    "et",
-    "fi",
-    "fj",
-    "fk",
-    "fm",
-    "fo",
-    "fr",
-    "ga",
-    "gb",
-    "gd",
-    "ge",
-    "gf",
-    "gg",
-    "gh",
-    "gi",
-    "gl",
-    "gm",
-    "gn",
-    "gp",
-    "gq",
-    "gr",
-    "gs",
-    "gt",
-    "gu",
-    "gw",
-    "gy",
-    "hk",
-    "hm",
-    "hn",
-    "hr",
-    "ht",
-    "hu",
-    "id",
-    "ie",
-    "il",
-    "im",
-    "in",
-    "io",
-    "iq",
-    "ir",
-    "is",
-    "it",
-    "je",
-    "jm",
-    "jo",
-    "jp",
-    "ke",
-    "kg",
-    "kh",
-    "ki",
-    "km",
-    "kn",
-    "kp",
-    "kr",
-    "kw",
-    "ky",
-    "kz",
-    "la",
-    "lb",
-    "lc",
-    "li",
-    "lk",
-    "lr",
-    "ls",
-    "lt",
-    "lu",
-    "lv",
-    "ly",
-    "ma",
-    "mc",
-    "md",
-    "mg",
-    "mh",
-    "mk",
-    "ml",
-    "mm",
-    "mn",
-    "mo",
-    "mp",
-    "mq",
-    "mr",
-    "ms",
-    "mt",
-    "mu",
-    "mv",
-    "mw",
-    "mx",
-    "my",
-    "mz",
-    "na",
-    "nc",
-    "ne",
-    "nf",
-    "ng",
-    "ni",
-    "nl",
-    "no",
-    "np",
-    "nr",
-    "nu",
-    "nz",
-    "om",
-    "pa",
-    "pe",
-    "pf",
-    "pg",
-    "ph",
-    "pk",
-    "pl",
-    "pm",
-    "pn",
-    "pr",
-    "ps",
-    "pt",
-    "pw",
-    "py",
-    "qa",
-    "re",
-    "ro",
-    "ru",
-    "rw",
-    "sa",
-    "sb",
-    "sc",
-    "sd",
-    "se",
-    "sg",
-    "sh",
-    "si",
-    "sj",
-    "sk",
-    "sl",
-    "sm",
-    "sn",
-    "so",
-    "sr",
-    "st",
-    "sv",
-    "sy",
-    "sz",
-    "tc",
-    "td",
-    "tf",
-    "tg",
-    "th",
-    "tj",
-    "tk",
-    "tl",
-    "tm",
-    "tn",
-    "to",
-    "tp",
-    "tr",
-    "tt",
-    "tv",
-    "tw",
-    "tz",
-    "ua",
-    "ug",
-    "uk",
-    "um",
-    "us",
-    "uy",
-    "uz",
-    "va",
-    "vc",
-    "ve",
-    "vg",
-    "vi",
-    "vn",
-    "vu",
-    "wf",
-    "ws",
-    "ye",
-    "yt",
-    "yu",
-    "za",
-    "zm",
-    "zw",
-    "aero",
-    "biz",
-    "com",
-    "coop",
-    "edu",
-    "gov",
-    "info",
-    "int",
-    "mil",
-    "museum",
-    "name",
-    "net",
-    "org",
-    "pro",
-    "me",
-    "mobi",
-    "xxx",
-]
+import itertools
+import functools
+import multiprocessing
+from typing import FrozenSet, Iterable, Iterator, List
+
+# Bundled list of top-level domains, replace with a newer one with update_tlds()
+TLD_FILE = os.path.join(os.path.dirname(__file__), "tlds.dat")
+
+
+def load_tlds(path: str = TLD_FILE) -> FrozenSet[str]:
+    """Read top-level domains from a Public Suffix List format file"""
+    tlds = set()
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            rule = line.split()[0] if line.strip() else ""
+            if not rule or rule.startswith("//"):
+                continue
+            label = rule.lstrip("!").rsplit(".", 1)[-1].lower()
+            try:
+                # hostRe only matches ASCII, internationalized TLDs as punycode
+                tlds.add(label.encode("idna").decode("ascii"))
+            except UnicodeError:
+                continue
+    return frozenset(tlds)
+
+
+def update_tlds(path: str = TLD_FILE) -> None:
+    """Replace the recognized top-level domains with the ones in path"""
+    global _countrycodes
+    _countrycodes = load_tlds(path)
+
+
+_countrycodes = load_tlds()
 
 _schemes = ["http://", "https://", "ftp://", "svn://"]
 
@@ -381,12 +147,31 @@ validPathChars = "".join(validPathChars)
 validUserinfoChars = "".join(validUserinfoChars)
 
 hostRe = re.compile(_host, re.VERBOSE | re.MULTILINE | re.I)
+# Runs of path characters, and of userinfo characters in the reversed string
+pathRe = re.compile("[%s]*" % re.escape(validPathChars))
+userinfoRe = re.compile("[%s]*" % re.escape(validUserinfoChars))
+
+# Any url grab() accepts without needScheme has a dot between letters or
+# digits (hostname or ipv4) or a [ (ipv6)
+_hostCandidateRe = re.compile(r"[a-z0-9]\.[a-z0-9]|\[", re.I)
+
+
+def may_contain_url(txt: str, needScheme: bool = True) -> bool:
+    """Cheap check for text that can't contain an url, before the full scan"""
+    if needScheme:
+        # every scheme ends with ://
+        return "://" in txt
+    return _hostCandidateRe.search(txt) is not None
 
 
 def grab(txt: str, needScheme: bool = True) -> List[str]:
+    if not may_contain_url(txt, needScheme):
+        return []
+
     seekpos: int = 0
 
     possibleUrls: List[str] = []
+    reversedTxt = None
 
     # Try to find all possible URI's
     while 1:
@@ -422,12 +207,10 @@ def grab(txt: str, needScheme: bool = True) -> List[str]:
 
         # Check if there is userinfo in URI
         if s > 1 and txt[s - 1] == "@":
-            s -= 1
-
-            while s >= 0 and txt[s] in validUserinfoChars:
-                s -= 1
-
-            s += 1
+            # Scan backwards from the @ by matching forwards in reversed text
+            if reversedTxt is None:
+                reversedTxt = txt[::-1]
+            s -= userinfoRe.match(reversedTxt, len(txt) - s).end() - (len(txt) - s)
 
         # Check if there is scheme
         schemeFound = False
@@ -443,8 +226,7 @@ def grab(txt: str, needScheme: bool = True) -> List[str]:
             continue
 
         # Try to figure out rest of URI
-        while e < len(txt) and txt[e] in validPathChars:
-            e += 1
+        e = pathRe.match(txt, e).end()
 
         # Some silly hack
         ns = s
@@ -464,3 +246,35 @@ def grab(txt: str, needScheme: bool = True) -> List[str]:
         seekpos = e
 
     return possibleUrls
+
+
+def _grab_lines(lines: List[str], needScheme: bool) -> List[List[str]]:
+    return [grab(line, needScheme) for line in lines]
+
+
+def grab_many(
+    lines: Iterable[str],
+    needScheme: bool = True,
+    processes: int = 1,
+    chunksize: int = 1000,
+) -> Iterator[List[str]]:
+    """Find URLs from many strings, yielding grab()'s result for each in order
+
+    Lines are read lazily in chunks, so arbitrarily large inputs (like log
+    files) can be processed. Lines which can't contain an URL are skipped
+    with a cheap check. With processes > 1 chunks are spread over a pool of
+    worker processes."""
+
+    it = iter(lines)
+    chunks = iter(lambda: list(itertools.islice(it, chunksize)), [])
+    grab_lines = functools.partial(_grab_lines, needScheme=needScheme)
+
+    if processes <= 1:
+        for chunk in chunks:
+            yield from grab_lines(chunk)
+        return
+
+    # Forking a process with threads (like the bot) can deadlock the children
+    with multiprocessing.get_context("spawn").Pool(processes) as pool:
+        for result in pool.imap(grab_lines, chunks):
+            yield from result
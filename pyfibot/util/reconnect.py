@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""
+Reconnect delays and connection health per network
+
+Reconnecting after a fixed delay makes every bot that lost its connection in
+a network outage come back at the same moment, over and over. Backoff doubles
+the delay after each failed attempt up to max_delay, and randomizes it with
+jitter so the attempts spread out.
+
+NetworkHealth tracks the connection state of one network and rotates through
+its servers when connecting to one fails. A connection that was up for at
+least stable_after seconds resets the backoff.
+"""
+
+import time
+import random
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+log = logging.getLogger("reconnect")
+
+CONNECTING = "connecting"
+CONNECTED = "connected"
+WAITING = "waiting"
+STOPPED = "stopped"
+
+
+class Backoff(object):
+    """Exponentially growing delays with jitter"""
+
+    def __init__(
+        self,
+        min_delay: float = 10,
+        max_delay: float = 600,
+        factor: float = 2,
+        jitter: float = 0.5,
+        stable_after: float = 60,
+    ) -> None:
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.factor = factor
+        self.jitter = jitter
+        self.stable_after = stable_after
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> "Backoff":
+        """Create a backoff from the "reconnect" section of the bot config"""
+        conf = config.get("reconnect", {})
+        return cls(
+            min_delay=conf.get("min_delay", 10),
+            max_delay=conf.get("max_delay", 600),
+            factor=conf.get("factor", 2),
+            jitter=conf.get("jitter", 0.5),
+            stable_after=conf.get("stable_after", 60),
+        )
+
+    def delay(self, failures: int) -> float:
+        """Seconds to wait before the next attempt after failures in a row"""
+        delay = min(self.max_delay, self.min_delay * self.factor**failures)
+        # Random delay between (1 - jitter) * delay and delay
+        return delay * (1 - self.jitter * random.random())
+
+
+class NetworkHealth(object):
+    """Connection state and reconnect schedule of a network"""
+
+    def __init__(
+        self,
+        servers: List[Tuple[str, int]],
+        backoff: Optional[Backoff] = None,
+        clock: Any = time.time,
+    ) -> None:
+        self.servers = servers
+        self.backoff = backoff or Backoff()
+        self.clock = clock
+        self.state = STOPPED
+        self.server_index = 0
+        self.failures = 0
+        self.attempts = 0
+        self.last_error: Optional[str] = None
+        self.connected_since: Optional[float] = None
+        self.next_attempt: Optional[float] = None
+
+    @property
+    def server(self) -> Tuple[str, int]:
+        return self.servers[self.server_index]
+
+    def connecting(self) -> Tuple[str, int]:
+        """Start an attempt, return the server to connect to"""
+        self.state = CONNECTING
+        self.attempts += 1
+        self.next_attempt = None
+        return self.server
+
+    def connected(self) -> None:
+        self.state = CONNECTED
+        self.connected_since = self.clock()
+
+    def _retry(self, error: str) -> float:
+        self.last_error = error
+        delay = self.backoff.delay(self.failures)
+        self.failures += 1
+        self.state = WAITING
+        self.next_attempt = self.clock() + delay
+        return delay
+
+    def lost(self, error: str) -> float:
+        """Connection was lost, return the delay before reconnecting"""
+        if self.connected_since is not None:
+            if self.clock() - self.connected_since >= self.backoff.stable_after:
+                self.failures = 0
+        self.connected_since = None
+        return self._retry(error)
+
+    def failed(self, error: str) -> float:
+        """Connecting failed, return the delay before trying the next server"""
+        self.server_index = (self.server_index + 1) % len(self.servers)
+        return self._retry(error)
+
+    def stopped(self) -> None:
+        """The bot quit, don't reconnect"""
+        self.state = STOPPED
+        self.connected_since = None
+        self.next_attempt = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "server": "%s:%d" % self.server,
+            "attempts": self.attempts,
+            "failures": self.failures,
+            "last_error": self.last_error,
+            "connected_since": self.connected_since,
+            "next_attempt": self.next_attempt,
+        }
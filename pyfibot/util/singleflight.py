@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""
+Coalescing of concurrent identical calls
+
+When several threads ask for the same key at the same time, only the first
+one runs the call. The rest wait for it to finish and get its result, or its
+exception. Nothing is cached: a call for the key made after the first one
+has finished runs again.
+"""
+
+import threading
+from typing import Any, Callable, Dict, Hashable
+
+
+class _Call(object):
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Any = None
+
+
+class SingleFlight(object):
+    """Share the result of a call between threads asking for the same key"""
+
+    def __init__(self) -> None:
+        self.calls = 0
+        self.shared = 0
+        self._lock = threading.Lock()
+        self._inflight: Dict[Hashable, _Call] = {}
+
+    def do(self, key: Hashable, func: Callable, *args, **kwargs) -> Any:
+        """Return func(*args, **kwargs), or the result of a call already in
+        progress for key"""
+        with self._lock:
+            call = self._inflight.get(key)
+            leader = call is None
+            if leader:
+                call = self._inflight[key] = _Call()
+                self.calls += 1
+            else:
+                self.shared += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func(*args, **kwargs)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            call.done.set()
+        return call.result
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "calls": self.calls,
+            "shared": self.shared,
+            "inflight": len(self._inflight),
+        }
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""
+Expiring LRU cache for URL titles
+
+Caches are kept in a registry in this module instead of in the modules using
+them. Bot modules are re-executed on every rehash, but this module is only
+imported once, so shared() hands the same cache back after a rehash, settings
+and entries untouched. A cache can also be written through to an SQLite file
+to survive restarts.
+"""
+
+import json
+import time
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+log = logging.getLogger("titlecache")
+
+_caches: Dict[str, "TitleCache"] = {}
+
+
+def _decode(value: Any) -> Any:
+    # JSON has no tuples, (title, info) pairs come back as lists
+    return tuple(value) if isinstance(value, list) else value
+
+
+class TitleCache(object):
+    """Thread safe LRU cache where every entry expires after its own TTL"""
+
+    def __init__(
+        self, capacity: int = 1000, ttl: float = 300, path: Optional[str] = None
+    ) -> None:
+        self.capacity = capacity
+        self.ttl = ttl
+        self.path: Optional[str] = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[str, Tuple[Any, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self._open(path)
+
+    def configure(
+        self, capacity: int = 1000, ttl: float = 300, path: Optional[str] = None
+    ) -> None:
+        """Change the cache settings, keeping the entries that still fit"""
+        with self._lock:
+            self.capacity = capacity
+            self.ttl = ttl
+        # The file is trimmed to the new capacity when it's opened
+        if path != self.path:
+            self._open(path)
+        with self._lock:
+            self._evict()
+
+    def _open(self, path: Optional[str]) -> None:
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+            self.path = path
+            if not path:
+                return
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS titles "
+                "(key TEXT PRIMARY KEY, value TEXT, expires REAL);"
+            )
+            # Drop expired entries, and the oldest ones if capacity was reduced
+            self._db.execute("DELETE FROM titles WHERE expires <= ?;", (time.time(),))
+            self._db.execute(
+                "DELETE FROM titles WHERE key NOT IN "
+                "(SELECT key FROM titles ORDER BY expires DESC LIMIT ?);",
+                (self.capacity,),
+            )
+            self._db.commit()
+
+    def get(self, key: str) -> Any:
+        """Return the cached value for key, None if missing or expired"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None and self._db is not None:
+                row = self._db.execute(
+                    "SELECT value, expires FROM titles WHERE key = ?;", (key,)
+                ).fetchone()
+                if row:
+                    entry = (_decode(json.loads(row[0])), row[1])
+                    self._entries[key] = entry
+                    self._evict()
+            if entry is None or entry[1] <= now:
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        """Cache value for ttl seconds, or the cache default"""
+        expires = time.time() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._entries[key] = (value, expires)
+            self._entries.move_to_end(key)
+            self._evict()
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO titles VALUES (?, ?, ?);",
+                    (key, json.dumps(value), expires),
+                )
+                self._db.commit()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM titles;")
+                self._db.commit()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def _remove(self, key: str) -> None:
+        """Drop an expired entry. Caller holds the lock."""
+        self._entries.pop(key, None)
+        if self._db is not None:
+            self._db.execute("DELETE FROM titles WHERE key = ?;", (key,))
+            self._db.commit()
+
+    def _evict(self) -> None:
+        """Drop least recently used entries over capacity. Caller holds the lock."""
+        while len(self._entries) > self.capacity:
+            key, _ = self._entries.popitem(last=False)
+            self.evictions += 1
+            if self._db is not None:
+                self._db.execute("DELETE FROM titles WHERE key = ?;", (key,))
+                self._db.commit()
+
+
+def shared(
+    name: str, capacity: int = 1000, ttl: float = 300, path: Optional[str] = None
+) -> TitleCache:
+    """Get the cache called name, creating it with the given settings if it
+    doesn't exist yet. An existing cache is returned as is, use configure()
+    to change its settings."""
+    cache = _caches.get(name)
+    if cache is None:
+        cache = _caches[name] = TitleCache(capacity, ttl, path)
+    return cache
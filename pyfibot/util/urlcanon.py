@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+Canonical forms of urls for use as cache keys
+
+Urls pointing to the same thing are often written differently: tracking
+parameters appended by share buttons, upper case host names, explicit default
+ports. canonicalize() removes those differences. For some sites, urls are
+further reduced to the id of the thing they point to, so that for example
+youtu.be and youtube.com links to the same video share a key.
+
+The result is only meant for comparing urls, not for fetching them.
+"""
+
+import re
+import urllib.parse as urlparse
+from typing import Callable, Dict, Optional
+
+# Query parameters that only track where a link was shared from
+TRACKING_PARAMS = frozenset(
+    [
+        "fbclid",
+        "gclid",
+        "dclid",
+        "msclkid",
+        "igshid",
+        "mc_cid",
+        "mc_eid",
+        "si",
+        "ref_src",
+        "ref_url",
+        "_hsenc",
+        "_hsmi",
+        "yclid",
+    ]
+)
+TRACKING_PREFIXES = ("utm_",)
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+_YOUTUBE_ID = re.compile(r"^[A-Za-z0-9_-]{11}$")
+
+
+def _youtube(parts: urlparse.SplitResult) -> Optional[str]:
+    path = parts.path.strip("/").split("/")
+    if parts.hostname == "youtu.be":
+        video = path[0]
+    elif path[0] == "watch":
+        video = urlparse.parse_qs(parts.query).get("v", [""])[0]
+    elif path[0] in ("shorts", "embed", "live", "v") and len(path) > 1:
+        video = path[1]
+    else:
+        return None
+    if not _YOUTUBE_ID.match(video):
+        return None
+    return "youtube:%s" % video
+
+
+# host -> function returning a site specific key for an url, or None
+SITE_RULES: Dict[str, Callable[[urlparse.SplitResult], Optional[str]]] = {
+    "youtube.com": _youtube,
+    "www.youtube.com": _youtube,
+    "m.youtube.com": _youtube,
+    "music.youtube.com": _youtube,
+    "youtu.be": _youtube,
+}
+
+
+def _is_tracking(param: str) -> bool:
+    name = urlparse.unquote_plus(param.partition("=")[0]).lower()
+    return name in TRACKING_PARAMS or name.startswith(TRACKING_PREFIXES)
+
+
+def canonicalize(url: str) -> str:
+    """Return the canonical form of url, or url itself if it can't be parsed"""
+    try:
+        parts = urlparse.urlsplit(url)
+        port = parts.port
+    except ValueError:
+        return url
+    if not parts.scheme or not parts.hostname:
+        return url
+
+    rule = SITE_RULES.get(parts.hostname)
+    if rule is not None:
+        key = rule(parts)
+        if key is not None:
+            return key
+
+    scheme = parts.scheme.lower()
+    netloc = parts.hostname
+    if port is not None and port != DEFAULT_PORTS.get(scheme):
+        netloc += ":%d" % port
+    if parts.username is not None:
+        netloc = parts.netloc.rpartition("@")[0] + "@" + netloc
+
+    # Filter the raw query string instead of parsing and re-encoding it, so the
+    # remaining parameters keep their original encoding and order
+    query = "&".join(
+        param for param in parts.query.split("&") if param and not _is_tracking(param)
+    )
+    return urlparse.urlunsplit(
+        (scheme, netloc, parts.path or "/", query, parts.fragment)
+    )
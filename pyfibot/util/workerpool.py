@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""
+Bounded worker pool for module commands, handlers and events
+
+All module callables run in a dedicated threadpool instead of the reactor's
+shared one. Every module gets its own concurrency cap and a bounded queue of
+calls waiting for a free slot, so a single slow module can't starve the others.
+When a module's queue is full, new calls are dropped. With the "coalesce"
+policy, a call identical to one already waiting in the queue is merged into it
+instead of being queued again.
+
+Callables that never block (no network, disk or sleeping) can be marked with
+the @nonblocking decorator. They're called directly on the reactor thread,
+skipping the thread handoff altogether.
+"""
+
+import os.path
+import logging
+from typing import Any, Callable, Dict, Hashable, Optional
+
+from twisted.internet import defer, reactor, threads
+from twisted.python.threadpool import ThreadPool
+
+log = logging.getLogger("workerpool")
+
+POLICIES = ("drop", "coalesce")
+
+
+def nonblocking(func: Callable) -> Callable:
+    """Mark a module command, handler or event as safe to run on the reactor"""
+    func.nonblocking = True  # type: ignore[attr-defined]
+    return func
+
+
+class WorkerPool(object):
+    """Run module callables in a bounded threadpool with per-module limits"""
+
+    def __init__(
+        self,
+        size: int = 10,
+        max_per_module: int = 4,
+        max_queue: int = 50,
+        policy: str = "drop",
+        module_limits: Optional[Dict[str, int]] = None,
+    ) -> None:
+        if policy not in POLICIES:
+            raise ValueError("Unknown worker policy: %s" % policy)
+        self.size = size
+        self.max_per_module = max_per_module
+        self.max_queue = max_queue
+        self.policy = policy
+        self.module_limits = module_limits or {}
+        self.threadpool = ThreadPool(maxthreads=size, name="pyfibot-workers")
+        self._semaphores: Dict[str, defer.DeferredSemaphore] = {}
+        # module -> {call key: number of identical calls waiting}
+        self._waiting: Dict[str, Dict[Hashable, int]] = {}
+        self._counters: Dict[str, Dict[str, int]] = {}
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> "WorkerPool":
+        """Create a pool from the "workers" section of the bot config"""
+        conf = config.get("workers", {})
+        return cls(
+            size=conf.get("pool_size", 10),
+            max_per_module=conf.get("max_per_module", 4),
+            max_queue=conf.get("max_queue", 50),
+            policy=conf.get("policy", "drop"),
+            module_limits=conf.get("modules", {}),
+        )
+
+    def start(self) -> None:
+        if self.threadpool.started:
+            return
+        self.threadpool.start()
+        reactor.addSystemEventTrigger("during", "shutdown", self.stop)
+        log.info("worker pool started with %d threads", self.size)
+
+    def stop(self) -> None:
+        if self.threadpool.started:
+            self.threadpool.stop()
+
+    def _module_name(self, module: str) -> str:
+        return os.path.splitext(module)[0]
+
+    def _semaphore(self, module: str) -> defer.DeferredSemaphore:
+        sem = self._semaphores.get(module)
+        if sem is None:
+            limit = self.module_limits.get(
+                self._module_name(module), self.max_per_module
+            )
+            sem = self._semaphores[module] = defer.DeferredSemaphore(limit)
+            self._waiting[module] = {}
+            self._counters[module] = {
+                "run": 0,
+                "inline": 0,
+                "dropped": 0,
+                "coalesced": 0,
+            }
+        return sem
+
+    def _call_key(self, func: Callable, args: tuple, kwargs: Dict[str, Any]):
+        try:
+            key = (func, args, tuple(sorted(kwargs.items())))
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+    def run(self, module: str, func: Callable, *args, **kwargs) -> defer.Deferred:
+        """Run func(*args, **kwargs) in the pool on behalf of module.
+
+        Returns a Deferred firing with the result. Calls rejected by the
+        backpressure policy fire immediately with None.
+        """
+        sem = self._semaphore(module)
+        waiting = self._waiting[module]
+        counters = self._counters[module]
+
+        if getattr(func, "nonblocking", False):
+            counters["inline"] += 1
+            return defer.maybeDeferred(func, *args, **kwargs)
+
+        key = None
+        if self.policy == "coalesce" and not sem.tokens:
+            key = self._call_key(func, args, kwargs)
+            if key is not None and key in waiting:
+                counters["coalesced"] += 1
+                log.debug("coalesced call to %s in %s", func.__name__, module)
+                return defer.succeed(None)
+
+        if not sem.tokens and len(sem.waiting) >= self.max_queue:
+            counters["dropped"] += 1
+            log.warning(
+                "%s queue full (%d waiting), dropping call to %s",
+                module,
+                len(sem.waiting),
+                func.__name__,
+            )
+            return defer.succeed(None)
+
+        if key is not None:
+            waiting[key] = waiting.get(key, 0) + 1
+
+        def _start():
+            if key is not None:
+                waiting[key] -= 1
+                if not waiting[key]:
+                    del waiting[key]
+            counters["run"] += 1
+            return threads.deferToThreadPool(
+                reactor, self.threadpool, func, *args, **kwargs
+            )
+
+        return sem.run(_start)
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """Per-module counters and current running/queued call counts"""
+        result = {}
+        for module, sem in self._semaphores.items():
+            stats = dict(self._counters[module])
+            stats["running"] = sem.limit - sem.tokens
+            stats["queued"] = len(sem.waiting)
+            result[self._module_name(module)] = stats
+        return result
@@ -54,7 +54,10 @@ class BotMock(botcore.CoreCommands):
 
         return r
 
-    def say(self, channel, message, length=None):
+    def run_cpu(self, func, *args, timeout=None):
+        return func(*args)
+
+    def say(self, channel, message, length=None, priority=None):
         return (channel, message)
 
     def to_utf8(self, _string):
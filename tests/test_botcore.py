@@ -250,4 +250,75 @@ class TestBotMock:
         """Test BotMock say method"""
         bot = bot_mock.BotMock()
         result = bot.say("#channel", "test message")
-        assert result == ("#channel", "test message")
\ No newline at end of file
+        assert result == ("#channel", "test message")
+
+
+class TestDispatchIndex:
+    """Test the factory's command/handler dispatch index"""
+
+    def test_build_dispatch(self):
+        from pyfibot.pyfibot import PyFiBotFactory
+
+        def command_foo(bot, user, channel, args):
+            pass
+
+        def handle_privmsg(bot, user, channel, msg):
+            pass
+
+        factory = PyFiBotFactory({})
+        env = {
+            "command_foo": command_foo,
+            "handle_privmsg": handle_privmsg,
+            "handle_notafunction": "string",
+            "helper": command_foo,
+        }
+        factory.ns = {"module_test.py": (env, env)}
+        dispatch = factory._build_dispatch()
+
+        assert dispatch["command_foo"] == [("module_test.py", command_foo)]
+        assert dispatch["handle_privmsg"] == [("module_test.py", handle_privmsg)]
+        assert "handle_notafunction" not in dispatch
+        assert "helper" not in dispatch
+
+    def test_unload_removed_modules(self, tmp_path):
+        from pyfibot.pyfibot import PyFiBotFactory
+
+        def command_foo(bot, user, channel, args):
+            pass
+
+        factory = PyFiBotFactory({})
+        factory.moduledir = str(tmp_path)
+        env = {"command_foo": command_foo}
+        factory.ns = {"module_gone.py": (env, env)}
+        factory.dispatch = factory._build_dispatch()
+
+        factory._unload_removed_modules()
+
+        assert factory.ns == {}
+        assert "command_foo" not in factory.dispatch
+
+
+class TestUrlScan:
+    """Test the url pre-filter in privmsg"""
+
+    def test_privmsg_url_scan(self):
+        from pyfibot.botcore import PyFiBot
+        from pyfibot.pyfibot import PyFiBotFactory
+
+        bot = Mock()
+        bot.nickname = "pyfibot"
+        bot.cmdchar = "!"
+        bot.factory = PyFiBotFactory({})
+
+        PyFiBot.privmsg(bot, "nick!user@host", "#chan", "no links here, e.g. this")
+        PyFiBot.privmsg(bot, "nick!user@host", "#chan", "see http://example.com/")
+        PyFiBot.privmsg(bot, "nick!user@host", "#chan", "not really a://link")
+
+        assert bot.factory.url_scan_stats == {
+            "messages": 3,
+            "scanned": 2,
+            "with_urls": 1,
+        }
+        url_calls = [c for c in bot._runhandler.call_args_list if c[0][0] == "url"]
+        assert len(url_calls) == 1
+        assert url_calls[0][0][3] == "http://example.com/"
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+from pyfibot.util.circuitbreaker import CircuitBreaker
+
+
+def test_opens_after_failures():
+    breaker = CircuitBreaker(max_failures=3, reset_timeout=60)
+    for i in range(2):
+        breaker.failure("example.com")
+        assert breaker.allow("example.com")
+    breaker.failure("example.com")
+    assert not breaker.allow("example.com")
+    # Other hosts are unaffected
+    assert breaker.allow("example.org")
+    assert breaker.stats() == {"open": ["example.com"], "refused": 1}
+
+
+def test_success_resets_failures():
+    breaker = CircuitBreaker(max_failures=2)
+    breaker.failure("example.com")
+    breaker.success("example.com")
+    breaker.failure("example.com")
+    assert breaker.allow("example.com")
+
+
+def test_half_open():
+    breaker = CircuitBreaker(max_failures=1, reset_timeout=0)
+    breaker.failure("example.com")
+    assert breaker.state("example.com") == "open"
+
+    # A single probe is let through
+    assert breaker.allow("example.com")
+    assert breaker.state("example.com") == "half-open"
+
+    # Failed probe opens the circuit again
+    breaker.failure("example.com")
+    assert breaker.state("example.com") == "open"
+
+    assert breaker.allow("example.com")
+    breaker.success("example.com")
+    assert breaker.state("example.com") == "closed"
+
+
+def test_half_open_single_probe():
+    breaker = CircuitBreaker(max_failures=1, reset_timeout=60)
+    breaker.failure("example.com")
+    breaker._circuits["example.com"].opened_at -= 60
+    assert breaker.allow("example.com")
+    assert not breaker.allow("example.com")
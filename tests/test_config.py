@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+import os.path
+
+import yaml
+
+from pyfibot.pyfibot import validate_config
+
+EXAMPLE = os.path.join(os.path.dirname(__file__), "..", "example_full.yml")
+
+
+def test_example_full_is_valid():
+    with open(EXAMPLE) as f:
+        assert validate_config(yaml.safe_load(f))
+
+
+def test_network_line_options():
+    network = {"server": "irc.nerv.fi", "lineburst": 3, "linecoalesce": 0.5}
+    assert validate_config({"networks": {"nerv": network}})
+    network["lineburst"] = 0
+    assert not validate_config({"networks": {"nerv": network}})
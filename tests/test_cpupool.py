@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+
+import pytest
+
+from pyfibot.util.cpupool import CPUPool, PoolFull
+
+
+def fail():
+    raise ValueError("parse error")
+
+
+def test_inline():
+    pool = CPUPool(processes=0)
+    assert pool.run(os.getpid) == os.getpid()
+    with pytest.raises(ValueError):
+        pool.run(fail)
+    assert pool.stats()["inline"] == 2
+
+
+def test_from_config():
+    pool = CPUPool.from_config({"cpu": {"processes": 3, "max_pending": 5}})
+    assert pool.processes == 3
+    assert pool.max_pending == 5
+    assert pool.timeout == 30
+
+
+def test_run_in_worker_process():
+    pool = CPUPool(processes=1, preload=())
+    try:
+        assert pool.run(os.getpid) != os.getpid()
+        assert pool.run(divmod, 7, 2) == (3, 1)
+        with pytest.raises(ValueError):
+            pool.run(fail)
+    finally:
+        pool.stop()
+    stats = pool.stats()
+    assert stats["run"] == 3
+    assert stats["errors"] == 1
+
+
+def test_timeout_and_pool_full():
+    pool = CPUPool(processes=1, max_pending=1, preload=())
+    try:
+        # Wait for the worker to start
+        pool.run(abs, -1)
+        with pytest.raises(TimeoutError):
+            pool.run(time.sleep, 0.5, timeout=0.05)
+        # The sleep still takes the only slot
+        with pytest.raises(PoolFull):
+            pool.run(abs, -1)
+        deadline = time.time() + 5
+        while pool.stats()["pending"] and time.time() < deadline:
+            time.sleep(0.05)
+        assert pool.run(abs, -1) == 1
+    finally:
+        pool.stop()
+    stats = pool.stats()
+    assert stats["timeouts"] == 1
+    assert stats["rejected"] == 1
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+from twisted.internet.address import IPv4Address, IPv6Address
+
+from pyfibot.util.dnscache import DNSCache
+from pyfibot.pyfibot import PyFiBotFactory
+
+
+class FakeResolver(object):
+    """Resolves hosts in ADDRESSES when complete() is called"""
+
+    ADDRESSES = {
+        "irc.example.com": [
+            IPv4Address("TCP", "192.0.2.1", 0),
+            IPv6Address("TCP", "2001:db8::1", 0),
+        ]
+    }
+
+    def __init__(self):
+        self.waiting = []
+
+    def resolveHostName(self, receiver, hostName, portNumber=0):
+        receiver.resolutionBegan(None)
+        self.waiting.append((receiver, hostName))
+
+    def complete(self):
+        for receiver, host in self.waiting:
+            for address in self.ADDRESSES.get(host, []):
+                receiver.addressResolved(address)
+            receiver.resolutionComplete()
+        self.waiting = []
+
+
+def test_resolve_and_cache():
+    resolver = FakeResolver()
+    dns = DNSCache(resolver, ttl=60)
+    results = []
+    dns.resolve("irc.example.com").addCallback(results.append)
+    dns.resolve("irc.example.com").addCallback(results.append)
+    assert dns.cached("irc.example.com") is None
+    # Concurrent lookups share one resolution
+    assert len(resolver.waiting) == 1
+
+    resolver.complete()
+    assert results == [["192.0.2.1", "2001:db8::1"]] * 2
+    assert dns.cached("irc.example.com") == ["192.0.2.1", "2001:db8::1"]
+
+    dns.resolve("irc.example.com").addCallback(results.append)
+    assert len(results) == 3
+    assert resolver.waiting == []
+    assert dns.stats()["lookups"] == 1
+
+
+def test_resolve_failure():
+    resolver = FakeResolver()
+    dns = DNSCache(resolver)
+    results = []
+    dns.resolve("unknown.example.com").addCallback(results.append)
+    resolver.complete()
+    assert results == [[]]
+    # Failures aren't cached
+    assert dns.cached("unknown.example.com") is None
+    assert dns.stats()["failures"] == 1
+
+
+def test_network_factory():
+    factory = PyFiBotFactory({})
+    factory.allBots = {}
+    factory.dns = DNSCache(FakeResolver())
+    factory.createNetwork(("irc.example.com", 6667), "example", "pyfibot", None)
+    factory.createNetwork(("irc.example.org", 6667), "other", "pyfibot", None)
+
+    # Bots are built for the network of the factory without any resolving
+    address = IPv4Address("TCP", "198.51.100.1", 6667)
+    bot = factory.for_network("other").buildProtocol(address)
+    assert bot.network.alias == "other"
+    assert bot.factory is factory
+    assert factory.find_bot_for_network("other") is bot
+
+    # The shared factory can only find networks from resolved addresses
+    address = IPv4Address("TCP", "192.0.2.1", 6667)
+    assert not hasattr(factory.buildProtocol(address), "network")
+    factory.dns.resolve("irc.example.com")
+    factory.dns.resolver.complete()
+    assert factory.buildProtocol(address).network.alias == "example"
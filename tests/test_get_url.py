@@ -0,0 +1,306 @@
+# -*- coding: utf-8 -*-
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+import requests
+from twisted.internet import defer, reactor, task
+from twisted.trial import unittest
+
+from pyfibot.pyfibot import PyFiBotFactory
+from pyfibot.util.asynchttp import AsyncHTTPClient
+from pyfibot.util.httpcache import HTTPCache
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    body = b"<html><head><title>Test page</title></head><body></body></html>"
+
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        if self.path == "/etag" and self.headers.get("If-None-Match") == '"v1"':
+            self.send_response(304)
+            self.send_header("ETag", '"v1"')
+            self.end_headers()
+            return
+        if self.path == "/login":
+            self.send_response(302)
+            self.send_header("Set-Cookie", "login=1")
+            self.send_header("Location", "/")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        if self.path == "/slow":
+            self.send_response(200)
+            self.send_header("Content-Length", "1000")
+            self.end_headers()
+            try:
+                for i in range(100):
+                    self.wfile.write(b"x")
+                    self.wfile.flush()
+                    time.sleep(0.05)
+            except OSError:
+                self.server.aborted = True
+            return
+        if self.path == "/error":
+            self.send_response(503)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html")
+        self.send_header("Content-Length", str(len(self.body)))
+        self.send_header("Set-Cookie", "session=abc")
+        if self.path == "/maxage":
+            self.send_header("Cache-Control", "max-age=60")
+        elif self.path == "/etag":
+            self.send_header("ETag", '"v1"')
+        elif self.path == "/nocache":
+            self.send_header("Cache-Control", "max-age=0")
+        self.end_headers()
+        self.wfile.write(self.body)
+        self.server.seen_cookies.append(self.headers.get("Cookie"))
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = HTTPServer(("127.0.0.1", 0), Handler)
+    httpd.seen_cookies = []
+    httpd.requests = []
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def url(server, path="/"):
+    return "http://127.0.0.1:%d%s" % (server.server_port, path)
+
+
+def test_connections_are_reused(server):
+    factory = PyFiBotFactory({})
+    for i in range(3):
+        r = factory.get_url(url(server))
+        assert r.content == Handler.body
+
+    stats = factory.get_url_stats()
+    assert stats["requests"] == 3
+    assert stats["connections"] == 1
+
+
+def test_cookies_are_not_shared(server):
+    factory = PyFiBotFactory({})
+    factory.get_url(url(server)).content
+    factory.get_url(url(server), cookies={"mine": "1"}).content
+    factory.get_url(url(server)).content
+
+    assert server.seen_cookies == [None, "mine=1", None]
+
+
+def test_cookies_are_kept_within_redirects(server):
+    factory = PyFiBotFactory({})
+    factory.get_url(url(server, "/login")).content
+    factory.get_url(url(server)).content
+
+    assert server.seen_cookies == ["login=1", None]
+
+
+def test_fresh_response_is_cached(server):
+    factory = PyFiBotFactory({})
+    first = factory.get_url(url(server, "/maxage"))
+    assert first.content == Handler.body
+    second = factory.get_url(url(server, "/maxage"))
+    assert second.content == Handler.body
+    assert second.from_cache
+    assert server.requests == ["/maxage"]
+
+
+def test_nocache_bypasses_cache(server):
+    factory = PyFiBotFactory({})
+    factory.get_url(url(server, "/maxage"))
+    r = factory.get_url(url(server, "/maxage"), nocache=True)
+    assert r.content == Handler.body
+    assert server.requests == ["/maxage", "/maxage"]
+
+
+def test_stale_response_is_revalidated(server):
+    factory = PyFiBotFactory({})
+    factory.get_url(url(server, "/etag")).content
+    r = factory.get_url(url(server, "/etag"))
+    assert r.status_code == 200
+    assert r.content == Handler.body
+    assert server.requests == ["/etag", "/etag"]
+    assert factory.http_cache.stats()["revalidated"] == 1
+
+
+def test_uncacheable_response_is_not_stored(server):
+    factory = PyFiBotFactory({})
+    factory.get_url(url(server))
+    factory.get_url(url(server))
+    assert server.requests == ["/", "/"]
+    assert factory.http_cache.stats()["entries"] == 0
+
+
+def test_stale_response_without_validator_is_not_stored(server):
+    factory = PyFiBotFactory({})
+    factory.get_url(url(server, "/nocache")).content
+    assert factory.http_cache.stats()["entries"] == 0
+
+
+def test_partially_read_response_is_not_stored(server):
+    factory = PyFiBotFactory({})
+    r = factory.get_url(url(server, "/maxage"))
+    next(r.iter_content(16))
+    r.close()
+    assert factory.http_cache.stats()["entries"] == 0
+
+    factory.get_url(url(server, "/maxage")).content
+    assert factory.http_cache.stats()["entries"] == 1
+
+
+def test_revalidation_keeps_entry_headers():
+    from pyfibot.util.httpcache import CacheEntry, HTTPCache
+
+    cache = HTTPCache()
+    entry = CacheEntry(
+        "http://example.com/",
+        200,
+        {"Content-Length": "5", "ETag": '"v1"', "Content-Type": "text/html"},
+        b"hello",
+        0,
+    )
+    r = requests.Response()
+    r.status_code = 304
+    r.headers["Content-Length"] = "0"
+    r.headers["Cache-Control"] = "max-age=60"
+    cache.refresh("key", entry, r)
+
+    assert entry.headers["Content-Length"] == "5"
+    assert entry.headers["Content-Type"] == "text/html"
+    assert entry.headers["Cache-Control"] == "max-age=60"
+    assert entry.is_fresh()
+
+
+def test_disk_cache_is_bounded(tmp_path):
+    from pyfibot.util.httpcache import HTTPCache
+
+    path = str(tmp_path / "cache.db")
+    cache = HTTPCache(path=path, max_db_entries=3)
+    for i in range(5):
+        r = requests.Response()
+        r.status_code = 200
+        r.url = "http://example.com/%d" % i
+        r.headers["Content-Length"] = "5"
+        r.headers["Cache-Control"] = "max-age=%d" % (60 + i)
+        r._content = b"hello"
+        cache.store(HTTPCache.key(r.url), r)
+
+    # Trimmed when the file is opened
+    cache = HTTPCache(path=path, max_db_entries=3)
+    rows = cache._db.execute("SELECT url FROM responses ORDER BY url;").fetchall()
+    assert [url for url, in rows] == [
+        "http://example.com/2",
+        "http://example.com/3",
+        "http://example.com/4",
+    ]
+
+
+def test_cache_persists_to_disk(tmp_path):
+    from pyfibot.util.httpcache import HTTPCache
+
+    r = requests.Response()
+    r.status_code = 200
+    r.url = "http://example.com/"
+    r.headers["Content-Length"] = "5"
+    r.headers["Cache-Control"] = "max-age=60"
+    r._content = b"hello"
+
+    path = str(tmp_path / "cache.db")
+    key = HTTPCache.key(r.url)
+    HTTPCache(path=path).store(key, r)
+
+    cached = HTTPCache(path=path).lookup(key)
+    assert cached.content == b"hello"
+    assert cached.headers["Cache-Control"] == "max-age=60"
+
+
+def test_failed_url_is_not_refetched():
+    # Nothing listens on the port once the socket is closed
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+
+    factory = PyFiBotFactory({"http": {"breaker_failures": 2}})
+    dead = "http://127.0.0.1:%d/" % port
+    assert factory.get_url(dead) is None
+    assert factory.failed_urls.get(HTTPCache.key(dead)) is not None
+    assert factory.breaker.state("127.0.0.1") == "closed"
+    assert factory.get_url(dead) is None
+    assert factory.breaker.state("127.0.0.1") == "closed"
+
+
+def test_circuit_opens_for_failing_host(server):
+    factory = PyFiBotFactory({"http": {"breaker_failures": 2, "breaker_reset": 60}})
+    for i in range(2):
+        assert factory.get_url(url(server, "/error")).status_code == 503
+    assert factory.breaker.state("127.0.0.1") == "open"
+    # Refused without touching the server, even for urls that work
+    assert factory.get_url(url(server)) is None
+    assert server.requests == ["/error", "/error"]
+
+    # Half-open probe succeeds and closes the circuit
+    factory.breaker.reset_timeout = 0
+    assert factory.get_url(url(server)).status_code == 200
+    assert factory.breaker.state("127.0.0.1") == "closed"
+
+
+class TestFetch(unittest.TestCase):
+    """Non-blocking fetch, run under trial so the reactor spins"""
+
+    def setUp(self):
+        self.httpd = HTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.seen_cookies = []
+        self.httpd.requests = []
+        self.httpd.aborted = False
+        thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        thread.start()
+        self.client = AsyncHTTPClient(reactor)
+
+    @defer.inlineCallbacks
+    def tearDown(self):
+        yield self.client.close()
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    @defer.inlineCallbacks
+    def test_fetch(self):
+        r = yield self.client.fetch(url(self.httpd), params={"q": "x"})
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.content, Handler.body)
+        self.assertEqual(r.headers["content-type"], "text/html")
+        self.assertFalse(r.truncated)
+        self.assertEqual(self.httpd.requests, ["/?q=x"])
+
+    @defer.inlineCallbacks
+    def test_fetch_max_bytes(self):
+        r = yield self.client.fetch(url(self.httpd), max_bytes=10)
+        self.assertEqual(r.content, Handler.body[:10])
+        self.assertTrue(r.truncated)
+
+    @defer.inlineCallbacks
+    def test_timeout_stops_reading_body(self):
+        d = self.client.fetch(url(self.httpd, "/slow"), timeout=0.2)
+        yield self.assertFailure(d, defer.TimeoutError)
+        for i in range(40):
+            if self.httpd.aborted:
+                break
+            yield task.deferLater(reactor, 0.05, lambda: None)
+        self.assertTrue(self.httpd.aborted)
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+import fnmatch
+import random
+
+from pyfibot.modules import module_urltitle
+from pyfibot.util.globindex import GlobIndex, GlobSet
+
+URLS = [
+    "https://www.youtube.com/watch?v=abc",
+    "https://youtube.com/watch?feature=x&v=abc",
+    "https://youtu.be/abc",
+    "https://twitter.com/user/status/123",
+    "https://mobile.twitter.com/user/status/123",
+    "https://en.wikipedia.org/wiki/Python",
+    "https://i.imgur.com/abc.jpg",
+    "https://www.ebay.de/itm/123",
+    "https://ebay.com/itm/123",
+    "http://cgi.ebay.de/ws/eBayISAPI.dll?ViewItem&item=1",
+    "https://vimeo.com/123",
+    "https://stackoverflow.com/questions/1/foo",
+    "https://www.reddit.com/r/python/comments/abc/title",
+    "https://areena.yle.fi/1-123",
+    "https://store.steampowered.com/app/123/",
+    "https://www.nettiauto.com/audi/a4/123",
+    "http://ircquotes.fi/?123",
+    "https://example.com/",
+    "https://example.com/?q=wikipedia.org",
+    "not a url",
+]
+
+
+def test_matches_like_fnmatch():
+    handlers = [
+        (ref.__doc__.split()[0], name)
+        for name, ref in vars(module_urltitle).items()
+        if name.startswith("_handle_")
+    ]
+    index = GlobIndex(handlers)
+    assert len(index) == len(handlers)
+    for url in URLS:
+        expected = [name for pattern, name in handlers if fnmatch.fnmatch(url, pattern)]
+        assert index.match(url) == expected, url
+
+    # Unlike fnmatch, host patterns don't match other hosts' urls in the path
+    assert index.match("https://example.com/youtube.com/watch?v=1") == []
+
+
+def test_order_and_kinds():
+    index = GlobIndex(
+        [
+            ("*", "all"),
+            ("https://example.com/*", "exact"),
+            ("https://*.example.com/*", "suffix"),
+            ("http*://*example.*/*", "generic"),
+            ("https://*example.com/a*", "suffix-path"),
+        ]
+    )
+    assert index.match("https://example.com/a") == [
+        "all",
+        "exact",
+        "generic",
+        "suffix-path",
+    ]
+    assert index.match("https://www.example.com/b") == ["all", "suffix", "generic"]
+    assert index.match("https://example.org") == ["all"]
+    assert GlobIndex().match("https://example.com/") == []
+
+
+def ignored_by_loop(config, url, user):
+    """The ignore check handle_url used to do"""
+    for ignore in config.get("ignore", []):
+        if fnmatch.fnmatch(url, ignore):
+            return True
+    for ignore in config.get("ignore_urls", []):
+        if fnmatch.fnmatch(url, ignore):
+            return True
+    for ignore in config.get("ignore_users", []):
+        if fnmatch.fnmatch(user, ignore):
+            return True
+    return False
+
+
+def test_globset_matches_like_fnmatch_loop():
+    rng = random.Random(0)
+    parts = ["spam", ".com", "/", "http", "s", "://", "x", "!", "@", "."]
+    wildcards = ["*", "?", "[sp]", "[!x]", "[?]"]
+
+    def word():
+        return "".join(rng.choice(parts) for _ in range(rng.randint(1, 5)))
+
+    def pattern():
+        # Never just wildcards, those would match everything
+        glob = word()
+        for _ in range(rng.randint(0, 2)):
+            glob += rng.choice(wildcards) + word()
+        return "*" + glob if rng.random() < 0.3 else glob
+
+    config = {
+        "ignore": [pattern() for _ in range(50)] + ["https://example.com/exact"],
+        "ignore_urls": [pattern() for _ in range(200)],
+        "ignore_users": [pattern() for _ in range(50)] + ["nick!user@host"],
+    }
+    urls = GlobSet(config["ignore"] + config["ignore_urls"])
+    users = GlobSet(config["ignore_users"])
+
+    strings = [word() for _ in range(2000)]
+    strings += ["https://example.com/exact", "nick!user@host"]
+    matched = 0
+    for url, user in zip(strings, reversed(strings)):
+        expected = ignored_by_loop(config, url, user)
+        matched += expected
+        assert (urls.match(url) is not None or users.match(user) is not None) == (
+            expected
+        ), (url, user)
+    # Make sure both outcomes were tested
+    assert 0 < matched < len(strings)
+
+
+def test_globset_returns_matching_pattern():
+    patterns = GlobSet(["*spam.com*", "https://example.com/", "*eggs*"])
+    assert patterns.match("https://example.com/") == "https://example.com/"
+    assert patterns.match("http://eggs.spam.com/") == "*spam.com*"
+    assert patterns.match("http://eggs.com/") == "*eggs*"
+    assert patterns.match("http://example.org/") is None
+    assert GlobSet().match("anything") is None
+    assert GlobSet().match(None) is None
+    assert patterns.match(None) is None
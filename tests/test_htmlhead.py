@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+from pyfibot.util.htmlhead import HeadParser, charset_from_content_type, parse_head
+
+
+def test_parse_head():
+    head = parse_head(
+        b"<html><head><meta name='fragment' content='!'>"
+        b"<title>\n  Foo &amp; Bar </title>"
+        b'<meta property="og:title" content="Social &quot;Foo&quot;">'
+        b"</head><body><title>Not this</title></body></html>"
+    )
+    assert head.title == "\n  Foo & Bar "
+    assert head.og_title == 'Social "Foo"'
+    assert head.fragment == "!"
+    assert head.done
+
+
+def test_parse_head_missing():
+    head = parse_head(b"<html><body><p>No head here</p></body></html>")
+    assert head.title is None
+    assert head.og_title is None
+    assert head.fragment is None
+
+
+def test_unterminated_title():
+    assert parse_head(b"<html><head><title>Cut off").title == "Cut off"
+
+
+def test_stops_at_body():
+    parser = HeadParser()
+    assert not parser.feed_bytes(b"<html><title>Foo</title>" + b" " * 2000)
+    assert parser.feed_bytes(b"<body>")
+    assert parser.title == "Foo"
+
+
+def test_charset():
+    assert charset_from_content_type("text/html; charset=ISO-8859-1") == "ISO-8859-1"
+    assert charset_from_content_type("text/html") is None
+    assert charset_from_content_type(None) is None
+
+    page = "<head><title>Hyvää päivää</title></head>"
+    # From the HTTP headers
+    assert parse_head(page.encode("latin-1"), "iso-8859-1").title == "Hyvää päivää"
+    # From a meta tag
+    meta = '<meta http-equiv="Content-Type" content="text/html; charset=iso-8859-1">'
+    head = parse_head((meta + page).encode("latin-1"))
+    assert head.charset == "iso8859-1"
+    assert head.title == "Hyvää päivää"
+    # Defaults to utf-8
+    assert parse_head(page.encode("utf-8")).title == "Hyvää päivää"
+
+
+def test_split_multibyte():
+    """Characters split between chunks are decoded correctly"""
+    data = ("<title>" + "ä" * 1000 + "</title></head>").encode("utf-8")
+    parser = HeadParser("utf-8")
+    for i in range(0, len(data), 7):
+        parser.feed_bytes(data[i : i + 7])
+    parser.close()
+    assert parser.title == "ä" * 1000
+
+
+def test_undeclared_latin1():
+    page = "<head><title>Pöytä ja äiti</title></head>".encode("latin-1")
+    head = parse_head(page)
+    assert head.title == "Pöytä ja äiti"
+    assert head.charset == "cp1252"
+
+    # Invalid UTF-8 only after the first chunk
+    data = b"<head>" + b" " * 2000 + page
+    parser = HeadParser()
+    for i in range(0, len(data), 100):
+        parser.feed_bytes(data[i : i + 100])
+    parser.close()
+    assert parser.title == "Pöytä ja äiti"
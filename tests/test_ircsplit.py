@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from pyfibot.util.ircsplit import split
+
+
+def test_short_messages():
+    assert split("hello world", 400) == ["hello world"]
+    assert split("hyvää päivää", 400) == ["hyvää päivää"]
+    assert split("", 400) == []
+    assert split(" \n ", 400) == []
+    # Line breaks and trailing whitespace are cleaned up
+    assert split("hello\nworld \t", 400) == ["hello world"]
+
+
+def test_split_at_spaces():
+    assert split("aaaa bbbb cccc dddd", 10) == ["aaaa bbbb", "...cccc", "...dddd"]
+    assert split("aaaa    bbbb", 7) == ["aaaa", "...bbbb"]
+
+
+def test_split_by_bytes():
+    text = "ä" * 20
+    lines = split(text, 11)
+    # ä is two bytes, never split in the middle
+    assert lines == ["ä" * 5, "...ääää", "...ääää", "...ääää", "...äää"]
+    assert all(len(line.encode("utf-8")) <= 11 for line in lines)
+    assert "".join(line.lstrip(".") for line in lines) == text
+
+
+def test_split_finnish():
+    text = " ".join(["hyvää päivää öljyä säästä"] * 40)
+    lines = split(text, 400)
+    assert len(lines) > 1
+    assert all(len(line.encode("utf-8")) <= 400 for line in lines)
+    # 400 characters would be over the limit
+    assert len(text[:400].encode("utf-8")) > 400
+
+
+def test_too_small():
+    with pytest.raises(ValueError):
+        split("hello", 5)
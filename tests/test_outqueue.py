@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+from pyfibot.util import outqueue
+from pyfibot.util.outqueue import OutgoingScheduler, TokenBucket
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_classify():
+    assert outqueue.classify("PRIVMSG #Chan :hello") == (outqueue.REPLY, "#chan")
+    assert outqueue.classify("NOTICE nick :hi", outqueue.BULK) == (
+        outqueue.BULK,
+        "nick",
+    )
+    assert outqueue.classify("MODE #chan +o nick", outqueue.BULK) == (
+        outqueue.URGENT,
+        "",
+    )
+    assert outqueue.classify("PING :server") == (outqueue.URGENT, "")
+
+
+def test_token_bucket():
+    clock = Clock()
+    bucket = TokenBucket(2.0, burst=3, clock=clock)
+    assert [bucket.take() for i in range(3)] == [0, 0, 0]
+    assert bucket.take() == 2.0
+    clock.now = 1.0
+    assert bucket.take() == 1.0
+    clock.now = 2.0
+    assert bucket.take() == 0
+    # Tokens don't accumulate over burst
+    clock.now = 100.0
+    assert [bucket.take() for i in range(4)] == [0, 0, 0, 2.0]
+
+
+def test_priorities_and_fairness():
+    scheduler = OutgoingScheduler(0)
+    sent = []
+
+    assert scheduler.push("PRIVMSG #rss :item 1", outqueue.BULK)
+    # Drain is already scheduled
+    assert not scheduler.push("PRIVMSG #rss :item 2", outqueue.BULK)
+    scheduler.push("PRIVMSG #a :reply 1")
+    scheduler.push("PRIVMSG #a :reply 2")
+    scheduler.push("PRIVMSG #b :reply 3")
+    scheduler.push("KICK #b nick :bye")
+
+    assert scheduler.stats()["depth"] == {"": 1, "#a": 2, "#b": 1, "#rss": 2}
+    assert scheduler.drain(sent.append) is None
+    assert sent == [
+        "KICK #b nick :bye",
+        "PRIVMSG #a :reply 1",
+        "PRIVMSG #b :reply 3",
+        "PRIVMSG #a :reply 2",
+        "PRIVMSG #rss :item 1",
+        "PRIVMSG #rss :item 2",
+    ]
+    # Queue is empty, the next push schedules a drain again
+    assert scheduler.push("PRIVMSG #a :again")
+
+
+def test_rate_limit_and_wait_times():
+    clock = Clock()
+    scheduler = OutgoingScheduler(1.0, burst=2, clock=clock)
+    sent = []
+    for i in range(4):
+        scheduler.push("PRIVMSG #rss :item %d" % i, outqueue.BULK)
+
+    assert scheduler.drain(sent.append) == 1.0
+    assert len(sent) == 2
+
+    # A reply queued while the bulk output waits goes out first
+    clock.now = 0.5
+    scheduler.push("PRIVMSG #chan :reply")
+    clock.now = 1.0
+    assert scheduler.drain(sent.append) == 1.0
+    assert sent[-1] == "PRIVMSG #chan :reply"
+
+    clock.now = 3.0
+    assert scheduler.drain(sent.append) is None
+    assert len(sent) == 5
+
+    stats = scheduler.stats()
+    assert stats["queued"] == 0
+    assert stats["sent"] == {"urgent": 0, "reply": 1, "bulk": 4}
+    assert stats["wait_max"] == {"urgent": 0, "reply": 0.5, "bulk": 3.0}
+    assert stats["wait_avg"]["bulk"] == 1.5
+
+
+def test_coalesce():
+    clock = Clock()
+    scheduler = OutgoingScheduler(1.0, coalesce=0.5, max_line=40, clock=clock)
+    sent = []
+
+    scheduler.push("PRIVMSG #rss :item 1", outqueue.BULK)
+    scheduler.push("PRIVMSG #rss :item 2", outqueue.BULK)
+    scheduler.push("PRIVMSG #other :hello", outqueue.BULK)
+    scheduler.push("PRIVMSG #rss :\x01ACTION waves\x01", outqueue.BULK)
+    scheduler.push("PRIVMSG #rss :item 3", outqueue.BULK)
+    scheduler.push("PRIVMSG #rss :item 4", outqueue.BULK)
+    # Would make the line too long
+    scheduler.push("PRIVMSG #rss :item 5 is quite long", outqueue.BULK)
+    scheduler.push("MODE #rss +v nick")
+
+    # Only the mode is sent right away, messages wait for more to merge
+    assert scheduler.drain(sent.append) == 0.5
+    assert sent == ["MODE #rss +v nick"]
+
+    clock.now = 10.0
+    while scheduler.drain(sent.append) is not None:
+        clock.now += 1.0
+    assert sent[1:] == [
+        "PRIVMSG #rss :item 1 | item 2",
+        "PRIVMSG #other :hello",
+        "PRIVMSG #rss :\x01ACTION waves\x01",
+        "PRIVMSG #rss :item 3 | item 4",
+        "PRIVMSG #rss :item 5 is quite long",
+    ]
+    assert scheduler.stats()["coalesced"] == 2
+
+
+def test_urgent_during_hold():
+    clock = Clock()
+    scheduler = OutgoingScheduler(0, coalesce=2.0, clock=clock)
+    sent = []
+
+    assert scheduler.push("PRIVMSG #rss :item 1", outqueue.BULK)
+    assert scheduler.drain(sent.append) == 2.0
+    assert sent == []
+
+    clock.now = 0.5
+    # A reply held until after the scheduled call doesn't need an earlier one
+    assert not scheduler.push("PRIVMSG #chan :reply")
+    # An urgent line does
+    assert scheduler.push("MODE #chan +o nick")
+    assert scheduler.drain(sent.append) == 1.5
+    assert sent == ["MODE #chan +o nick"]
+
+    clock.now = 3.0
+    assert scheduler.drain(sent.append) is None
+    assert sent[1:] == ["PRIVMSG #chan :reply", "PRIVMSG #rss :item 1"]
+
+
+def test_coalesce_disabled():
+    scheduler = OutgoingScheduler(0)
+    sent = []
+    scheduler.push("PRIVMSG #rss :item 1")
+    scheduler.push("PRIVMSG #rss :item 2")
+    assert scheduler.drain(sent.append) is None
+    assert sent == ["PRIVMSG #rss :item 1", "PRIVMSG #rss :item 2"]
+    assert scheduler.stats()["coalesced"] == 0
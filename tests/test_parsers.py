@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+import os.path
+
+import pytest
+
+from pyfibot.util import parsers
+
+STATIC = os.path.join(os.path.dirname(__file__), "static")
+
+FMI_RESPONSE = """<?xml version="1.0" encoding="UTF-8"?>
+<wfs:FeatureCollection>
+  <gml:name>Helsinki Kaisaniemi</gml:name>
+  <wml2:MeasurementTimeseries gml:id="obs-obs-1-1-t2m">
+    <wml2:point><wml2:value>14.0</wml2:value></wml2:point>
+    <wml2:point><wml2:value>14.5</wml2:value></wml2:point>
+  </wml2:MeasurementTimeseries>
+  <wml2:MeasurementTimeseries gml:id="obs-obs-1-1-rh">
+    <wml2:point><wml2:value>NaN</wml2:value></wml2:point>
+  </wml2:MeasurementTimeseries>
+</wfs:FeatureCollection>
+"""
+
+
+def test_parse_head():
+    content = (
+        b"<html><head><title>Page title</title>"
+        b'<meta property="og:title" content="OG title">'
+        b'<meta name="fragment" content="!"></head></html>'
+    )
+    assert parsers.parse_head(content) == ("Page title", "OG title", "!")
+    assert parsers.parse_head(b"<html><body>text</body></html>") == (
+        None,
+        None,
+        None,
+    )
+
+
+def test_parse_feed():
+    with open(os.path.join(STATIC, "test_rss_init.xml"), "rb") as f:
+        title, items = parsers.parse_feed(f.read())
+    assert title == "Uutiset - Ampparit.com"
+    assert len(items) == 50
+    assert items[0] == {
+        "title": "Tuuli riepotteli Rosbergiakin (Yle)",
+        "link": "http://www.ampparit.com/redir.php?id=237104024",
+    }
+    # Urls aren't downloaded in the worker process
+    with pytest.raises(TypeError):
+        parsers.parse_feed("http://example.com/feed.xml")
+
+
+def test_parse_fmi_observations():
+    place, values = parsers.parse_fmi_observations(FMI_RESPONSE)
+    assert place == "Helsinki Kaisaniemi"
+    assert values == {"t2m": 14.5}
+
+
+def test_parse_fmi_observations_no_place():
+    assert parsers.parse_fmi_observations("<wfs:FeatureCollection/>") == (None, {})
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+from unittest.mock import Mock
+
+from twisted.internet import error
+from twisted.python.failure import Failure
+
+from pyfibot import pyfibot
+from pyfibot.pyfibot import PyFiBotFactory
+from pyfibot.util.reconnect import Backoff, NetworkHealth
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_backoff():
+    backoff = Backoff(min_delay=10, max_delay=100, jitter=0)
+    assert [backoff.delay(i) for i in range(6)] == [10, 20, 40, 80, 100, 100]
+
+    backoff = Backoff(min_delay=10, max_delay=100, jitter=0.5)
+    delays = [backoff.delay(2) for i in range(100)]
+    assert all(20 <= delay <= 40 for delay in delays)
+    assert len(set(delays)) > 1
+
+
+def test_server_rotation():
+    clock = Clock()
+    servers = [("irc1.example.com", 6667), ("irc2.example.com", 6697)]
+    health = NetworkHealth(servers, Backoff(jitter=0), clock)
+    assert health.connecting() == servers[0]
+
+    assert health.failed("Connection refused") == 10
+    assert health.stats() == {
+        "state": "waiting",
+        "server": "irc2.example.com:6697",
+        "attempts": 1,
+        "failures": 1,
+        "last_error": "Connection refused",
+        "connected_since": None,
+        "next_attempt": 1010.0,
+    }
+    assert health.connecting() == servers[1]
+    assert health.failed("Connection refused") == 20
+    assert health.connecting() == servers[0]
+
+
+def test_stable_connection_resets_backoff():
+    clock = Clock()
+    health = NetworkHealth([("irc.example.com", 6667)], Backoff(jitter=0), clock)
+    health.connecting()
+    health.connected()
+    # Dropped right away, keep backing off
+    assert health.lost("Connection lost") == 10
+    health.connecting()
+    health.connected()
+    assert health.lost("Connection lost") == 20
+
+    health.connecting()
+    health.connected()
+    clock.now += 60
+    assert health.lost("Connection lost") == 10
+    assert health.failures == 1
+
+
+def test_network_factory_reconnect():
+    factory = PyFiBotFactory({"reconnect": {"jitter": 0}})
+    factory.allBots = {}
+    factory.createNetwork(
+        ("irc1.example.com", 6667),
+        "example",
+        "pyfibot",
+        None,
+        servers=[("irc1.example.com", 6667), ("irc2.example.com", 6667)],
+    )
+    network_factory = factory.for_network("example")
+    assert factory.for_network("example") is network_factory
+
+    network_factory.health.connecting()
+    network_factory.clientConnectionFailed(
+        None, Failure(error.ConnectionRefusedError())
+    )
+    try:
+        assert network_factory._reconnect.active()
+        health = factory.network_health()["example"]
+        assert health["state"] == "waiting"
+        assert health["server"] == "irc2.example.com:6667"
+    finally:
+        network_factory.stop()
+    assert not network_factory._reconnect
+    assert factory.network_health()["example"]["state"] == "stopped"
+
+    # Bots that quit aren't reconnected
+    network_factory.health.connecting()
+    bot = network_factory.buildProtocol(None)
+    assert factory.network_health()["example"]["state"] == "connected"
+    bot.hasQuit = True
+    network_factory.clientConnectionLost(None, Failure(error.ConnectionDone()))
+    assert network_factory._reconnect is None
+    assert factory.find_bot_for_network("example") is None
+
+
+def test_factory_restart(monkeypatch):
+    """Starting the factory again after a reconnect doesn't add another
+    shutdown trigger, and a stopped factory has no bots"""
+    triggers = []
+
+    def add_trigger(*args):
+        triggers.append(args)
+        return len(triggers)
+
+    monkeypatch.setattr(pyfibot.reactor, "addSystemEventTrigger", add_trigger)
+    factory = PyFiBotFactory({})
+    factory.workers = Mock()
+    factory.cpu = Mock()
+    factory._loadmodules = Mock()
+    for _ in range(2):
+        factory.startFactory()
+        factory.stopFactory()
+    assert triggers == [("before", "shutdown", factory.http_client.close)]
+    assert factory.find_bot_for_network("nerv") is None
+    factory.control_received({"command": "join", "network": "nerv", "channel": "#a"})
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+import threading
+
+import pytest
+
+from pyfibot.util.singleflight import SingleFlight
+
+
+def run_concurrently(flight, key, func, count):
+    results, errors = [], []
+
+    def worker():
+        try:
+            results.append(flight.do(key, func))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker) for _ in range(count)]
+    for t in threads:
+        t.start()
+    return threads, results, errors
+
+
+def test_concurrent_calls_are_shared():
+    flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        release.wait(5)
+        return "title"
+
+    threads, results, errors = run_concurrently(flight, "url", fetch, 5)
+    # Wait until everybody is either running or waiting for the call
+    while flight.calls + flight.shared < 5:
+        pass
+    release.set()
+    for t in threads:
+        t.join()
+    assert calls == [1]
+    assert results == ["title"] * 5
+    assert flight.stats() == {"calls": 1, "shared": 4, "inflight": 0}
+
+    # Finished calls aren't cached
+    assert flight.do("url", lambda: "new title") == "new title"
+
+
+def test_errors_are_shared():
+    flight = SingleFlight()
+    release = threading.Event()
+
+    def fail():
+        release.wait(5)
+        raise ValueError("no title")
+
+    threads, results, errors = run_concurrently(flight, "url", fail, 3)
+    while flight.calls + flight.shared < 3:
+        pass
+    release.set()
+    for t in threads:
+        t.join()
+    assert results == []
+    assert [str(e) for e in errors] == ["no title"] * 3
+
+    with pytest.raises(ValueError):
+        flight.do("url", fail)
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+from unittest.mock import Mock
+
+from pyfibot.pyfibot import PyFiBotFactory
+from pyfibot.supervisor import ControlChannel, Supervisor
+
+CONFIG = {
+    "nick": "pyfibot",
+    "admins": [],
+    "networks": {
+        "nerv": {"server": "irc.nerv.fi"},
+        "ircnet": {"server": "irc.example.com"},
+        "quakenet": {"server": "irc.quakenet.org"},
+    },
+    "supervisor": {"groups": [["ircnet", "quakenet", "unknown"]]},
+}
+
+
+def test_control_channel():
+    received = []
+    channel = ControlChannel(received.append)
+    channel.dataReceived(b'{"command": "join", "network": "nerv"}\n{"comm')
+    channel.dataReceived(b'and": "rehash"}\nnot json\n["no", "command"]\n')
+    assert received == [{"command": "join", "network": "nerv"}, {"command": "rehash"}]
+
+
+def test_groups():
+    assert Supervisor.groups(CONFIG) == [["ircnet", "quakenet"], ["nerv"]]
+
+
+def test_route():
+    supervisor = Supervisor("config.yml", CONFIG)
+    grouped, nerv = supervisor.workers
+    assert nerv.name == "nerv"
+    for worker in supervisor.workers:
+        worker.transport = Mock(pid=1)
+        worker.send = Mock()
+
+    supervisor.route(nerv, {"command": "join", "network": "quakenet", "channel": "#a"})
+    grouped.send.assert_called_once_with(
+        {"command": "join", "network": "quakenet", "channel": "#a"}
+    )
+
+    # Broadcasts go to everyone else
+    supervisor.route(grouped, {"command": "rehash", "broadcast": True})
+    nerv.send.assert_called_once_with({"command": "rehash"})
+    assert grouped.send.call_count == 1
+
+    # Messages for networks without a running worker are dropped
+    nerv.transport = None
+    supervisor.route(grouped, {"command": "join", "network": "nerv"})
+    supervisor.route(grouped, {"command": "join", "network": "unknown"})
+    assert nerv.send.call_count == 1
+
+
+def test_factory_control():
+    factory = PyFiBotFactory(CONFIG)
+    factory.allBots = {}
+    factory.createNetwork(
+        ("irc.nerv.fi", 6667), "nerv", "pyfibot", "pyfibot", channels=["#pyfibot"]
+    )
+    bot = factory.allBots["nerv"] = Mock()
+    bot.network = factory.data["networks"]["nerv"]
+
+    # Without a supervisor there's nothing to forward to
+    assert not factory.forward("ircnet", "join", channel="#a")
+
+    factory.control = Mock()
+    assert factory.forward("ircnet", "join", channel="#a", key=None)
+    factory.control.send.assert_called_once_with(
+        {"command": "join", "network": "ircnet", "channel": "#a", "key": None}
+    )
+    # Local and unknown networks aren't forwarded
+    assert not factory.forward("nerv", "join", channel="#a")
+    assert not factory.forward("efnet", "join", channel="#a")
+
+    factory.broadcast("rehash", conf=False)
+    factory.control.send.assert_called_with(
+        {"command": "rehash", "conf": False, "broadcast": True}
+    )
+
+    factory.control_received({"command": "join", "network": "nerv", "channel": "#b"})
+    bot.join.assert_called_once_with("#b", key=None)
+    # The channel is added when the server confirms the join
+    assert bot.network.channels == ["#pyfibot"]
+    factory.control_received(
+        {"command": "part", "network": "nerv", "channel": "#pyfibot"}
+    )
+    bot.part.assert_called_once_with("#pyfibot")
+    assert bot.network.channels == []
+    factory.control_received({"command": "say", "network": "ircnet", "message": "x"})
+    assert not bot.say.called
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+from pyfibot.util import titlecache
+from pyfibot.util.titlecache import TitleCache
+
+
+def test_lru_eviction():
+    cache = TitleCache(capacity=2)
+    cache.put("a", "A")
+    cache.put("b", "B")
+    assert cache.get("a") == "A"
+    cache.put("c", "C")
+    # b was the least recently used
+    assert cache.get("b") is None
+    assert cache.get("a") == "A"
+    assert cache.get("c") == "C"
+    assert cache.stats() == {"entries": 2, "hits": 3, "misses": 1, "evictions": 1}
+
+
+def test_ttl():
+    cache = TitleCache(ttl=60)
+    cache.put("default", "title")
+    cache.put("short", "title", ttl=0)
+    assert cache.get("default") == "title"
+    assert cache.get("short") is None
+    assert cache.stats()["entries"] == 1
+
+
+def test_persistence(tmp_path):
+    path = str(tmp_path / "titles.db")
+    cache = TitleCache(path=path)
+    cache.put("url", ("title", "info"))
+    cache.put("expired", "title", ttl=0)
+
+    cache = TitleCache(path=path)
+    assert cache.get("url") == ("title", "info")
+    assert cache.get("expired") is None
+
+
+def test_persistence_capacity(tmp_path):
+    path = str(tmp_path / "titles.db")
+    cache = TitleCache(path=path)
+    for i in range(10):
+        cache.put("url%d" % i, "title", ttl=100 + i)
+
+    cache = TitleCache(capacity=3, path=path)
+    assert [cache.get("url%d" % i) for i in (6, 7, 8, 9)] == [
+        None,
+        "title",
+        "title",
+        "title",
+    ]
+
+
+def test_shared_survives_reconfigure():
+    cache = titlecache.shared("test", capacity=10)
+    cache.put("url", "title")
+    again = titlecache.shared("test", capacity=5, ttl=10)
+    assert again is cache
+    # Looking the cache up doesn't change it
+    assert again.capacity == 10
+    again.configure(capacity=5, ttl=10)
+    assert again.capacity == 5
+    assert again.get("url") == "title"
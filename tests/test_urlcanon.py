@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+from pyfibot.util.urlcanon import canonicalize
+
+
+def test_normalization():
+    assert canonicalize("HTTPS://Example.COM:443/Path") == "https://example.com/Path"
+    assert canonicalize("http://example.com:80") == "http://example.com/"
+    assert canonicalize("http://example.com:8080/") == "http://example.com:8080/"
+    assert canonicalize("http://user@Example.com/") == "http://user@example.com/"
+
+
+def test_tracking_params():
+    assert (
+        canonicalize("https://example.com/a?utm_source=x&id=1&fbclid=abc&UTM_Medium=y")
+        == "https://example.com/a?id=1"
+    )
+    assert canonicalize("https://example.com/a?si=x") == "https://example.com/a"
+    # Remaining parameters are left as they were
+    assert (
+        canonicalize("https://example.com/?q=a%20b&b=2&a=1")
+        == "https://example.com/?q=a%20b&b=2&a=1"
+    )
+    assert canonicalize("https://example.com/#!/page") == "https://example.com/#!/page"
+
+
+def test_youtube():
+    urls = [
+        "https://www.youtube.com/watch?v=dQw4w9WgXcQ&feature=share",
+        "https://youtu.be/dQw4w9WgXcQ",
+        "http://youtube.com/watch?v=dQw4w9WgXcQ",
+        "https://m.youtube.com/watch?feature=youtu.be&v=dQw4w9WgXcQ",
+        "https://www.youtube.com/shorts/dQw4w9WgXcQ",
+        "https://youtu.be/dQw4w9WgXcQ?si=abcdef&t=10",
+    ]
+    assert {canonicalize(url) for url in urls} == {"youtube:dQw4w9WgXcQ"}
+    # Not a video
+    assert (
+        canonicalize("https://www.youtube.com/channel/abc")
+        == "https://www.youtube.com/channel/abc"
+    )
+
+
+def test_unparseable():
+    assert canonicalize("not a url") == "not a url"
+    assert canonicalize("http://example.com:port/") == "http://example.com:port/"
@@ -47,6 +47,80 @@ def test_levenshtein_distance():
     assert distance("abc", "def") == 3
     assert distance("kitten", "sitting") == 3
 
+    # Bounded, anything over the limit is reported as limit + 1
+    assert distance("kitten", "sitting", 3) == 3
+    assert distance("kitten", "sitting", 2) == 3
+    assert distance("kitten", "sitting", 0) == 1
+    assert distance("a" * 100, "b", 5) == 6
+    assert distance("abcdef", "abcdeg", 1) == 1
+
+
+def test_read_head():
+    """Test that only the beginning of a page is read for the title"""
+    import io
+    import requests
+
+    read_head = module_urltitle.__read_head
+    head = b"<html><head><title>Foo</title></head>"
+    body = b"<body>" + b"x" * 100000 + b"</body></html>"
+
+    r = requests.Response()
+    r.raw = io.BytesIO(head + body)
+    content = read_head(r)
+    assert content.startswith(head)
+    assert len(content) < 8192 + len(head)
+    assert r.raw.closed
+
+    # No </head> in sight, give up after the byte budget once there's a title
+    r = requests.Response()
+    r.raw = io.BytesIO(b"<html><title>Foo</title>" + b"x" * 100000)
+    assert len(read_head(r, max_bytes=1000)) == 8192
+
+    # Without a title keep going, up to the limit
+    r = requests.Response()
+    r.raw = io.BytesIO(b"<html>" + b"x" * 100000)
+    assert len(read_head(r, max_bytes=1000, limit=50000)) == 50000
+
+    # Already downloaded (cached) responses are read the same way
+    r = requests.Response()
+    r._content = head + body
+    r._content_consumed = True
+    assert read_head(r, max_bytes=len(head)) == (head + body)[:8192]
+
+
+def test_get_head_long_head():
+    """The title is found in a head longer than HEAD_MAX_BYTES"""
+    import io
+    import requests
+
+    page = (
+        b"<html><head>"
+        + b'<script>var x = "%s";</script>' % (b"x" * 70000)
+        + b"<title>Late title</title></head><body>text</body></html>"
+    )
+    r = requests.Response()
+    r.status_code = 200
+    r.headers["content-type"] = "text/html"
+    r.raw = io.BytesIO(page)
+    bot = Mock()
+    bot.run_cpu.side_effect = lambda func, *args: func(*args)
+    with patch.object(module_urltitle, "__get_response", lambda bot, url: r):
+        head = module_urltitle.__get_head(bot, "http://example.com/")
+    assert head.title == "Late title"
+
+    # Titles outside the head are found by the fallback parser
+    r = requests.Response()
+    r.status_code = 200
+    r.headers["content-type"] = "text/html"
+    r.raw = io.BytesIO(
+        b"<html><head><meta charset=utf-8></head><body>"
+        + b"<p>%s</p>" % (b"x" * 70000)
+        + b"<title>Body title</title></body></html>"
+    )
+    with patch.object(module_urltitle, "__get_response", lambda bot, url: r):
+        head = module_urltitle.__get_head(bot, "http://example.com/")
+    assert head.title == "Body title"
+
 
 def test_escaped_fragment():
     """Test Google escaped fragment URL transformation"""
@@ -134,7 +208,7 @@ class TestUrlTitleCoreLogic:
         assert call_args.endswith("...")
 
     def test_title_function_caching(self):
-        """Test that titles are cached when URL is provided"""
+        """Test that titles are cached when a cache key is provided"""
         bot = self.create_mock_bot()
         bot.say.return_value = ("channel", "message")
         
@@ -145,7 +219,7 @@ class TestUrlTitleCoreLogic:
         title = "Test Title"
         
         # Call with URL should cache the result
-        result = module_urltitle._title(bot, "#test", title, url=url)
+        result = module_urltitle._title(bot, "#test", title, key=url)
         
         # Check that title was cached
         cached_title = module_urltitle.cache.get(url)
@@ -197,4 +271,64 @@ class TestUrlTitleEndToEnd:
         
         for url in spotify_urls:
             result = module_urltitle.handle_url(self.bot, "user", "#channel", url, url)
-            assert result is None
\ No newline at end of file
+            assert result is None
+
+    def test_fragment_page_cached_under_posted_url(self):
+        """A page with a fragment meta tag is cached under the posted url"""
+        url = "http://example.com/page"
+        heads = {
+            url: Mock(fragment="!", og_title=None, title="Loading..."),
+            url + "?_escaped_fragment_=": Mock(
+                fragment=None, og_title=None, title="Today's news at Example"
+            ),
+        }
+        module_urltitle.cache.clear()
+        with patch.object(module_urltitle, "__get_head", lambda bot, u: heads[u]):
+            module_urltitle.handle_url(self.bot, "user", "#channel", url, url)
+
+        assert module_urltitle.cache.get(url) == "Today's news at Example"
+
+    def test_get_head_pool_full_or_timeout(self):
+        """A full process pool parses the head inline, a timeout gives up"""
+        from pyfibot.util.cpupool import PoolFull
+
+        r = Mock(headers={"content-type": "text/html"}, _content_consumed=True)
+        r.content = b"<html><body><p>x</p><title>Late title</title></body></html>"
+        get_head = getattr(module_urltitle, "__get_head")
+        with patch.object(module_urltitle, "__get_response", lambda bot, u: r):
+            self.bot.run_cpu.side_effect = PoolFull("full")
+            assert get_head(self.bot, "http://example.com").title == "Late title"
+            self.bot.run_cpu.side_effect = TimeoutError("timed out")
+            assert get_head(self.bot, "http://example.com") is None
+
+
+def test_rehash_keeps_title_cache(tmp_path):
+    """Loading the module again on rehash doesn't shrink the persistent cache"""
+    import bot_mock
+    from pyfibot.util import titlecache
+
+    path = str(tmp_path / "titles.db")
+    bot = bot_mock.BotMock(
+        {"module_urltitle": {"cache_size": 5000, "cache_path": path}}
+    )
+    with open(module_urltitle.__file__) as f:
+        source = f.read()
+
+    titlecache._caches.pop("urltitle", None)
+    try:
+        for rehash in range(2):
+            # Like PyFiBotFactory._loadmodules
+            env = {}
+            exec(source, env, env)
+            env["init"](bot)
+            if not rehash:
+                for i in range(3000):
+                    env["cache"].put("http://example.com/%d" % i, "title")
+
+        cache = titlecache.shared("urltitle")
+        assert cache.capacity == 5000
+        assert cache.stats()["entries"] == 3000
+        rows = cache._db.execute("SELECT COUNT(*) FROM titles;").fetchone()[0]
+        assert rows == 3000
+    finally:
+        titlecache._caches.pop("urltitle", None)
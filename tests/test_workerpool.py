@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from pyfibot.util.workerpool import WorkerPool, nonblocking
+
+
+def noop(*args):
+    pass
+
+
+def fired(d):
+    """True if the deferred has a result available"""
+    result = []
+    d.addBoth(result.append)
+    return bool(result)
+
+
+# The pool is never started, so calls that get a slot stay running forever.
+# This makes the queueing deterministic without a running reactor.
+
+
+def test_drop_when_queue_full():
+    pool = WorkerPool(max_per_module=1, max_queue=1)
+    calls = [pool.run("module_test.py", noop, i) for i in range(3)]
+
+    assert [fired(d) for d in calls] == [False, False, True]
+    stats = pool.stats()["module_test"]
+    assert stats["running"] == 1
+    assert stats["queued"] == 1
+    assert stats["dropped"] == 1
+
+
+def test_per_module_limit():
+    pool = WorkerPool(max_per_module=1, module_limits={"module_fast": 3})
+    for i in range(3):
+        pool.run("module_fast.py", noop, i)
+        pool.run("module_slow.py", noop, i)
+
+    stats = pool.stats()
+    assert stats["module_fast"]["running"] == 3
+    assert stats["module_slow"]["running"] == 1
+    assert stats["module_slow"]["queued"] == 2
+
+
+def test_coalesce_identical_waiting_calls():
+    pool = WorkerPool(max_per_module=1, policy="coalesce")
+    pool.run("module_test.py", noop, "running")
+    first = pool.run("module_test.py", noop, "same")
+    second = pool.run("module_test.py", noop, "same")
+    other = pool.run("module_test.py", noop, "other")
+
+    assert not fired(first)
+    assert fired(second)
+    assert not fired(other)
+    stats = pool.stats()["module_test"]
+    assert stats["coalesced"] == 1
+    assert stats["queued"] == 2
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        WorkerPool(policy="explode")
+
+
+def test_nonblocking_runs_inline():
+    pool = WorkerPool(max_per_module=1)
+
+    @nonblocking
+    def handle_fast(value):
+        return value * 2
+
+    d = pool.run("module_test.py", handle_fast, 21)
+    result = []
+    d.addCallback(result.append)
+    assert result == [42]
+    assert pool.stats()["module_test"]["inline"] == 1
+    assert pool.stats()["module_test"]["running"] == 0